@@ -6,12 +6,88 @@ from toga.style import Pack
 from toga.style.pack import COLUMN, ROW
 import toga_chart
 import numpy as np
-import csv
+import asyncio
 import os
+import time
 
 import matplotlib.pyplot as pyplot
 pyplot.ion
 
+class SpectrumModel:
+    """
+    A spectrum loaded from a CSV file, and the state of its plot. The file is
+    only read once; the chart is redrawn from the arrays held here.
+    """
+    def __init__(self, path, wavenumber, absorbance):
+        self.path = path
+        self.filename = os.path.basename(path)
+        self.wavenumber = wavenumber
+        self.absorbance = absorbance
+
+        self.bkgd_lowlim = wavenumber[-1]
+        self.bkgd_highlim = wavenumber[0]
+        self.excl_lowlim = np.median(wavenumber)
+        self.excl_highlim = np.median(wavenumber)
+
+        self.ylim = (np.min(absorbance), np.max(absorbance))
+        self.__decimated = {}
+
+    def decimated(self, n_columns):
+        """
+        Returns the (wavenumber, absorbance) points needed to draw the
+        spectrum 'n_columns' pixels wide: the first, lowest, highest and last
+        point of each column. The chart's renderer draws paths point by point,
+        so this is much faster than drawing every point, and looks the same.
+        The result is cached, since resizing tends to revisit the same widths.
+        """
+        n_columns = max(int(n_columns), 1)
+        if n_columns not in self.__decimated:
+            if len(self.__decimated) >= 32:
+                self.__decimated.clear()
+            x = self.wavenumber
+            y = self.absorbance
+            if len(x) <= 4 * n_columns:
+                self.__decimated[n_columns] = (x, y)
+            else:
+                starts = np.unique(np.linspace(0, len(x), n_columns + 1).astype(int)[:-1])
+                ends = np.append(starts[1:], len(x)) - 1
+                xs = np.column_stack((x[starts], x[starts], x[starts], x[ends])).ravel()
+                ys = np.column_stack((y[starts], np.minimum.reduceat(y, starts),
+                                      np.maximum.reduceat(y, starts), y[ends])).ravel()
+                self.__decimated[n_columns] = (xs, ys)
+        return self.__decimated[n_columns]
+
+    def lim_lines(self):
+        """
+        Returns (x position, colour) of each of the limit lines.
+        """
+        return [(self.bkgd_lowlim, 'g'), (self.bkgd_highlim, 'g'),
+                (self.excl_lowlim, 'r'), (self.excl_highlim, 'r')]
+
+
+class FrameTimer:
+    """
+    Keeps track of how long the chart takes to draw.
+    """
+    def __init__(self):
+        self.n_frames = 0
+        self.total = 0.0
+        self.worst = 0.0
+        self.last = 0.0
+
+    def record(self, elapsed):
+        self.n_frames += 1
+        self.total += elapsed
+        self.worst = max(self.worst, elapsed)
+        self.last = elapsed
+
+    def summary(self):
+        if not self.n_frames:
+            return "No frames drawn yet"
+        return "Frame time: last %.1f ms, mean %.1f ms, max %.1f ms (%d frames)" % (
+            self.last * 1e3, self.total / self.n_frames * 1e3, self.worst * 1e3, self.n_frames)
+
+
 class FTIRBackgroundSubtract(toga.App):
 
     def startup(self):
@@ -56,13 +132,23 @@ class FTIRBackgroundSubtract(toga.App):
                                             multiple_select=False,
                                             on_result=self.appWindows)
 
-    def appWindows(self, window, path):
+    async def appWindows(self, window, path):
         """ Creates two windows: the plotting window, where the CSV file is plotted, and the anlaysis
-        window, where the analytical controls and buttons are placed.
+        window, where the analytical controls and buttons are placed. The CSV file is then read in
+        the background, and the chart is drawn once it has loaded.
         """
+        if path is None:
+            return
 
         self.path = path
         self.filename = os.path.basename(path)
+        self.model = None
+        self.frame_timer = FrameTimer()
+        # (created first, since the chart can be drawn as soon as it is shown)
+        self.frame_time_label = toga.Label(
+            self.frame_timer.summary(),
+            style=Pack(padding=(0.5))
+        )
 
         """
         MAIN (PLOTTING) WINDOW
@@ -120,51 +206,62 @@ class FTIRBackgroundSubtract(toga.App):
         # add elements to the main window
         analysis_box.add(analysis_label)
         analysis_box.add(testPrintPath_label)
+        analysis_box.add(self.frame_time_label)
 
         # add content and show window
         analysis_window.content = analysis_box
         analysis_window.show()
+
+        # read the file without blocking the GUI
+        loop = asyncio.get_running_loop()
+        try:
+            wavenumber, absorbance = await loop.run_in_executor(None, self.readCSV, path)
+        except (OSError, ValueError) as e:
+            self.main_window.error_dialog("FTIR Background Subtract",
+                                          "Could not read %s: %s" % (self.filename, e))
+            return
+        self.model = SpectrumModel(path, wavenumber, absorbance)
+        self.chart.redraw()
     
     def readCSV(self, path):
-        reader = csv.reader(open(path, "rt"), dialect="excel") 
+        with open(path, "rb") as ifp:
+            data = np.loadtxt(ifp, delimiter=",", usecols=(0, 1), dtype=np.float64, ndmin=2)
 
-        wavenumber = []
-        absorbance = []
-
-        for line in reader:
-            wavenumber.append(float(line[0]))
-            absorbance.append(float(line[1]))
-        
-        return np.array(wavenumber), np.array(absorbance)
+        return np.ascontiguousarray(data[:, 0]), np.ascontiguousarray(data[:, 1])
     
     def plotData(self, chart, figure, *args, **kwargs):
-        """Use toga_chart to plot up the CSV data
+        """Use toga_chart to plot up the CSV data. toga_chart gives us a new figure every time the
+        chart is drawn (e.g. on every resize), so this only builds the plot from the arrays that
+        were loaded by appWindows.
         """
-        # read in CSV data
-        wavenumber, absorbance = self.readCSV(self.path)
-        self.bkgd_lowlim = wavenumber[-1]
-        self.bkgd_highlim = wavenumber[0]
-        self.excl_lowlim = np.median(wavenumber)
-        self.excl_highlim = np.median(wavenumber)
+        start = time.perf_counter()
+        figure.canvas.mpl_connect('draw_event', lambda event: self.on_chart_drawn(start))
 
         ax = figure.add_subplot(1, 1, 1)
-        ax.plot(wavenumber, absorbance, "-")
 
         # Set plot styling
         ax.invert_xaxis()
         ax.set_xlabel("Wavenumber")
         ax.set_ylabel("Absorbance")
-        ax.set_title(self.filename)
 
-        # add DraggableLines
-        ax.cla()
-        self.lim_line1 = DraggableLine(self.bkgd_lowlim, ax, color='g')
-        self.lim_line2 = DraggableLine(self.bkgd_highlim, ax, color='g')
-        self.excl_line1 = DraggableLine(self.excl_lowlim, ax, color='r')
-        self.excl_line2 = DraggableLine(self.excl_highlim, ax, color='r')
+        if self.model is None:
+            ax.set_title("Loading " + self.filename + "...")
+            return ax
+        ax.set_title(self.model.filename)
+
+        wavenumber, absorbance = self.model.decimated(figure.bbox.width)
+        ax.plot(wavenumber, absorbance, "-")
+
+        # add the limit lines
+        for x_pos, color in self.model.lim_lines():
+            ax.plot([x_pos]*2, self.model.ylim, linewidth=2.0, color=color)
 
         return ax
 
+    def on_chart_drawn(self, start):
+        self.frame_timer.record(time.perf_counter() - start)
+        self.frame_time_label.text = self.frame_timer.summary()
+
 
 class BackgroundRangeSelector:
     def __init__(self, ax):
@@ -3,10 +3,21 @@ ftir-background-subtract
 
 A GUI tool for drawing polynomial backgrounds on FTIR spectra and subtracting
 them to get total absorbance (by height) of a desired peak.
+
+The numerical code is in FTIRbackgroundsubtract.compute, which only needs
+numpy. The GUI (FTIRbackgroundsubtract.core) is only imported when it is
+first used, since importing it loads wxPython and matplotlib.
 """
 
 __version__ = "1.2.0"
 __author__ = 'Kayla Iacovino and Nial Peters'
 
 # ----------------- IMPORTS ----------------- #
-import FTIRbackgroundsubtract.core
+import importlib
+
+
+def __getattr__(name):
+    #import the GUI and compute modules lazily
+    if name in ('core', 'compute'):
+        return importlib.import_module('FTIRbackgroundsubtract.' + name)
+    raise AttributeError("module 'FTIRbackgroundsubtract' has no attribute %r"%name)
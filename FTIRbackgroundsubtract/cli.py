@@ -0,0 +1,660 @@
+"""
+Command line batch processor. Fits backgrounds to many spectra in parallel
+and writes the peak heights to a single CSV table, e.g.:
+
+    ftir-bkgd-batch spectra/ --band 2400,4000,2590,3788,1,3500 -o results.csv
+    ftir-bkgd-batch 'spectra/*.CSV' --all-presets -o results.csv
+
+Each spectrum is processed in a separate worker process (one per core by
+default). A failure on one file is recorded in its rows of the table rather
+than stopping the run.
+
+With --db, results are also kept in an SQLite database (see
+compute.results), and spectra that have already been fitted with the same
+bands are read from it rather than being fitted again:
+
+    ftir-bkgd-batch spectra/ --all-presets --db results.sqlite -o results.csv
+
+Results are streamed to the output as they arrive, with only a few chunks
+of files in flight at once, so the memory used doesn't grow with the number
+of spectra. --memory-budget (in MB) limits the number of workers and the
+size of the chunks further, for very large collections on small machines.
+
+Compressed spectra (e.g. .csv.gz) are read without decompressing them
+first. A tar or zip archive of spectra is handed to one worker as a single
+task, which reads it in one pass and fits each spectrum in it as it comes;
+its rows name the spectra as archive/member:
+
+    ftir-bkgd-batch session1.tar.gz session2.zip --preset 3500 -o results.csv
+"""
+import argparse
+import collections
+import concurrent.futures
+import csv
+import glob
+import itertools
+import os
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    #not available on Windows
+    resource = None
+
+from FTIRbackgroundsubtract.compute.archive import (archive_sizes, is_archive_filename,
+                                                   iter_archive, strip_compression)
+from FTIRbackgroundsubtract.compute.bands import Band, PRESETS, get_preset, process_bands
+from FTIRbackgroundsubtract.compute.loader import is_spectrum_filename, parse_spectrum
+from FTIRbackgroundsubtract.compute.results import ResultsStore, band_key, file_digest
+
+PROGRESS_INTERVAL = 0.25 #seconds
+
+RESULT_COLUMNS = ('file', 'band', 'peak_height', 'bkgd_lowlim', 'bkgd_highlim',
+                  'excl_lowlim', 'excl_highlim', 'bkgd_fit_order', 'n_ignored',
+                  'error')
+
+#number of results written to the database in each transaction
+DB_COMMIT_ROWS = 1000
+
+MB = 1024 * 1024
+
+#rough memory use, for planning a run with --memory-budget: an idle
+#process with numpy loaded, the working memory of fitting a spectrum per
+#byte of its file, and a result row waiting to be written
+PARENT_BASE_MEMORY = 48 * MB
+WORKER_BASE_MEMORY = 40 * MB
+SPECTRUM_MEMORY_FACTOR = 18
+ROW_MEMORY = 2048
+
+#decompressed size per byte of a compressed file, assumed when planning
+#memory for files whose decompressed size isn't recorded (text spectra
+#typically compress by about this much)
+COMPRESSION_RATIO = 4
+
+
+def parse_band(s):
+    """
+    Parses a --band argument of the form
+    'low,high,excl_low,excl_high,order[,name]'.
+    """
+    fields = [f.strip() for f in s.split(',')]
+    if len(fields) not in (5, 6):
+        raise argparse.ArgumentTypeError("expected low,high,excl_low,excl_high,order[,name], "
+                                         "got %r" % s)
+    try:
+        lims = [float(f) for f in fields[:4]]
+        order = int(fields[4])
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid number in band %r" % s)
+
+    if not lims[0] < lims[2] <= lims[3] < lims[1]:
+        raise argparse.ArgumentTypeError("band %r must satisfy low < excl_low <= excl_high < high" % s)
+    if order < 0:
+        raise argparse.ArgumentTypeError("fit order must not be negative in band %r" % s)
+
+    name = fields[5] if len(fields) == 6 else None
+    return Band(*lims, bkgd_fit_order=order, name=name)
+
+
+def find_spectra(paths):
+    """
+    Expands a list of files, directories and glob patterns into a sorted
+    list of spectrum filenames with no duplicates. Directories are searched
+    recursively for files that loader.is_spectrum_filename() accepts and
+    for archives of spectra.
+    """
+    filenames = set()
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, dirnames, files in os.walk(path):
+                for f in files:
+                    if is_spectrum_filename(f) or is_archive_filename(f):
+                        filenames.add(os.path.join(dirpath, f))
+        elif os.path.isfile(path):
+            filenames.add(path)
+        else:
+            matches = [m for m in glob.glob(path, recursive=True) if os.path.isfile(m)]
+            if not matches:
+                print("warning: no spectra found for %r" % path, file=sys.stderr)
+            filenames.update(matches)
+    return sorted(filenames)
+
+
+def process_file(filename, bands, fit_options, stored=None):
+    """
+    Fits every band to one spectrum. Returns (filename, pid, elapsed time,
+    rows), where rows has one dict per band. Errors are reported in the
+    'error' column instead of being raised, so that one bad file can't stop
+    a batch. If the file could be read, each row also has the 'hash' of the
+    contents that were parsed and the 'mtime_ns' and 'size' of the file,
+    for the results database. Archives are passed on to process_archive(),
+    with 'stored'.
+    """
+    if is_archive_filename(filename):
+        return process_archive(filename, bands, fit_options, stored)
+
+    t0 = time.perf_counter()
+    try:
+        with open(filename, 'rb') as ifp:
+            st = os.fstat(ifp.fileno())
+            data = ifp.read()
+    except OSError as e:
+        rows = [_result_row(filename, band, error=e) for band in bands]
+        return filename, os.getpid(), time.perf_counter() - t0, rows
+
+    try:
+        results = process_bands(*parse_spectrum(data), bands, **fit_options)
+    except ValueError as e:
+        rows = [_result_row(filename, band, error=e) for band in bands]
+    else:
+        rows = _band_rows(filename, results)
+    digest = file_digest(data)
+    for row in rows:
+        row.update(hash=digest, mtime_ns=st.st_mtime_ns, size=st.st_size)
+
+    return filename, os.getpid(), time.perf_counter() - t0, rows
+
+
+def process_archive(filename, bands, fit_options, stored=None):
+    """
+    Fits every band to each spectrum in a tar or zip archive, reading the
+    archive in one pass. Returns (filename, pid, elapsed time, rows) as
+    process_file() does, with the rows of each spectrum in turn, named
+    'archive/member'. Each row also has the 'hash' of its spectrum's
+    contents and the 'mtime_ns' and 'size' of the archive, for the results
+    database. If the archive can't be read, the rows for the archive itself
+    give the error.
+
+    'stored' may be a set of the hashes of spectra whose results for all of
+    the bands are in the database already. They aren't fitted again, and
+    their rows only have the file, band, hash, mtime_ns and size, with
+    'stored' set to True.
+    """
+    t0 = time.perf_counter()
+    rows = []
+    try:
+        st = os.stat(filename)
+        for name, data in iter_archive(filename, is_spectrum_filename):
+            member = os.path.join(filename, name)
+            digest = file_digest(data)
+            if stored is not None and digest in stored:
+                member_rows = [dict(_result_row(member, band), stored=True) for band in bands]
+            else:
+                try:
+                    results = process_bands(*parse_spectrum(data), bands, **fit_options)
+                except ValueError as e:
+                    member_rows = [_result_row(member, band, error=e) for band in bands]
+                else:
+                    member_rows = _band_rows(member, results)
+            for row in member_rows:
+                row.update(hash=digest, mtime_ns=st.st_mtime_ns, size=st.st_size)
+            rows.extend(member_rows)
+    except (OSError, ValueError) as e:
+        rows.extend(_result_row(filename, band, error=e) for band in bands)
+
+    return filename, os.getpid(), time.perf_counter() - t0, rows
+
+
+def _band_rows(filename, results):
+    #the rows of the BandResults of one spectrum
+    return [_result_row(filename, r.band, r.peak_height, r.n_ignored, r.error,
+                        bkgd_func=r.bkgd_func, ignored_idxs=r.ignored_idxs,
+                        iterations=r.iterations, converged=r.converged, fit_time=r.fit_time)
+            for r in results]
+
+
+def _result_row(filename, band, peak_height=None, n_ignored=None, error=None, bkgd_func=None,
+                ignored_idxs=None, iterations=None, converged=None, fit_time=None):
+    #the keys that aren't in RESULT_COLUMNS are only for the results database
+    if error is not None and not isinstance(error, str):
+        error = "%s: %s" % (type(error).__name__, error)
+    return {'file': filename,
+            'band': band.name,
+            'peak_height': None if peak_height is None else float(peak_height),
+            'bkgd_lowlim': band.bkgd_lowlim,
+            'bkgd_highlim': band.bkgd_highlim,
+            'excl_lowlim': band.excl_lowlim,
+            'excl_highlim': band.excl_highlim,
+            'bkgd_fit_order': band.bkgd_fit_order,
+            'n_ignored': n_ignored,
+            'error': error,
+            'coeffs': None if bkgd_func is None else bkgd_func.coeffs,
+            'ignored_idxs': ignored_idxs,
+            'iterations': iterations,
+            'converged': converged,
+            'fit_time': fit_time}
+
+
+def _process_chunk(tasks, fit_options):
+    return [process_file(filename, bands, fit_options, stored)
+            for filename, bands, stored in tasks]
+
+
+def _stored_row(filename, band, result):
+    #a CSV row from a result in the ResultsStore
+    return _result_row(filename, band, result['peak_height'], result['n_ignored'],
+                       result['error'])
+
+
+def plan_memory(filenames, n_bands, workers, memory_budget):
+    """
+    Works out how to process 'filenames' in 'memory_budget' bytes. Returns
+    (workers, chunk_memory, max_pending): the number of worker processes
+    that fit in the budget (at most 'workers'), the estimated memory of the
+    results of a chunk of files and the number of chunks that may be in
+    flight at once. Raises ValueError if even one worker won't fit.
+    """
+    largest = max((_spectrum_sizes(f)[0] for f in filenames), default=0)
+    worker_memory = WORKER_BASE_MEMORY + SPECTRUM_MEMORY_FACTOR * largest
+    available = memory_budget - PARENT_BASE_MEMORY
+    if available < worker_memory + _result_memory(largest, n_bands):
+        raise ValueError("a memory budget of %.0f MB is too small to fit the largest spectrum, "
+                         "which needs about %.0f MB"
+                         % (memory_budget / MB, (PARENT_BASE_MEMORY + worker_memory) / MB))
+
+    #give the workers what they need, and the rest to the results in flight
+    workers = max(1, min(workers, int(available * 0.9 // worker_memory)))
+    max_pending = 2 * workers
+    chunk_memory = (available - workers * worker_memory) // max_pending
+    return workers, max(chunk_memory, _result_memory(largest, n_bands)), max_pending
+
+
+def _file_size(filename):
+    try:
+        return os.path.getsize(filename)
+    except OSError:
+        return 0
+
+
+def _spectrum_sizes(filename):
+    #(largest, total) decompressed size of the spectra in a file, which is
+    #estimated with COMPRESSION_RATIO if it isn't recorded
+    size = _file_size(filename)
+    if is_archive_filename(filename):
+        sizes = archive_sizes(filename)
+        if sizes is not None:
+            return sizes
+        #a compressed tar file may hold just one spectrum
+        if strip_compression(filename) != filename or not filename.lower().endswith('.tar'):
+            size *= COMPRESSION_RATIO
+    elif strip_compression(filename) != filename:
+        size *= COMPRESSION_RATIO
+    return size, size
+
+
+def _result_memory(size, n_bands):
+    #estimated memory of the result rows of a file of 'size' bytes, whose
+    #ignored point indices take up to about half as much as the text
+    return n_bands * (ROW_MEMORY + size // 2)
+
+
+def _count_chunks(tasks, chunksize):
+    #splits the tasks into lists of 'chunksize'
+    for i in range(0, len(tasks), chunksize):
+        yield tasks[i:i + chunksize]
+
+
+def _memory_chunks(tasks, chunk_memory, chunksize):
+    #splits the tasks into lists whose results are estimated to need no
+    #more than 'chunk_memory' bytes (but at least one file each), and of
+    #no more than 'chunksize' files
+    chunk = []
+    used = 0
+    for task in tasks:
+        need = _result_memory(_spectrum_sizes(task[0])[1], len(task[1]))
+        if chunk and (used + need > chunk_memory or len(chunk) >= chunksize):
+            yield chunk
+            chunk = []
+            used = 0
+        chunk.append(task)
+        used += need
+    if chunk:
+        yield chunk
+
+
+def run_batch(filenames, bands, fit_options, workers=None, chunksize=None, progress=True,
+              file_bands=None, memory_budget=None, stored=None):
+    """
+    Processes the files in a pool of 'workers' processes (defaults to the
+    number of cores) and yields the results of process_file() in the same
+    order as 'filenames'. Files are handed to the workers 'chunksize' at a
+    time, which defaults to giving each worker about four chunks.
+
+    'file_bands' may be a list (the same length as 'filenames') of the bands
+    to fit to each file, to use instead of 'bands'. 'stored' is passed on
+    to process_archive() for the archives.
+
+    Each file is loaded, fitted and measured in a worker, and only its
+    result rows are sent back. Only a few chunks are in flight at once, and
+    no more are submitted until the caller has consumed the results of the
+    oldest, so a slow writer holds back the workers rather than letting the
+    results pile up. If 'memory_budget' (bytes) is given, the number of
+    workers and the size of the chunks are chosen to stay within it (see
+    plan_memory()), and 'chunksize' is ignored. The chunks are then no
+    bigger than they would be without a budget, so that all of the
+    planned workers are used.
+    """
+    if not filenames:
+        return
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(filenames)))
+    if file_bands is None:
+        file_bands = [bands] * len(filenames)
+    tasks = [(filename, b, stored if is_archive_filename(filename) else None)
+             for filename, b in zip(filenames, file_bands)]
+
+    if memory_budget is not None:
+        n_bands = max(len(b) for b in file_bands)
+        workers, chunk_memory, max_pending = plan_memory(filenames, n_bands, workers,
+                                                         memory_budget)
+        #still give each of the planned workers about four chunks, however
+        #much memory they may use
+        chunks = _memory_chunks(tasks, chunk_memory, max(1, len(filenames) // (4 * workers)))
+    else:
+        if chunksize is None:
+            chunksize = max(1, len(filenames) // (4 * workers))
+        max_pending = 2 * workers
+        chunks = _count_chunks(tasks, chunksize)
+
+    if workers == 1:
+        #no point paying for process startup and pickling
+        executor = None
+        results = (r for chunk in chunks for r in _process_chunk(chunk, fit_options))
+    else:
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+        results = _bounded_map(executor, _process_chunk, chunks, max_pending, fit_options)
+
+    try:
+        t0 = time.perf_counter()
+        last_report = t0
+        for i, result in enumerate(results, 1):
+            now = time.perf_counter()
+            #limit the progress updates to a few per second
+            if progress and (now - last_report > PROGRESS_INTERVAL or i == len(filenames)):
+                last_report = now
+                print("\r%d/%d files (%.1f files/s)" % (i, len(filenames), i / max(now - t0, 1e-9)),
+                      end='', file=sys.stderr, flush=True)
+            yield result
+        if progress:
+            print(file=sys.stderr)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+
+def _bounded_map(executor, func, chunks, max_pending, *args):
+    #like executor.map() over the chunks, flattening the lists that func
+    #returns, but with no more than max_pending chunks submitted at once
+    pending = collections.deque()
+    chunks = iter(chunks)
+    for chunk in itertools.islice(chunks, max_pending):
+        pending.append(executor.submit(func, chunk, *args))
+    while pending:
+        results = pending.popleft().result()
+        for chunk in itertools.islice(chunks, 1):
+            pending.append(executor.submit(func, chunk, *args))
+        yield from results
+
+
+def peak_rss():
+    """
+    Returns the peak resident memory (bytes) of this process and of the
+    largest of its finished child processes, or None where the platform
+    doesn't report it.
+    """
+    if resource is None:
+        return None, None
+    #ru_maxrss is in kB on Linux but in bytes on macOS
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale)
+
+
+def print_worker_summary(worker_stats, wall_time, stream=sys.stderr):
+    """
+    Prints the number of files, busy time and throughput of each worker
+    process. 'worker_stats' maps pid to [n_files, busy_time].
+    """
+    total_files = sum(n for n, busy in worker_stats.values())
+    print("%d files in %.2f s (%.1f files/s) using %d worker(s)"
+          % (total_files, wall_time, total_files / max(wall_time, 1e-9), len(worker_stats)),
+          file=stream)
+    for pid, (n_files, busy) in sorted(worker_stats.items()):
+        print("  pid %-8d %6d files %8.2f s busy %8.1f files/s"
+              % (pid, n_files, busy, n_files / max(busy, 1e-9)), file=stream)
+
+
+def add_band_arguments(parser):
+    """
+    Adds the options that choose the bands to fit and how to fit them,
+    which are shared with the other commands. See get_bands() and
+    get_fit_options().
+    """
+    parser.add_argument('-b', '--band', dest='bands', action='append', type=parse_band,
+                        default=[], metavar='LOW,HIGH,EXCL_LOW,EXCL_HIGH,ORDER[,NAME]',
+                        help="background limits, excluded peak window and fit order of a "
+                             "band to measure (may be given more than once)")
+    parser.add_argument('-p', '--preset', dest='presets', action='append', default=[],
+                        choices=list(PRESETS),
+                        help="measure one of the GUI's suggested bands (may be given more "
+                             "than once)")
+    parser.add_argument('--all-presets', action='store_true',
+                        help="measure all of the preset bands")
+    parser.add_argument('--threshold', type=float, default=5.0,
+                        help="outlier rejection threshold in standard errors (default: 5)")
+    parser.add_argument('--batch-reject', action='store_true',
+                        help="reject all outliers above the threshold in each pass")
+    parser.add_argument('--max-iterations', type=int, default=10000,
+                        help="maximum number of outlier rejection passes")
+
+
+def get_bands(parser, args):
+    """
+    Returns the list of Bands chosen by the options from
+    add_band_arguments(), exiting with an error if there are none.
+    """
+    if args.all_presets:
+        args.presets = list(PRESETS)
+    bands = [get_preset(name) for name in args.presets] + args.bands
+    if not bands:
+        parser.error("no bands given, use --band, --preset or --all-presets")
+    return bands
+
+
+def get_fit_options(args):
+    """
+    Returns the keyword arguments for process_file_bands() chosen by the
+    options from add_band_arguments().
+    """
+    return {'bkgd_threshold': args.threshold,
+            'bkgd_batch_reject': args.batch_reject,
+            'bkgd_max_iterations': args.max_iterations}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='ftir-bkgd-batch',
+        description="Fit polynomial backgrounds to a batch of FTIR spectra and "
+                    "write the background-subtracted peak heights to a CSV table.")
+    parser.add_argument('paths', nargs='+', metavar='PATH',
+                        help="spectrum files, directories or glob patterns")
+    add_band_arguments(parser)
+    parser.add_argument('-o', '--output', default='-',
+                        help="output CSV file (default: stdout)")
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help="number of worker processes (default: number of cores)")
+    parser.add_argument('--chunksize', type=int, default=None,
+                        help="number of files sent to a worker at a time")
+    parser.add_argument('--db', default=None,
+                        help="SQLite database to store the results in. Spectra and bands "
+                             "that are already in it are not fitted again")
+    parser.add_argument('--recompute', action='store_true',
+                        help="fit everything again, replacing the results in the database")
+    parser.add_argument('--memory-budget', type=float, default=None, metavar='MB',
+                        help="keep the run within about this many MB, by limiting the "
+                             "number of workers and the results in flight")
+    parser.add_argument('-q', '--quiet', action='store_true',
+                        help="don't report progress, worker throughput or memory use")
+    args = parser.parse_args(argv)
+    bands = get_bands(parser, args)
+
+    filenames = find_spectra(args.paths)
+    if not filenames:
+        parser.error("no spectra found")
+
+    memory_budget = None
+    if args.memory_budget is not None:
+        memory_budget = args.memory_budget * MB
+        try:
+            workers, chunk_memory, max_pending = plan_memory(
+                filenames, len(bands), args.workers or os.cpu_count() or 1, memory_budget)
+        except ValueError as e:
+            parser.error(str(e))
+        if not args.quiet:
+            print("memory budget %.0f MB: %d worker(s), up to %d chunks of %.1f MB of results "
+                  "in flight" % (args.memory_budget, workers, max_pending, chunk_memory / MB),
+                  file=sys.stderr)
+
+    fit_options = get_fit_options(args)
+
+    store = None
+    digests = {}
+    done = {}
+    stored = None
+    if args.db is not None:
+        store = ResultsStore(args.db)
+        if not args.recompute:
+            done = store.completed(bands, fit_options)
+            #the spectra in archives are only skipped if they have all of
+            #the bands, so that an archive's rows are all fitted or all not
+            all_keys = set(band_key(b) for b in bands)
+            stored = set(digest for digest, keys in done.items() if keys == all_keys)
+        for filename in filenames:
+            if is_archive_filename(filename):
+                #the spectra in archives are stored by their own hashes, which
+                #aren't known until the archive is read
+                continue
+            #files that are new or have changed are hashed by the worker that
+            #reads them
+            try:
+                digest = store.cached_hash(filename)
+            except OSError:
+                #the worker will report the error
+                continue
+            if digest is not None:
+                digests[filename] = digest
+
+    #only send the workers the bands that aren't in the database yet
+    todo_files = []
+    todo_bands = []
+    for filename in filenames:
+        have = done.get(digests.get(filename), ())
+        todo = [b for b in bands if band_key(b) not in have]
+        if todo:
+            todo_files.append(filename)
+            todo_bands.append(todo)
+
+    if args.output == '-':
+        ofp = sys.stdout
+    else:
+        ofp = open(args.output, 'w', newline='')
+
+    worker_stats = collections.defaultdict(lambda: [0, 0.0])
+    n_errors = 0
+    pending = []
+    pending_files = []
+    n_stored_members = 0
+    t0 = time.perf_counter()
+    try:
+        writer = csv.DictWriter(ofp, fieldnames=RESULT_COLUMNS, extrasaction='ignore')
+        writer.writeheader()
+        results = run_batch(todo_files, bands, fit_options, args.workers, args.chunksize,
+                            progress=not args.quiet, file_bands=todo_bands,
+                            memory_budget=memory_budget, stored=stored)
+        todo_files = set(todo_files)
+        for filename in filenames:
+            fitted = {}
+            if filename in todo_files:
+                _, pid, elapsed, new_rows = next(results)
+                worker_stats[pid][0] += 1
+                worker_stats[pid][1] += elapsed
+                if is_archive_filename(filename):
+                    #all of the rows of the spectra in the archive
+                    fitted = None
+                    if store is not None:
+                        pending.extend(dict(row, band=band)
+                                       for band, row in zip(itertools.cycle(bands), new_rows)
+                                       if 'hash' in row and not row.get('stored'))
+                        #record the spectra in the archive, so the results can
+                        #be found by their names
+                        pending_files.extend((row['file'], row['hash'], row['mtime_ns'], row['size'])
+                                             for row in new_rows[::len(bands)] if 'hash' in row)
+                else:
+                    new_bands = [b for b in bands
+                                 if band_key(b) not in done.get(digests.get(filename), ())]
+                    for band, row in zip(new_bands, new_rows):
+                        fitted[band_key(band)] = row
+                        if store is not None and 'hash' in row:
+                            pending.append(dict(row, band=band))
+                    if store is not None and 'hash' in new_rows[0]:
+                        row = new_rows[0]
+                        pending_files.append((filename, row['hash'], row['mtime_ns'], row['size']))
+                if len(pending) >= DB_COMMIT_ROWS:
+                    store.put_files(pending_files)
+                    store.put_many(pending, fit_options)
+                    pending = []
+                    pending_files = []
+
+            if fitted is None:
+                #the spectra in the archive that weren't fitted again
+                n_stored_members += sum(1 for row in new_rows if row.get('stored')) // len(bands)
+                rows = [_stored_row(row['file'], band, store.get(row['hash'], band, fit_options))
+                        if row.get('stored') else row
+                        for band, row in zip(itertools.cycle(bands), new_rows)]
+            else:
+                rows = []
+                for band in bands:
+                    row = fitted.get(band_key(band))
+                    if row is None:
+                        row = _stored_row(filename, band,
+                                          store.get(digests[filename], band, fit_options))
+                    rows.append(row)
+            writer.writerows(rows)
+            n_errors += sum(1 for r in rows if r['error'])
+        #let run_batch() finish, which shuts down the workers
+        next(results, None)
+    finally:
+        if ofp is not sys.stdout:
+            ofp.close()
+        if store is not None:
+            if pending_files:
+                store.put_files(pending_files)
+            if pending:
+                store.put_many(pending, fit_options)
+            store.close()
+
+    if not args.quiet and store is not None:
+        print("%d of %d files already in %s" % (len(filenames) - len(todo_files), len(filenames),
+                                                args.db), file=sys.stderr)
+        if n_stored_members:
+            print("%d spectra in archives already in %s" % (n_stored_members, args.db),
+                  file=sys.stderr)
+    if not args.quiet:
+        print_worker_summary(worker_stats, time.perf_counter() - t0)
+        parent_rss, child_rss = peak_rss()
+        if parent_rss is not None:
+            msg = "peak RSS %.1f MB" % (parent_rss / MB)
+            if worker_stats and os.getpid() not in worker_stats:
+                msg += " (largest worker %.1f MB)" % (child_rss / MB)
+            print(msg, file=sys.stderr)
+    if n_errors:
+        print("%d band fit(s) failed, see the 'error' column" % n_errors, file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,32 @@
+"""
+The numerical parts of ftir-background-subtract. These only need numpy, so
+they can be used without a display and without importing wxPython or
+matplotlib.
+"""
+from FTIRbackgroundsubtract.compute.scan import ProcessedScan, find_residuals, load_ftir_file
+from FTIRbackgroundsubtract.compute.loader import load_spectrum, parse_spectrum
+from FTIRbackgroundsubtract.compute.archive import iter_archive
+from FTIRbackgroundsubtract.compute.fitting import fit_backgrounds, fit_with_rejection, polynomial_residuals
+from FTIRbackgroundsubtract.compute.moments import PrefixMoments
+from FTIRbackgroundsubtract.compute.cache import SpectrumCache
+from FTIRbackgroundsubtract.compute.bands import Band, PRESETS, process_bands, process_file_bands
+from FTIRbackgroundsubtract.compute.decimate import minmax_decimate, thin_error_bars
+from FTIRbackgroundsubtract.compute.concentration import SPECIES, batch_concentrations, concentration
+from FTIRbackgroundsubtract.compute.absorptivity import AbsorptivityDatabase, get_default_database
+from FTIRbackgroundsubtract.compute.metrics import PeakMetrics, peak_metrics
+from FTIRbackgroundsubtract.compute.uncertainty import peak_uncertainty
+from FTIRbackgroundsubtract.compute.cube import Cube, map_cube, open_envi
+
+__all__ = ['ProcessedScan', 'find_residuals', 'load_ftir_file',
+           'load_spectrum', 'parse_spectrum',
+           'iter_archive',
+           'fit_backgrounds', 'fit_with_rejection', 'polynomial_residuals',
+           'PrefixMoments',
+           'SpectrumCache',
+           'Band', 'PRESETS', 'process_bands', 'process_file_bands',
+           'minmax_decimate', 'thin_error_bars',
+           'SPECIES', 'batch_concentrations', 'concentration',
+           'AbsorptivityDatabase', 'get_default_database',
+           'PeakMetrics', 'peak_metrics',
+           'peak_uncertainty',
+           'Cube', 'map_cube', 'open_envi']
@@ -0,0 +1,230 @@
+"""
+A small database of published molar absorptivities (L/mol/cm) of the
+volatile bands of silicate glasses, for use with compute.concentration.
+
+Each entry records the band, species, glass type, source and either a
+constant value or a function of the glass composition. The entries are held
+in arrays sorted by band position, so range queries are binary searches.
+Entries are matched to samples by the distance between compositions on a
+total alkali-silica diagram (SiO2 vs Na2O + K2O, in wt%). Composition
+dependent values are evaluated on arrays, so a whole batch of samples is
+handled at once.
+
+Compositions are dicts of oxide wt%, whose values may be scalars or arrays
+(one value per sample).
+"""
+import numpy
+
+
+#molar masses of the oxides (g/mol) per cation
+NA2O_PER_NA = 61.979 / 2.0
+CAO_PER_CA = 56.077
+
+#entries whose band is within this distance (cm-1) of the requested band
+#are considered to be the same band
+BAND_TOLERANCE = 60.0
+
+
+def na_fraction(composition):
+    """
+    Returns the molar Na/(Na+Ca) of 'composition' (a dict of oxide wt%
+    with 'Na2O' and 'CaO').
+    """
+    na = numpy.asarray(composition['Na2O'], dtype=float) / NA2O_PER_NA
+    ca = numpy.asarray(composition['CaO'], dtype=float) / CAO_PER_CA
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        return na / (na + ca)
+
+
+def dixon_pan_1995(composition):
+    """
+    Absorptivity of the carbonate doublet (1515 and 1430 cm-1) in basaltic
+    glasses as a function of composition (Dixon and Pan, 1995):
+
+        epsilon = 451 - 342 * Na/(Na+Ca)
+    """
+    return 451.0 - 342.0 * na_fraction(composition)
+
+
+class AbsorptivityEntry:
+    """
+    One published absorptivity.
+
+        * band - band position (cm-1)
+        * species - species name (see compute.concentration.SPECIES)
+        * glass - glass type the calibration applies to, e.g. 'basalt'
+        * source - reference
+        * epsilon - the absorptivity (L/mol/cm), or None if 'formula' is given
+        * formula - function of a composition dict returning the absorptivity
+        * sio2, alkalis - approximate SiO2 and Na2O + K2O (wt%) of the
+                          calibration glasses, used to find the nearest entry
+        * requires - oxides that 'formula' needs
+    """
+    def __init__(self, band, species, glass, source, epsilon=None, formula=None,
+                 sio2=None, alkalis=None, requires=()):
+        if (epsilon is None) == (formula is None):
+            raise ValueError("Give either epsilon or formula")
+        self.band = band
+        self.species = species
+        self.glass = glass
+        self.source = source
+        self.epsilon = epsilon
+        self.formula = formula
+        self.sio2 = sio2
+        self.alkalis = alkalis
+        self.requires = tuple(requires)
+
+    def __repr__(self):
+        return "AbsorptivityEntry(%g, %r, %r, %r)" % (self.band, self.species, self.glass, self.source)
+
+    def describe(self):
+        if self.formula is not None:
+            value = "composition dependent"
+        else:
+            value = "%g L/mol/cm" % self.epsilon
+        return "%g cm-1  %s  %s  %s  (%s)" % (self.band, self.species, self.glass, value, self.source)
+
+    def evaluate(self, composition=None):
+        """
+        Returns the absorptivity, for each sample of 'composition' if it is
+        composition dependent.
+        """
+        if self.formula is None:
+            return self.epsilon
+        if composition is None or any(o not in composition for o in self.requires):
+            raise ValueError("%s needs the %s content of the glass"
+                             % (self.describe(), " and ".join(self.requires)))
+        return self.formula(composition)
+
+
+#calibration compositions are approximate averages of the glasses used
+ENTRIES = (
+    AbsorptivityEntry(3550, 'H2O', 'basalt', "Dixon et al. (1995)", epsilon=63.0,
+                      sio2=50.5, alkalis=3.0),
+    AbsorptivityEntry(1630, 'H2Om', 'basalt', "Dixon et al. (1995)", epsilon=25.0,
+                      sio2=50.5, alkalis=3.0),
+    AbsorptivityEntry(1515, 'CO3', 'basalt', "Dixon et al. (1995)", epsilon=375.0,
+                      sio2=50.5, alkalis=3.0),
+    AbsorptivityEntry(1430, 'CO3', 'basalt', "Dixon et al. (1995)", epsilon=375.0,
+                      sio2=50.5, alkalis=3.0),
+    AbsorptivityEntry(4500, 'OH', 'basalt', "Dixon et al. (1995)", epsilon=0.67,
+                      sio2=50.5, alkalis=3.0),
+    AbsorptivityEntry(5200, 'H2Om', 'basalt', "Dixon et al. (1995)", epsilon=0.62,
+                      sio2=50.5, alkalis=3.0),
+    AbsorptivityEntry(1515, 'CO3', 'basanite to basaltic andesite', "Dixon and Pan (1995)",
+                      formula=dixon_pan_1995, sio2=48.0, alkalis=4.5, requires=('Na2O', 'CaO')),
+    AbsorptivityEntry(1430, 'CO3', 'basanite to basaltic andesite', "Dixon and Pan (1995)",
+                      formula=dixon_pan_1995, sio2=48.0, alkalis=4.5, requires=('Na2O', 'CaO')),
+    AbsorptivityEntry(2350, 'CO2', 'rhyolite', "Blank et al. (1993)", epsilon=1214.0,
+                      sio2=76.5, alkalis=8.5),
+    AbsorptivityEntry(4500, 'OH', 'rhyolite', "Newman et al. (1986)", epsilon=1.73,
+                      sio2=76.5, alkalis=8.5),
+    AbsorptivityEntry(5200, 'H2Om', 'rhyolite', "Newman et al. (1986)", epsilon=1.61,
+                      sio2=76.5, alkalis=8.5),
+    AbsorptivityEntry(1630, 'H2Om', 'rhyolite', "Newman et al. (1986)", epsilon=55.0,
+                      sio2=76.5, alkalis=8.5),
+)
+
+
+class AbsorptivityDatabase:
+    """
+    The absorptivity entries, indexed by band position and species.
+    """
+    def __init__(self, entries=ENTRIES):
+        self.entries = sorted(entries, key=lambda e: e.band)
+        self.bands = numpy.array([e.band for e in self.entries], dtype=float)
+        self.sio2 = numpy.array([numpy.nan if e.sio2 is None else e.sio2 for e in self.entries])
+        self.alkalis = numpy.array([numpy.nan if e.alkalis is None else e.alkalis for e in self.entries])
+        self.__by_species = {}
+        for i, e in enumerate(self.entries):
+            self.__by_species.setdefault(e.species, []).append(i)
+        self.__by_species = {k: numpy.array(v) for k, v in self.__by_species.items()}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def range_indices(self, lo, hi, species=None):
+        """
+        Returns the indices of the entries with lo <= band <= hi (and of
+        'species', if given).
+        """
+        start = numpy.searchsorted(self.bands, min(lo, hi), side='left')
+        stop = numpy.searchsorted(self.bands, max(lo, hi), side='right')
+        idxs = numpy.arange(start, stop)
+        if species is not None:
+            idxs = numpy.intersect1d(idxs, self.__by_species.get(species, []), assume_unique=True)
+        return idxs
+
+    def in_range(self, lo, hi, species=None):
+        """
+        Returns the entries with lo <= band <= hi (and of 'species', if
+        given), in order of band position.
+        """
+        return [self.entries[i] for i in self.range_indices(lo, hi, species)]
+
+    def nearest_indices(self, band, species, sio2, alkalis):
+        """
+        Returns the index of the entry for 'band' and 'species' whose
+        calibration composition is nearest to each sample (sio2 and alkalis
+        may be arrays). Raises ValueError if there is no such entry.
+        """
+        candidates = self.range_indices(band - BAND_TOLERANCE, band + BAND_TOLERANCE, species)
+        if len(candidates) == 0:
+            raise ValueError("No absorptivity for %s near %g cm-1" % (species, band))
+        sio2 = numpy.asarray(sio2, dtype=float)
+        alkalis = numpy.asarray(alkalis, dtype=float)
+
+        #prefer the nearest band, then the nearest composition
+        band_dist = numpy.abs(self.bands[candidates] - band)
+        candidates = candidates[band_dist == band_dist.min()]
+        dist = numpy.hypot(sio2[..., numpy.newaxis] - self.sio2[candidates],
+                           alkalis[..., numpy.newaxis] - self.alkalis[candidates])
+        return candidates[numpy.argmin(dist, axis=-1)]
+
+    def nearest(self, band, species, composition):
+        """
+        Returns the entry for 'band' and 'species' calibrated on the glass
+        nearest to 'composition' (which must have SiO2, Na2O and K2O).
+        """
+        i = self.nearest_indices(band, species, composition['SiO2'],
+                                 _alkalis(composition))
+        return self.entries[int(i)]
+
+    def lookup(self, band, species, composition):
+        """
+        Returns (absorptivities, entry indices) for a batch of samples:
+        each sample gets the entry calibrated on the glass nearest to its
+        composition, evaluated for that composition.
+
+            * band - band position (cm-1)
+            * species - species name
+            * composition - dict of arrays of oxide wt%, with at least SiO2,
+                            Na2O and K2O (and CaO for composition dependent
+                            carbonate absorptivities)
+        """
+        sio2 = numpy.asarray(composition['SiO2'], dtype=float)
+        idxs = numpy.broadcast_to(self.nearest_indices(band, species, sio2, _alkalis(composition)),
+                                  sio2.shape)
+        epsilon = numpy.empty(sio2.shape)
+        for i in numpy.unique(idxs):
+            selected = idxs == i
+            sub = {k: numpy.broadcast_to(v, sio2.shape)[selected] for k, v in composition.items()}
+            epsilon[selected] = self.entries[i].evaluate(sub)
+        return epsilon, idxs
+
+
+def _alkalis(composition):
+    return (numpy.asarray(composition['Na2O'], dtype=float) +
+            numpy.asarray(composition.get('K2O', 0.0), dtype=float))
+
+
+_default_database = None
+
+def get_default_database():
+    """
+    Returns an AbsorptivityDatabase of ENTRIES.
+    """
+    global _default_database
+    if _default_database is None:
+        _default_database = AbsorptivityDatabase()
+    return _default_database
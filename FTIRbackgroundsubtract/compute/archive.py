@@ -0,0 +1,244 @@
+"""
+Reading compressed spectra, and archives of many spectra, without
+decompressing them to temporary files first.
+
+Single files compressed with gzip, bzip2, xz or (if the zstandard package is
+installed) zstd are recognised from their first bytes, and are decompressed
+in memory (see decompress()), up to a limit on the decompressed size so
+that a small, highly compressed file can't use up the memory. Tar archives (which may be compressed in any of the same
+ways) and zip archives are read in a single sequential pass over the file,
+yielding the contents of each spectrum in them in turn, so each member is
+only held in memory while it is being parsed.
+"""
+import bz2
+import gzip
+import io
+import lzma
+import os
+import tarfile
+import zipfile
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    #zstd support is optional
+    zstandard = None
+
+
+#(magic number, name) of the compression formats
+COMPRESSION_MAGIC = ((b'\x1f\x8b', 'gzip'),
+                     (b'BZh', 'bz2'),
+                     (b'\xfd7zXZ\x00', 'xz'),
+                     (b'\x28\xb5\x2f\xfd', 'zstd'))
+
+COMPRESSED_EXTENSIONS = ('.gz', '.bz2', '.xz', '.zst')
+
+#extensions of archives, after any COMPRESSED_EXTENSIONS have been removed
+ARCHIVE_EXTENSIONS = ('.tar', '.tgz', '.tbz', '.tbz2', '.txz', '.tzst', '.zip')
+
+ZIP_MAGIC = (b'PK\x03\x04', b'PK\x05\x06')
+
+#bytes read from an archive at a time
+READ_SIZE = 1024 * 1024
+
+#default limit on the decompressed size of a spectrum, far more than any
+#real spectrum needs
+DEFAULT_MAX_SIZE = 1024 * 1024 * 1024
+
+#what the decompressors raise for truncated or corrupt data, which is
+#reported as a ValueError instead
+CORRUPT_ERRORS = (EOFError, lzma.LZMAError, zlib.error, tarfile.TarError, zipfile.BadZipFile)
+if zstandard is not None:
+    CORRUPT_ERRORS += (zstandard.ZstdError,)
+
+
+def get_compression(data):
+    """
+    Returns the name of the compression format of 'data' (at least the
+    first few bytes of a file), or None if it isn't compressed.
+    """
+    for magic, name in COMPRESSION_MAGIC:
+        if data.startswith(magic):
+            return name
+    return None
+
+
+def _zstd_required():
+    return ValueError("Reading zstd compressed files needs the zstandard package")
+
+
+def open_decompressed(fp):
+    """
+    Returns a binary file object that reads the decompressed contents of
+    the binary file object 'fp', or 'fp' itself if it isn't compressed.
+    'fp' must support peek(), as files opened with open(name, 'rb') do.
+    """
+    compression = get_compression(fp.peek(8)[:8])
+    if compression == 'gzip':
+        return gzip.GzipFile(fileobj=fp, mode='rb')
+    if compression == 'bz2':
+        return bz2.BZ2File(fp, mode='rb')
+    if compression == 'xz':
+        return lzma.LZMAFile(fp, mode='rb')
+    if compression == 'zstd':
+        if zstandard is None:
+            raise _zstd_required()
+        return zstandard.ZstdDecompressor().stream_reader(fp)
+    return fp
+
+
+def decompress(data, max_size=DEFAULT_MAX_SIZE):
+    """
+    Returns the decompressed contents of 'data' (bytes), or 'data' itself
+    if it isn't compressed. A whole spectrum has to be in memory to be
+    parsed anyway, and decompressing it in one call is faster than through
+    a file object.
+
+        * max_size - largest decompressed size allowed (bytes), or None for
+                     no limit. The decompressor never produces more than
+                     this, so a decompression bomb is stopped before it
+                     uses up the memory.
+
+    Raises ValueError if the data is corrupt or decompresses to more than
+    'max_size' bytes.
+    """
+    compression = get_compression(data[:8])
+    if compression is None:
+        return data
+    if compression == 'zstd' and zstandard is None:
+        raise _zstd_required()
+
+    chunks = []
+    size = 0
+    try:
+        #a file may hold several compressed streams one after another (e.g.
+        #from cat a.gz b.gz), which are joined
+        while get_compression(data[:8]) == compression:
+            limit = None if max_size is None else max_size + 1 - size
+            chunk, data = _decompress_stream(compression, data, limit)
+            chunks.append(chunk)
+            size += len(chunk)
+            if max_size is not None and size > max_size:
+                raise ValueError("Decompressed %s data is larger than the limit of %d bytes"
+                                 % (compression, max_size))
+    except CORRUPT_ERRORS + (OSError,) as e:
+        raise ValueError("Corrupt %s data: %s" % (compression, e))
+    return b''.join(chunks)
+
+
+def _decompress_stream(compression, data, limit):
+    #decompresses the first stream in 'data', returning at most 'limit'
+    #bytes (or all of it if 'limit' is None), and the data after the stream
+    if compression == 'zstd':
+        #zstd decompressobj() has no output limit, but a stream reader does
+        with zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data)) as reader:
+            return reader.read(-1 if limit is None else limit), b''
+
+    if compression == 'gzip':
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        out = decompressor.decompress(data, 0 if limit is None else limit)
+    else:
+        decompressor = bz2.BZ2Decompressor() if compression == 'bz2' else lzma.LZMADecompressor()
+        out = decompressor.decompress(data, -1 if limit is None else limit)
+    if not decompressor.eof:
+        if limit is not None and len(out) >= limit:
+            #stopped at the limit, which the caller reports
+            return out, b''
+        raise EOFError("Compressed data ended before the end-of-stream marker was reached")
+    return out, decompressor.unused_data
+
+
+def strip_compression(filename):
+    """
+    Returns 'filename' without a compression extension (e.g. 'a.csv.gz'
+    becomes 'a.csv').
+    """
+    root, ext = os.path.splitext(filename)
+    if ext.lower() in COMPRESSED_EXTENSIONS:
+        return root
+    return filename
+
+
+def is_archive_filename(filename):
+    """
+    Returns True if 'filename' has the extension of a tar or zip archive
+    (e.g. .tar, .tar.gz, .tgz, .zip).
+    """
+    return os.path.splitext(strip_compression(filename))[1].lower() in ARCHIVE_EXTENSIONS
+
+
+def iter_archive(filename, accept=None, max_size=DEFAULT_MAX_SIZE):
+    """
+    Reads a tar or zip archive in one sequential pass and yields (member
+    name, contents) for each file in it. The contents are as stored, so a
+    member may itself be compressed (see decompress()). Links are skipped,
+    as a single pass can't go back to the files they point to.
+
+        * filename - the archive, a zip file or a tar file that may be
+                     compressed with any of the formats in COMPRESSION_MAGIC
+        * accept - function of a member name that returns True if the member
+                   should be read, or None to read every file
+        * max_size - largest member that may be read (bytes), or None for no
+                     limit
+
+    Raises ValueError if the file isn't an archive, is corrupt or has a
+    member larger than 'max_size', after yielding the members before the
+    problem.
+    """
+    with open(filename, 'rb', buffering=READ_SIZE) as raw:
+        try:
+            if raw.peek(4)[:4] in ZIP_MAGIC:
+                yield from _iter_zip(raw, accept, max_size)
+            else:
+                yield from _iter_tar(raw, accept, max_size)
+        except CORRUPT_ERRORS as e:
+            raise ValueError("%s is not a tar or zip archive, or is corrupt: %s" % (filename, e))
+
+
+def _check_member_size(name, size, max_size):
+    if max_size is not None and size > max_size:
+        raise ValueError("%s is larger than the limit of %d bytes" % (name, max_size))
+
+
+def _iter_tar(fp, accept, max_size):
+    #stream mode, so the tar file is read once, front to back, as it is
+    #decompressed
+    with open_decompressed(fp) as ifp:
+        with tarfile.open(fileobj=ifp, mode='r|') as tar:
+            for member in tar:
+                if not member.isfile() or (accept is not None and not accept(member.name)):
+                    continue
+                _check_member_size(member.name, member.size, max_size)
+                yield member.name, tar.extractfile(member).read()
+
+
+def _iter_zip(fp, accept, max_size):
+    #the members are read in the order they are stored, so the file is read
+    #front to back (after the central directory at the end)
+    with zipfile.ZipFile(fp) as zf:
+        for info in sorted(zf.infolist(), key=lambda info: info.header_offset):
+            if info.is_dir() or (accept is not None and not accept(info.filename)):
+                continue
+            #the size in the directory may not be true, so don't read more
+            #than the limit whatever it says
+            _check_member_size(info.filename, info.file_size, max_size)
+            with zf.open(info) as member:
+                data = member.read(-1 if max_size is None else max_size + 1)
+            _check_member_size(info.filename, len(data), max_size)
+            yield info.filename, data
+
+
+def archive_sizes(filename):
+    """
+    Returns (largest, total): the size in bytes of the largest file in a
+    zip archive and of all of them, decompressed. For other archives, and
+    compressed files, these aren't known without reading the whole file, so
+    None is returned.
+    """
+    try:
+        with zipfile.ZipFile(filename) as zf:
+            sizes = [info.file_size for info in zf.infolist() if not info.is_dir()]
+    except (OSError, zipfile.BadZipFile):
+        return None
+    return max(sizes, default=0), sum(sizes)
@@ -0,0 +1,139 @@
+"""
+Fitting several absorption bands of the same spectrum in one pass. The
+spectrum is loaded once and a single ProcessedScan (and so a single set of
+sorted arrays and prefix moment tables) is shared by all of the bands.
+"""
+import time
+
+import numpy
+
+from FTIRbackgroundsubtract.compute.loader import load_spectrum
+from FTIRbackgroundsubtract.compute.scan import ProcessedScan
+
+
+class Band:
+    """
+    The background limits, excluded peak window and fit order used to
+    measure one absorption band.
+    """
+    def __init__(self, bkgd_lowlim, bkgd_highlim, excl_lowlim, excl_highlim,
+                 bkgd_fit_order=1, name=None):
+        self.bkgd_lowlim = bkgd_lowlim
+        self.bkgd_highlim = bkgd_highlim
+        self.excl_lowlim = excl_lowlim
+        self.excl_highlim = excl_highlim
+        self.bkgd_fit_order = bkgd_fit_order
+        if name is None:
+            name = "%g-%g" % (excl_lowlim, excl_highlim)
+        self.name = name
+
+    def __repr__(self):
+        return "Band(%g, %g, %g, %g, bkgd_fit_order=%d, name=%r)" % (
+            self.bkgd_lowlim, self.bkgd_highlim, self.excl_lowlim, self.excl_highlim,
+            self.bkgd_fit_order, self.name)
+
+
+#the suggested limits offered by the GUI, keyed by the button labels
+PRESETS = {
+    '3500': Band(2400, 4000, 2590, 3788, 1, name='3500'),
+    '4500': Band(4050, 5072, 4300, 4600, 3, name='4500'),
+    '5200': Band(4710, 5960, 5138, 5280, 3, name='5200'),
+    'CO3': Band(1242, 2038, 1362, 1770, 3, name='CO3'),
+    'CO3 (2)': Band(1499, 2339, 1551, 2058, 5, name='CO3 (2)'),
+}
+
+
+def get_preset(name):
+    """
+    Returns the preset Band called 'name' (see PRESETS).
+    """
+    try:
+        return PRESETS[name]
+    except KeyError:
+        raise ValueError("Unknown band preset %r, expected one of: %s"
+                         % (name, ", ".join(PRESETS)))
+
+
+class BandResult:
+    """
+    The outcome of fitting one band. If the fit failed, 'error' is the
+    exception and the other fields are None.
+
+     * band - the Band that was fitted
+     * peak_height - height of the background-subtracted peak
+     * bkgd_func - numpy.poly1d of the fitted background
+     * n_ignored - number of points rejected from the background fit
+     * ignored_idxs - indices (into the spectrum) of the rejected points
+     * iterations - number of outlier rejection passes
+     * converged - False if the rejection stopped at the iteration limit
+     * fit_time - time taken to fit the band (s)
+    """
+    def __init__(self, band, peak_height=None, bkgd_func=None, n_ignored=None,
+                 iterations=None, converged=None, fit_time=None, error=None,
+                 ignored_idxs=None):
+        self.band = band
+        self.peak_height = peak_height
+        self.bkgd_func = bkgd_func
+        self.n_ignored = n_ignored
+        self.ignored_idxs = ignored_idxs
+        self.iterations = iterations
+        self.converged = converged
+        self.fit_time = fit_time
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+def process_bands(wavenum, absorbance, bands, **fit_options):
+    """
+    Fits every band in 'bands' to one spectrum and returns a list of
+    BandResult in the same order. The keyword arguments are passed on to
+    ProcessedScan. A band that fails (e.g. because its limits are outside
+    the spectrum) gives a result with 'error' set rather than raising, so
+    that it doesn't stop the others.
+    """
+    return process_scan_bands(ProcessedScan(wavenum, absorbance, **fit_options), bands)
+
+
+def process_scan_bands(scan, bands):
+    """
+    Like process_bands(), but fits the bands to an existing ProcessedScan,
+    so that its moment tables are reused. The scan's limits are left set to
+    those of the last band.
+    """
+    bands = list(bands)
+    if bands:
+        #build the moment tables once, up to the highest order needed
+        scan.get_moments(max(b.bkgd_fit_order for b in bands))
+
+    results = []
+    for band in bands:
+        t0 = time.perf_counter()
+        try:
+            scan.bkgd_lowlim = band.bkgd_lowlim
+            scan.bkgd_highlim = band.bkgd_highlim
+            scan.excl_lowlim = band.excl_lowlim
+            scan.excl_highlim = band.excl_highlim
+            scan.bkgd_fit_order = band.bkgd_fit_order
+            scan.calculate()
+            results.append(BandResult(band, peak_height=scan.get_peak_height(),
+                                      bkgd_func=scan.bkgd_func,
+                                      n_ignored=len(scan.bkgd_ignored_pts),
+                                      ignored_idxs=scan.bkgd_ignored_idxs,
+                                      iterations=scan.bkgd_iterations,
+                                      converged=scan.bkgd_converged,
+                                      fit_time=time.perf_counter() - t0))
+        except (ValueError, numpy.linalg.LinAlgError) as e:
+            results.append(BandResult(band, fit_time=time.perf_counter() - t0, error=e))
+    return results
+
+
+def process_file_bands(filename, bands, **fit_options):
+    """
+    Loads a spectrum file once and fits every band to it, see
+    process_bands().
+    """
+    wavenum, absorbance = load_spectrum(filename)
+    return process_bands(wavenum, absorbance, bands, **fit_options)
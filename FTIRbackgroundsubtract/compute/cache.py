@@ -0,0 +1,199 @@
+"""
+On-disk cache of parsed spectra.
+
+Parsed wavenumber and absorbance arrays are stored as a single 2 x N .npy
+file named after a hash of the source file contents. Reopening a cached
+spectrum memory-maps that file, so no parsing or copying is needed. An
+index maps each source path to its (mtime, size, hash) so that unchanged
+files are found without rehashing them. The cache is bounded in size and
+evicts the least recently used entries first.
+"""
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy
+
+from FTIRbackgroundsubtract.compute.loader import parse_spectrum
+
+
+DEFAULT_CACHE_DIR = '~/.bkgd_subtract_cache'
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+
+class SpectrumCache:
+    """
+    Content-addressed cache of parsed spectra.
+
+        * cache_dir - directory to store the cache in
+        * max_bytes - maximum total size of the cached arrays. The least
+                      recently used entries are deleted to stay below this.
+    """
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = os.path.normpath(os.path.expanduser(cache_dir))
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.__index_file = os.path.join(self.cache_dir, 'index.json')
+        self.__index = None
+
+
+    def load(self, filename):
+        """
+        Returns (wavenumber, absorbance) arrays for the spectrum file
+        'filename'. On a cache hit these are read-only memory-mapped arrays.
+        """
+        path = os.path.abspath(filename)
+        st = os.stat(path)
+        index = self.__get_index()
+
+        entry = index.get(path)
+        if entry is not None and entry[0] == st.st_mtime_ns and entry[1] == st.st_size:
+            arrays = self.__open(entry[2])
+            if arrays is not None:
+                self.hits += 1
+                return arrays
+
+        with open(path, 'rb') as ifp:
+            data = ifp.read()
+        digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+
+        #the same contents may already be cached under a different path
+        arrays = self.__open(digest)
+        if arrays is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            wavenumber, absorbance = parse_spectrum(data)
+            try:
+                self.__store(digest, wavenumber, absorbance)
+            except OSError:
+                #if we can't write to the cache then just don't cache
+                return wavenumber, absorbance
+            arrays = self.__open(digest)
+
+        index[path] = [st.st_mtime_ns, st.st_size, digest]
+        self.__save_index()
+        return arrays
+
+
+    def stats(self):
+        """
+        Returns a dict of the hit and miss counts and the size of the cache.
+        """
+        entries = self.__entries()
+        return {'hits': self.hits, 'misses': self.misses,
+                'entries': len(entries),
+                'bytes': sum(e[2] for e in entries)}
+
+
+    def clear(self):
+        """
+        Deletes everything in the cache.
+        """
+        for digest, mtime, size in self.__entries():
+            self.__remove(digest)
+        self.__index = {}
+        self.__save_index()
+
+
+    def __data_file(self, digest):
+        return os.path.join(self.cache_dir, digest + '.npy')
+
+
+    def __open(self, digest):
+        data_file = self.__data_file(digest)
+        try:
+            arr = numpy.load(data_file, mmap_mode='r')
+            #mark as recently used
+            os.utime(data_file)
+        except (OSError, ValueError):
+            return None
+        return arr[0], arr[1]
+
+
+    def __store(self, digest, wavenumber, absorbance):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        fd, tmp_file = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as ofp:
+                numpy.save(ofp, numpy.vstack((wavenumber, absorbance)))
+            os.replace(tmp_file, self.__data_file(digest))
+        except OSError:
+            os.unlink(tmp_file)
+            raise
+        self.__evict(keep=digest)
+
+
+    def __entries(self):
+        #returns a list of (digest, mtime, size) of all the cached arrays
+        entries = []
+        try:
+            names = os.listdir(self.cache_dir)
+        except OSError:
+            return entries
+        for name in names:
+            if not name.endswith('.npy'):
+                continue
+            try:
+                st = os.stat(os.path.join(self.cache_dir, name))
+            except OSError:
+                continue
+            entries.append((name[:-4], st.st_mtime_ns, st.st_size))
+        return entries
+
+
+    def __evict(self, keep=None):
+        entries = sorted(self.__entries(), key=lambda e: e[1])
+        total = sum(e[2] for e in entries)
+        for digest, mtime, size in entries:
+            if total <= self.max_bytes:
+                break
+            if digest == keep:
+                continue
+            self.__remove(digest)
+            total -= size
+
+
+    def __remove(self, digest):
+        try:
+            os.unlink(self.__data_file(digest))
+        except OSError:
+            pass
+        index = self.__get_index()
+        for path in [p for p, e in index.items() if e[2] == digest]:
+            del index[path]
+
+
+    def __get_index(self):
+        if self.__index is None:
+            try:
+                with open(self.__index_file, 'r') as ifp:
+                    self.__index = json.load(ifp)
+            except (OSError, ValueError):
+                self.__index = {}
+        return self.__index
+
+
+    def __save_index(self):
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            fd, tmp_file = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            with os.fdopen(fd, 'w') as ofp:
+                json.dump(self.__index, ofp)
+            os.replace(tmp_file, self.__index_file)
+        except OSError:
+            pass
+
+
+_default_cache = None
+
+def get_default_cache():
+    """
+    Returns the SpectrumCache shared by the GUI.
+    """
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = SpectrumCache()
+    return _default_cache
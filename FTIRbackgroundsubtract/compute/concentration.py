@@ -0,0 +1,164 @@
+"""
+Concentrations from peak heights using the Beer-Lambert law:
+
+    c (wt%) = 100 * M * A / (d * rho * epsilon)
+
+where M is the molar mass of the species (g/mol), A the peak height
+(absorbance), d the thickness of the sample (cm), rho its density (g/L) and
+epsilon the molar absorptivity of the band (L/mol/cm).
+
+Everything works on numpy arrays, so the concentrations of a whole batch of
+samples are calculated at once. Per-sample thicknesses and densities can be
+loaded from a CSV table with load_sample_metadata() and matched to the
+samples with join_metadata().
+"""
+import csv
+
+import numpy
+
+
+class Species:
+    """
+    A species whose concentration can be calculated.
+
+        * name - key in SPECIES
+        * molar_mass - molar mass used in the calculation (g/mol)
+        * description - for display
+    """
+    def __init__(self, name, molar_mass, description):
+        self.name = name
+        self.molar_mass = molar_mass
+        self.description = description
+
+    def __repr__(self):
+        return "Species(%r, %g)" % (self.name, self.molar_mass)
+
+
+#OH and carbonate are conventionally reported as H2O and CO2 equivalents
+SPECIES = {
+    'H2O': Species('H2O', 18.015, "Total water (H2Ot)"),
+    'OH': Species('OH', 18.015, "Hydroxyl (as H2O)"),
+    'H2Om': Species('H2Om', 18.015, "Molecular water (H2Om)"),
+    'CO2': Species('CO2', 44.01, "Molecular CO2"),
+    'CO3': Species('CO3', 44.01, "Carbonate, CO3 2- (as CO2)"),
+}
+
+UNITS = ('wt%', 'ppm')
+
+#columns of a sample metadata table (see load_sample_metadata())
+METADATA_COLUMNS = ('sample', 'thickness_um', 'density')
+
+
+def get_species(name):
+    """
+    Returns the Species called 'name' (see SPECIES).
+    """
+    try:
+        return SPECIES[name]
+    except KeyError:
+        raise ValueError("Unknown species %r, expected one of: %s" % (name, ", ".join(SPECIES)))
+
+
+def molar_masses(species):
+    """
+    Returns the molar masses of 'species', which is a species name or an
+    array of them.
+    """
+    species = numpy.asarray(species)
+    names, inverse = numpy.unique(species, return_inverse=True)
+    masses = numpy.array([get_species(n).molar_mass for n in names])
+    return masses[inverse].reshape(species.shape)
+
+
+def concentration(peak_height, thickness_um, density, absorptivity, species='H2O', units='wt%'):
+    """
+    Returns the concentration of 'species' from the Beer-Lambert law. All of
+    the arguments can be arrays, and are broadcast against each other.
+
+        * peak_height - height of the background-subtracted peak (absorbance)
+        * thickness_um - thickness of the sample in microns
+        * density - density of the sample in g/L
+        * absorptivity - molar absorptivity of the band in L/mol/cm
+        * species - name of the species (see SPECIES), or an array of names
+        * units - 'wt%' or 'ppm' (by weight)
+    """
+    if units not in UNITS:
+        raise ValueError("units must be one of: %s" % ", ".join(UNITS))
+    peak_height = numpy.asarray(peak_height, dtype=float)
+    thickness_cm = numpy.asarray(thickness_um, dtype=float) * 1.0e-4
+    density = numpy.asarray(density, dtype=float)
+    absorptivity = numpy.asarray(absorptivity, dtype=float)
+
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        conc = (100.0 * molar_masses(species) * peak_height) / (thickness_cm * density * absorptivity)
+    if units == 'ppm':
+        conc = conc * 1.0e4
+    return conc
+
+
+def load_sample_metadata(filename):
+    """
+    Loads a CSV table of per-sample metadata, with a header row naming the
+    columns. It must have 'sample', 'thickness_um' and 'density' (g/L)
+    columns, and may have others (e.g. 'absorptivity' or the oxide
+    composition). Returns a dict mapping each column name to an array,
+    numeric where all of the values in the column are numbers.
+    """
+    with open(filename, 'r', newline='') as ifp:
+        rows = list(csv.DictReader(ifp))
+    if not rows:
+        raise ValueError("No samples in %s" % filename)
+    missing = [c for c in METADATA_COLUMNS if c not in rows[0]]
+    if missing:
+        raise ValueError("%s is missing the column(s): %s" % (filename, ", ".join(missing)))
+
+    metadata = {}
+    for column in rows[0]:
+        values = [r[column].strip() for r in rows]
+        try:
+            metadata[column] = numpy.array([float(v) if v else numpy.nan for v in values])
+        except ValueError:
+            metadata[column] = numpy.array(values)
+    metadata['sample'] = numpy.array([r['sample'].strip() for r in rows])
+    return metadata
+
+
+def join_metadata(samples, metadata):
+    """
+    Returns the metadata (as from load_sample_metadata()) of each of
+    'samples', as a dict of arrays the same length as 'samples'. Raises
+    ValueError if a sample isn't in the metadata.
+    """
+    samples = numpy.asarray(samples)
+    order = numpy.argsort(metadata['sample'], kind='stable')
+    sorted_names = metadata['sample'][order]
+    pos = numpy.searchsorted(sorted_names, samples)
+    pos = numpy.minimum(pos, len(sorted_names) - 1)
+    found = sorted_names[pos] == samples
+    if not numpy.all(found):
+        raise ValueError("No metadata for sample(s): %s" % ", ".join(samples[~found][:10]))
+    idxs = order[pos]
+    return {column: values[idxs] for column, values in metadata.items()}
+
+
+def batch_concentrations(samples, peak_heights, metadata, absorptivity=None, species='H2O',
+                         units='wt%'):
+    """
+    Returns the concentrations of a batch of samples, taking each sample's
+    thickness and density (and absorptivity, if 'absorptivity' is None)
+    from 'metadata'.
+
+        * samples - array of sample names
+        * peak_heights - array of peak heights, one for each sample
+        * metadata - dict of arrays, as from load_sample_metadata()
+        * absorptivity - molar absorptivity (or an array of them), or None
+                         to use the 'absorptivity' column of the metadata
+        * species, units - see concentration()
+    """
+    joined = join_metadata(samples, metadata)
+    if absorptivity is None:
+        if 'absorptivity' not in joined:
+            raise ValueError("No absorptivity given, and the metadata has no 'absorptivity' column")
+        absorptivity = joined['absorptivity']
+    return concentration(peak_heights, joined['thickness_um'], joined['density'], absorptivity,
+                         species=species, units=units)
@@ -0,0 +1,352 @@
+"""
+Hyperspectral FTIR maps ("cubes"), which have a spectrum at every pixel of
+an image.
+
+Cubes are read from ENVI files, which most FTIR imaging software can
+export: a text header (.hdr) describing a raw binary data file. The data
+file is memory mapped, not read in, and is processed one tile of pixels at a
+time. The spectra of a tile are copied into a (pixels, points) array and
+fitted with fit_backgrounds(), which solves the backgrounds of all of them
+together because they share a wavenumber axis. The maps of peak height
+etc. are written to a memory mapped ENVI file as each tile is finished, so
+the memory used depends on the tile size and not on the size of the cube.
+"""
+import os
+import time
+
+import numpy
+
+from FTIRbackgroundsubtract.compute.concentration import concentration
+from FTIRbackgroundsubtract.compute.fitting import fit_backgrounds
+from FTIRbackgroundsubtract.compute.metrics import peak_metrics
+
+
+#ENVI 'data type' codes
+ENVI_DTYPES = {1: 'u1', 2: 'i2', 3: 'i4', 4: 'f4', 5: 'f8', 12: 'u2', 13: 'u4', 14: 'i8', 15: 'u8'}
+
+#extensions tried for the data file of a header, after no extension
+ENVI_DATA_EXTENSIONS = ('.dat', '.img', '.raw', '.bsq', '.bil', '.bip')
+
+#default upper limit on the memory used for the spectra of a tile and the
+#fit of them (bytes)
+DEFAULT_MEMORY_BUDGET = 256 * 1024 * 1024
+
+#approximate number of bytes of working memory per point of a tile: the
+#float64 spectra, the subtracted spectra, the residuals and error arrays of
+#the outlier rejection and the background mask
+BYTES_PER_POINT = 80
+
+#the maps made for each band, from compute.metrics.PeakMetrics and the fit
+MAP_NAMES = ('peak_height', 'position', 'area', 'fwhm', 'centroid', 'n_ignored')
+
+
+def parse_envi_header(filename):
+    """
+    Reads an ENVI header file and returns a dict of its fields, with the
+    keys in lower case. Values in braces are returned as lists of strings,
+    other values as strings.
+    """
+    with open(filename, 'r') as ifp:
+        text = ifp.read()
+    if not text.lstrip().startswith('ENVI'):
+        raise ValueError("%s is not an ENVI header" % filename)
+
+    header = {}
+    lines = iter(text.splitlines()[1:])
+    for line in lines:
+        if '=' not in line:
+            continue
+        key, value = line.split('=', 1)
+        key = key.strip().lower()
+        value = value.strip()
+        if value.startswith('{'):
+            #braced values can run over several lines
+            while '}' not in value:
+                try:
+                    value += ' ' + next(lines).strip()
+                except StopIteration:
+                    raise ValueError("Unterminated {} for %r in %s" % (key, filename))
+            value = value[1:value.index('}')]
+            header[key] = [v.strip() for v in value.split(',') if v.strip()]
+        else:
+            header[key] = value
+    return header
+
+
+def _envi_filenames(filename):
+    #returns (header filename, data filename) for either of them
+    stem, ext = os.path.splitext(filename)
+    if ext.lower() == '.hdr':
+        for data_ext in ('',) + ENVI_DATA_EXTENSIONS:
+            if os.path.isfile(stem + data_ext):
+                return filename, stem + data_ext
+        raise ValueError("Can't find the data file for %s" % filename)
+    for header in (stem + '.hdr', filename + '.hdr'):
+        if os.path.isfile(header):
+            return header, filename
+    raise ValueError("Can't find the ENVI header for %s" % filename)
+
+
+def _to_wavenumber(values, units):
+    #converts the band centres of an ENVI header to wavenumbers (cm-1)
+    units = units.lower().replace(' ', '')
+    if units in ('micrometers', 'micrometer', 'microns', 'micron', 'um'):
+        return 1.0e4 / values
+    if units in ('nanometers', 'nanometer', 'nm'):
+        return 1.0e7 / values
+    if units in ('wavenumber', 'wavenumbers', 'cm-1', '1/cm', 'unknown', ''):
+        return values
+    raise ValueError("Unsupported wavelength units %r" % units)
+
+
+class Cube:
+    """
+    A hyperspectral cube of lines x samples pixels with a spectrum of
+    n_points at each.
+
+        * data - the array of data (usually a numpy.memmap), laid out as
+                 given by 'interleave'
+        * wavenum - (n_points,) wavenumber axis
+        * interleave - 'bip' (lines, samples, points), 'bil' (lines, points,
+                       samples) or 'bsq' (points, lines, samples)
+    """
+    def __init__(self, data, wavenum, interleave='bip'):
+        interleave = interleave.lower()
+        if interleave == 'bip':
+            self.lines, self.samples, n_points = data.shape
+        elif interleave == 'bil':
+            self.lines, n_points, self.samples = data.shape
+        elif interleave == 'bsq':
+            n_points, self.lines, self.samples = data.shape
+        else:
+            raise ValueError("interleave must be 'bip', 'bil' or 'bsq'")
+        self.wavenum = numpy.asarray(wavenum, dtype=numpy.float64)
+        if self.wavenum.shape != (n_points,):
+            raise ValueError("wavenum has %d points but the cube has %d"
+                             % (len(self.wavenum), n_points))
+        self.data = data
+        self.interleave = interleave
+
+    def __repr__(self):
+        return "Cube(%d x %d pixels, %d points, %r)" % (self.lines, self.samples,
+                                                         self.n_points, self.interleave)
+
+    @property
+    def n_points(self):
+        return len(self.wavenum)
+
+    @property
+    def shape(self):
+        return (self.lines, self.samples)
+
+    def spectra(self, rows, cols):
+        """
+        Returns the spectra of the pixels in the slices 'rows' and 'cols'
+        as a (n_pixels, n_points) float64 array, in row major order. Only
+        these pixels are read from the file.
+        """
+        if self.interleave == 'bip':
+            block = self.data[rows, cols, :]
+        elif self.interleave == 'bil':
+            block = self.data[rows, :, cols].transpose(0, 2, 1)
+        else:
+            block = self.data[:, rows, cols].transpose(1, 2, 0)
+        return numpy.array(block, dtype=numpy.float64).reshape(-1, self.n_points)
+
+    def tile_shape(self, memory_budget=DEFAULT_MEMORY_BUDGET):
+        """
+        Returns the (rows, cols) of the largest tiles whose spectra can be
+        fitted within 'memory_budget' bytes. Tiles are whole lines where
+        possible, as these are contiguous in bip and bil files.
+        """
+        pixels = max(1, int(memory_budget // (BYTES_PER_POINT * self.n_points)))
+        if pixels >= self.samples:
+            return (min(self.lines, pixels // self.samples), self.samples)
+        return (1, pixels)
+
+    def tiles(self, tile_shape):
+        """
+        Yields (rows, cols) slices covering the cube in tiles of
+        'tile_shape' pixels, line by line.
+        """
+        tile_rows, tile_cols = tile_shape
+        for r in range(0, self.lines, tile_rows):
+            for c in range(0, self.samples, tile_cols):
+                yield (slice(r, min(r + tile_rows, self.lines)),
+                       slice(c, min(c + tile_cols, self.samples)))
+
+
+def open_envi(filename):
+    """
+    Memory maps an ENVI cube, given either its header or its data file,
+    and returns a Cube. The header must give the band centres ('wavelength'
+    with 'wavelength units' of wavenumber, micrometers or nanometers).
+    """
+    header_file, data_file = _envi_filenames(filename)
+    header = parse_envi_header(header_file)
+    try:
+        lines = int(header['lines'])
+        samples = int(header['samples'])
+        n_points = int(header['bands'])
+        dtype = numpy.dtype(ENVI_DTYPES[int(header['data type'])])
+    except KeyError as e:
+        raise ValueError("%s has no (or an unsupported) %s" % (header_file, e))
+    interleave = header.get('interleave', 'bsq').lower()
+    offset = int(header.get('header offset', 0))
+    if header.get('byte order', '0').strip() == '1':
+        dtype = dtype.newbyteorder('>')
+    else:
+        dtype = dtype.newbyteorder('<')
+
+    if 'wavelength' not in header:
+        raise ValueError("%s doesn't give the wavenumber of each band" % header_file)
+    wavenum = _to_wavenumber(numpy.array(header['wavelength'], dtype=numpy.float64),
+                             header.get('wavelength units', 'unknown'))
+
+    shape = {'bip': (lines, samples, n_points), 'bil': (lines, n_points, samples),
+             'bsq': (n_points, lines, samples)}.get(interleave)
+    if shape is None:
+        raise ValueError("Unsupported interleave %r in %s" % (interleave, header_file))
+    data = numpy.memmap(data_file, dtype=dtype, mode='r', offset=offset, shape=shape)
+    return Cube(data, wavenum, interleave)
+
+
+def create_envi_maps(filename, lines, samples, names, description="FTIR peak maps"):
+    """
+    Creates an ENVI file of float32 maps (one band per map, bsq
+    interleave), filled with NaN, and returns it as a writable
+    (n_maps, lines, samples) numpy.memmap. 'filename' is the data file;
+    the header is written next to it with a .hdr extension.
+    """
+    stem = os.path.splitext(filename)[0]
+    with open(stem + '.hdr', 'w') as ofp:
+        ofp.write("ENVI\n")
+        ofp.write("description = {%s}\n" % description)
+        ofp.write("samples = %d\nlines = %d\nbands = %d\n" % (samples, lines, len(names)))
+        ofp.write("header offset = 0\nfile type = ENVI Standard\n")
+        ofp.write("data type = 4\ninterleave = bsq\nbyte order = 0\n")
+        ofp.write("band names = {%s}\n" % ", ".join(names))
+        ofp.write("data ignore value = NaN\n")
+
+    maps = numpy.memmap(filename, dtype='<f4', mode='w+', shape=(len(names), lines, samples))
+    maps[:] = numpy.nan
+    return maps
+
+
+class CubeMapsResult:
+    """
+    Results of map_cube().
+
+        * names - the name of each map, '<band name> <quantity>'
+        * maps - (n_maps, lines, samples) array (memory mapped) of the maps
+        * n_tiles - number of tiles that were processed
+        * tile_shape - (rows, cols) of the tiles
+        * n_failed - number of (band, tile) fits that failed, whose pixels
+                     are left as NaN
+        * elapsed - time taken (s)
+    """
+    def __init__(self, names, maps, n_tiles, tile_shape, n_failed, elapsed):
+        self.names = names
+        self.maps = maps
+        self.n_tiles = n_tiles
+        self.tile_shape = tile_shape
+        self.n_failed = n_failed
+        self.elapsed = elapsed
+
+    def get(self, name):
+        """
+        Returns the map called 'name'.
+        """
+        return self.maps[self.names.index(name)]
+
+
+def map_names(bands, concentration_params=None):
+    """
+    Returns the names of the maps that map_cube() makes for 'bands'.
+    """
+    concentration_params = concentration_params or {}
+    names = []
+    for band in bands:
+        names.extend("%s %s" % (band.name, m) for m in MAP_NAMES)
+        if band.name in concentration_params:
+            names.append("%s concentration" % band.name)
+    return names
+
+
+def _fit_tile(wavenum, spectra, band, fit_options, conc_params):
+    #returns the maps of one band for a tile, as a list of (n_pixels,) arrays
+    result = fit_backgrounds(wavenum, spectra, band.bkgd_lowlim, band.bkgd_highlim,
+                             band.excl_lowlim, band.excl_highlim, band.bkgd_fit_order,
+                             **fit_options)
+    metrics = peak_metrics(wavenum, result.subtracted, band.bkgd_lowlim, band.bkgd_highlim)
+    values = [metrics.height, metrics.position, metrics.area, metrics.fwhm, metrics.centroid,
+              result.n_ignored]
+    if conc_params is not None:
+        values.append(concentration(metrics.height, **conc_params))
+    return values
+
+
+def map_cube(cube, bands, output, concentration_params=None, tile_shape=None,
+             memory_budget=DEFAULT_MEMORY_BUDGET, progress=None, **fit_options):
+    """
+    Fits the background of every band to every pixel of 'cube', and writes
+    maps of the peak metrics (see MAP_NAMES) and optionally the
+    concentration to the ENVI file 'output'. Returns a CubeMapsResult.
+
+        * cube - a Cube, e.g. from open_envi()
+        * bands - list of compute.bands.Band to measure
+        * output - filename of the output data file (see create_envi_maps())
+        * concentration_params - dict mapping band names to dicts of keyword
+                    arguments for compute.concentration.concentration()
+                    (thickness_um, density, absorptivity and optionally
+                    species and units), for the bands to make concentration
+                    maps of
+        * tile_shape - (rows, cols) of the tiles, by default the largest
+                       that fit in 'memory_budget' (see Cube.tile_shape())
+        * memory_budget - bytes of working memory for a tile
+        * progress - function called with (tiles done, total tiles) after
+                     each tile
+        * fit_options - keyword arguments for compute.fitting.fit_backgrounds()
+                        (angle_err, col_err_fraction, reject_outliers, ...)
+
+    Pixels whose spectra aren't finite (e.g. masked pixels stored as NaN)
+    are left as NaN in the maps, as are the pixels of a tile whose fit
+    failed.
+    """
+    t0 = time.perf_counter()
+    bands = list(bands)
+    concentration_params = concentration_params or {}
+    names = map_names(bands, concentration_params)
+    if tile_shape is None:
+        tile_shape = cube.tile_shape(memory_budget)
+    tiles = list(cube.tiles(tile_shape))
+
+    maps = create_envi_maps(output, cube.lines, cube.samples, names)
+    n_failed = 0
+    for i, (rows, cols) in enumerate(tiles, 1):
+        spectra = cube.spectra(rows, cols)
+        valid = numpy.all(numpy.isfinite(spectra), axis=1)
+        spectra = spectra[valid] if not numpy.all(valid) else spectra
+
+        tile_maps = numpy.full((len(names), len(valid)), numpy.nan, dtype=numpy.float32)
+        k = 0
+        for band in bands:
+            conc_params = concentration_params.get(band.name)
+            n_maps = len(MAP_NAMES) + (conc_params is not None)
+            if len(spectra):
+                try:
+                    values = _fit_tile(cube.wavenum, spectra, band, fit_options, conc_params)
+                except (ValueError, numpy.linalg.LinAlgError):
+                    n_failed += 1
+                else:
+                    tile_maps[k:k + n_maps, valid] = values
+            k += n_maps
+
+        n_rows = rows.stop - rows.start
+        maps[:, rows, cols] = tile_maps.reshape(len(names), n_rows, -1)
+        maps.flush()
+        if progress is not None:
+            progress(i, len(tiles))
+
+    return CubeMapsResult(names, maps, len(tiles), tile_shape, n_failed,
+                          time.perf_counter() - t0)
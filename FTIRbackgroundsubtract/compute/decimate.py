@@ -0,0 +1,133 @@
+"""
+Level-of-detail reduction of spectra for plotting. A line plot can't show
+more detail than one vertical stroke per pixel column, so each column only
+needs the first, lowest, highest and last points that fall in it. Plotting
+those gives the same picture as plotting every point (peaks included), but
+the number of points drawn depends on the width of the plot rather than on
+the size of the spectrum.
+"""
+import numpy
+
+#views with fewer than this many points per pixel column are not decimated
+MIN_POINTS_PER_COLUMN = 4
+
+
+def view_slice(x, x_lo, x_hi):
+    """
+    Returns the slice of the monotonic (ascending or descending) array 'x'
+    that covers x_lo <= x <= x_hi, extended by one point at each end so that
+    lines run on to the edges of the view.
+    """
+    n = len(x)
+    if n == 0:
+        return slice(0, 0)
+    lo, hi = min(x_lo, x_hi), max(x_lo, x_hi)
+    if x[0] <= x[-1]:
+        start = numpy.searchsorted(x, lo, side='left')
+        stop = numpy.searchsorted(x, hi, side='right')
+    else:
+        start = n - numpy.searchsorted(x[::-1], hi, side='right')
+        stop = n - numpy.searchsorted(x[::-1], lo, side='left')
+    return slice(max(start - 1, 0), min(stop + 1, n))
+
+
+def _column_starts(x, x_lo, x_hi, n_columns):
+    #index of the first point in each occupied pixel column
+    lo, hi = min(x_lo, x_hi), max(x_lo, x_hi)
+    width = (hi - lo) if hi > lo else 1.0
+    cols = numpy.floor((x - lo) * (n_columns / width)).astype(numpy.intp)
+    numpy.clip(cols, -1, n_columns, out=cols)
+    starts = numpy.concatenate(([0], numpy.flatnonzero(cols[1:] != cols[:-1]) + 1))
+    return starts
+
+
+def _first_match(y, col_values, cols, starts):
+    #index of the first point in each column whose y equals the column's
+    #value, or the column's first point if there is none (i.e. NaNs)
+    idxs = starts.copy()
+    hits = numpy.flatnonzero(y == col_values[cols])
+    hit_cols = cols[hits]
+    first = numpy.ones(len(hits), dtype=bool)
+    first[1:] = hit_cols[1:] != hit_cols[:-1]
+    idxs[hit_cols[first]] = hits[first]
+    return idxs
+
+
+def minmax_decimate(x, y, x_lo, x_hi, n_columns):
+    """
+    Returns (x, y) arrays of the points of the monotonic series (x, y) to
+    plot in a view from x_lo to x_hi that is 'n_columns' pixels wide. For
+    each pixel column this keeps the first and last points (so that the
+    lines between columns are right) and the minimum and maximum (so that
+    the vertical extent of the column is right). Points outside the view
+    are dropped, apart from one at each end.
+
+        * x - monotonic (ascending or descending) numpy array
+        * y - numpy array of the same length as x
+        * x_lo, x_hi - limits of the view (in either order)
+        * n_columns - width of the view in pixels
+    """
+    x = numpy.asarray(x)
+    y = numpy.asarray(y)
+    s = view_slice(x, x_lo, x_hi)
+    x = x[s]
+    y = y[s]
+    n_columns = max(int(n_columns), 1)
+    if len(x) <= MIN_POINTS_PER_COLUMN * n_columns:
+        return x, y
+
+    starts = _column_starts(x, x_lo, x_hi, n_columns)
+    ends = numpy.append(starts[1:], len(x)) - 1
+
+    #the position of the first min and max in each column
+    counts = numpy.diff(numpy.append(starts, len(x)))
+    cols = numpy.repeat(numpy.arange(len(starts)), counts)
+    min_idx = _first_match(y, numpy.minimum.reduceat(y, starts), cols, starts)
+    max_idx = _first_match(y, numpy.maximum.reduceat(y, starts), cols, starts)
+
+    #emit first, min, max, last for each column, with the min and max in
+    #the order in which they occur
+    lower = numpy.minimum(min_idx, max_idx)
+    upper = numpy.maximum(min_idx, max_idx)
+    idxs = numpy.column_stack((starts, lower, upper, ends)).ravel()
+    return x[idxs], y[idxs]
+
+
+def thin_error_bars(x, y, x_err, y_err, x_lo, x_hi, n_columns):
+    """
+    Returns the x and y data of a single NaN-separated line that draws the
+    error bars of the points (x, y) for a view from x_lo to x_hi that is
+    'n_columns' pixels wide. If there are too many points in the view for
+    their bars to be told apart, each pixel column gets one vertical bar
+    spanning all of the vertical bars in it, and the horizontal bar of its
+    first point.
+    """
+    x = numpy.asarray(x, dtype=float)
+    y = numpy.asarray(y, dtype=float)
+    x_err = numpy.broadcast_to(x_err, x.shape)
+    y_err = numpy.broadcast_to(y_err, x.shape)
+
+    s = view_slice(x, x_lo, x_hi)
+    x, y, x_err, y_err = x[s], y[s], x_err[s], y_err[s]
+    y_lo = y - y_err
+    y_hi = y + y_err
+
+    n_columns = max(int(n_columns), 1)
+    if len(x) > n_columns and len(x) > 1:
+        starts = _column_starts(x, x_lo, x_hi, n_columns)
+        y_lo = numpy.minimum.reduceat(y_lo, starts)
+        y_hi = numpy.maximum.reduceat(y_hi, starts)
+        x, y, x_err = x[starts], y[starts], x_err[starts]
+
+    #each point has a horizontal bar, a vertical bar and a NaN after each
+    xs = numpy.empty((len(x), 6))
+    ys = numpy.empty((len(x), 6))
+    xs[:, 0] = x - x_err
+    xs[:, 1] = x + x_err
+    xs[:, 3:5] = x[:, numpy.newaxis]
+    ys[:, 0:2] = y[:, numpy.newaxis]
+    ys[:, 3] = y_lo
+    ys[:, 4] = y_hi
+    xs[:, 2::3] = numpy.nan
+    ys[:, 2::3] = numpy.nan
+    return xs.ravel(), ys.ravel()
@@ -0,0 +1,461 @@
+"""
+Polynomial background fitting.
+
+fit_with_rejection() fits a single spectrum, rejecting points that don't
+fit within their error bars. Rather than refitting from scratch each time a
+point is rejected, the Cholesky factor of the fit is downdated to remove
+it.
+
+fit_backgrounds() fits many spectra at once. All the spectra in a batch
+share one wavenumber axis and one set of background limits, so the design
+matrix of the fit is the same for every spectrum. It is built and QR
+factorised once, and the coefficients of all the spectra are then found
+with a single matrix product.
+
+The fits are done on a centred and scaled copy of the axis to keep the high
+order fits well conditioned. Coefficients are returned in the same form as
+numpy.polyfit.
+"""
+import math
+import time
+
+import numpy
+
+
+#smallest fraction of the square of a diagonal element of a Cholesky factor
+#that a downdate may leave before we refactorise instead
+DOWNDATE_TOL = 1e-8
+
+
+def background_mask(wavenum, bkgd_lowlim, bkgd_highlim, excl_lowlim, excl_highlim):
+    """
+    Returns a boolean mask which is True for the points of 'wavenum' that lie
+    between the background limits but not between the exclude limits. The
+    limits are exclusive.
+    """
+    bkgd_mask = numpy.logical_and(wavenum > bkgd_lowlim, wavenum < bkgd_highlim)
+    excl_mask = numpy.logical_and(wavenum > excl_lowlim, wavenum < excl_highlim)
+    return numpy.logical_and(bkgd_mask, numpy.logical_not(excl_mask))
+
+
+def scale_axis(x):
+    """
+    Returns (centre, scale) such that (x - centre) / scale lies in [-1, 1].
+    """
+    lo = numpy.min(x)
+    hi = numpy.max(x)
+    centre = 0.5 * (hi + lo)
+    scale = 0.5 * (hi - lo)
+    if scale == 0:
+        scale = 1.0
+    return centre, scale
+
+
+def unscale_coeffs(coeffs, centre, scale):
+    """
+    Converts polynomial coefficients (highest power first, as returned by
+    numpy.polyfit) of a fit in t = (x - centre) / scale into coefficients of
+    the same polynomial in x. 'coeffs' may have any number of leading
+    dimensions.
+    """
+    coeffs = numpy.asarray(coeffs)
+    n = coeffs.shape[-1]
+
+    #t**j = sum_i binom(j, i) * x**i * (-centre)**(j - i) / scale**j
+    transform = numpy.zeros((n, n))
+    for j in range(n):
+        for i in range(j + 1):
+            transform[i, j] = math.comb(j, i) * (-centre) ** (j - i) / scale ** j
+
+    return (coeffs[..., ::-1] @ transform.T)[..., ::-1]
+
+
+class BatchFitResult:
+    """
+    Results of fit_backgrounds().
+
+        * coeffs - (n_spectra, order + 1) array of polynomial coefficients in
+                   wavenumber, highest power first (as numpy.polyfit)
+        * subtracted - (n_spectra, n_points) array of the absorbances minus
+                       their fitted backgrounds
+        * bkgd_mask - (n_spectra, n_points) boolean array of the points used
+                      in each fit (after any outliers were rejected)
+        * n_ignored - (n_spectra,) number of points rejected from each fit
+        * iterations - number of rejection passes that were made
+    """
+    def __init__(self, coeffs, subtracted, bkgd_mask, n_ignored, iterations):
+        self.coeffs = coeffs
+        self.subtracted = subtracted
+        self.bkgd_mask = bkgd_mask
+        self.n_ignored = n_ignored
+        self.iterations = iterations
+
+
+    def backgrounds(self, absorbances):
+        """
+        Returns the fitted backgrounds, given the absorbances that were fitted.
+        """
+        return absorbances - self.subtracted
+
+
+def cholesky_downdate(r, v):
+    """
+    Updates the upper triangular factor 'r' of a Gram matrix G = r.T @ r in
+    place, so that it becomes the factor of G - outer(v, v). That is, it
+    removes the row 'v' from the least squares problem that 'r' came from,
+    in O(n**2) rather than the O(m * n**2) of refactorising.
+
+    'r' may be a stack of factors with shape (..., n, n), with 'v' of shape
+    (..., n). Returns a boolean (array) which is False where the downdate
+    would have lost too much precision, in which case that factor is left
+    in an undefined state and must be recalculated from scratch.
+    """
+    v = numpy.array(v, dtype=numpy.float64)
+    n = r.shape[-1]
+    ok = numpy.ones(v.shape[:-1], dtype=bool)
+
+    for k in range(n):
+        rkk = r[..., k, k]
+        r2 = rkk * rkk - v[..., k] * v[..., k]
+        ok &= r2 > DOWNDATE_TOL * rkk * rkk
+        rk_new = numpy.sqrt(numpy.where(ok, r2, 1.0))
+        c = rk_new / rkk
+        s = v[..., k] / rkk
+        r[..., k, k] = rk_new
+        row = (r[..., k, k + 1:] - s[..., numpy.newaxis] * v[..., k + 1:]) / c[..., numpy.newaxis]
+        r[..., k, k + 1:] = row
+        v[..., k + 1:] = c[..., numpy.newaxis] * v[..., k + 1:] - s[..., numpy.newaxis] * row
+
+    return ok
+
+
+def _triangular_factor(vander):
+    #returns the R factor of the QR decomposition of 'vander', with a positive
+    #diagonal so that it is also the Cholesky factor of vander.T @ vander
+    r = numpy.linalg.qr(vander, mode='r')
+    signs = numpy.sign(numpy.diagonal(r, axis1=-2, axis2=-1)).copy()
+    signs[signs == 0] = 1
+    return r * signs[..., :, numpy.newaxis]
+
+
+def _solve_factored(r, rhs):
+    #solves (r.T @ r) c = rhs
+    z = numpy.linalg.solve(numpy.swapaxes(r, -1, -2), rhs[..., numpy.newaxis])
+    return numpy.linalg.solve(r, z)[..., 0]
+
+
+class RejectionResult:
+    """
+    Results of fit_with_rejection().
+
+        * coeffs - polynomial coefficients in x, highest power first (as
+                   numpy.polyfit)
+        * keep - indices of the points that were used in the final fit
+        * rejected - indices of the points that were rejected, in the order
+                     that they were rejected
+        * iterations - number of rejection passes that were made
+        * converged - False if rejection was stopped early, either by
+                      max_iterations or by running out of points
+        * fit_time - time taken for the fit (s)
+    """
+    def __init__(self, coeffs, keep, rejected, iterations, converged, fit_time):
+        self.coeffs = coeffs
+        self.keep = keep
+        self.rejected = rejected
+        self.iterations = iterations
+        self.converged = converged
+        self.fit_time = fit_time
+
+
+def fit_with_rejection(x, y, x_err, y_err, order, threshold=None, max_iterations=None,
+                       residual_mode='extremes', gram=None, rhs=None):
+    """
+    Fits a polynomial to x, y and then rejects points that can't be fitted
+    to within their error bars (see find_residuals), until all the remaining
+    points fit. The least squares factorisation is downdated as points are
+    removed, rather than being recalculated.
+
+        * x, y - the data to fit
+        * x_err, y_err - absolute errors of the data
+        * order - order of the polynomial
+        * threshold - if None then only the worst point is removed on each
+                      pass. Otherwise every point whose residual is more than
+                      'threshold' times its y error is removed in the same
+                      pass (or the worst point, if there are none).
+        * max_iterations - maximum number of rejection passes (None for no
+                           limit)
+        * residual_mode - how the residuals are calculated, see
+                          polynomial_residuals()
+        * gram, rhs - optional precalculated normal equations of the initial
+                      fit, in (x - centre) / scale where centre and scale are
+                      from scale_axis(x) (see moments.PrefixMoments)
+
+    Returns a RejectionResult. Raises ValueError if there are not enough
+    points to fit.
+    """
+    t0 = time.perf_counter()
+    x = numpy.asarray(x, dtype=numpy.float64)
+    y = numpy.asarray(y, dtype=numpy.float64)
+    x_err = numpy.broadcast_to(x_err, x.shape)
+    y_err = numpy.broadcast_to(y_err, x.shape)
+
+    n_coeffs = order + 1
+    if len(x) < n_coeffs:
+        raise ValueError("Not enough background points to fit a polynomial of order %d"%order)
+
+    centre, scale = scale_axis(x)
+    vander = numpy.vander((x - centre) / scale, n_coeffs)
+    t_lo = (x - x_err - centre) / scale
+    t_hi = (x + x_err - centre) / scale
+
+    r = None
+    if gram is not None:
+        try:
+            r = numpy.linalg.cholesky(gram).T
+            rhs = numpy.array(rhs, dtype=numpy.float64)
+        except numpy.linalg.LinAlgError:
+            r = None
+    if r is None:
+        r = _triangular_factor(vander)
+        rhs = vander.T @ y
+    coeffs_t = _solve_factored(r, rhs)
+
+    active = numpy.ones(len(x), dtype=bool)
+    n_active = len(x)
+    rejected = []
+    iterations = 0
+    converged = True
+
+    while True:
+        resid = polynomial_residuals(coeffs_t, t_lo, t_hi, y, y_err, mode=residual_mode)
+        resid[~active] = 0
+        if not numpy.any(resid):
+            break
+
+        if n_active <= n_coeffs or (max_iterations is not None and iterations >= max_iterations):
+            converged = False
+            break
+
+        to_remove = None
+        if threshold is not None:
+            to_remove = numpy.nonzero(resid > threshold * y_err)[0]
+            #worst first, and always leave enough points to fit
+            to_remove = to_remove[numpy.argsort(-resid[to_remove], kind='stable')][:n_active - n_coeffs]
+        if to_remove is None or len(to_remove) == 0:
+            to_remove = [numpy.argmax(resid)]
+
+        for i in to_remove:
+            active[i] = False
+            rejected.append(i)
+            rhs -= vander[i] * y[i]
+            if not cholesky_downdate(r, vander[i]):
+                r = _triangular_factor(vander[active])
+        n_active -= len(to_remove)
+        iterations += 1
+        coeffs_t = _solve_factored(r, rhs)
+
+    return RejectionResult(unscale_coeffs(coeffs_t, centre, scale), numpy.nonzero(active)[0],
+                           numpy.array(rejected, dtype=int), iterations, converged,
+                           time.perf_counter() - t0)
+
+
+def polyval(coeffs, x):
+    """
+    Evaluates polynomials using Horner's method, in the native dtype of the
+    arrays.
+
+        * coeffs - coefficients, highest power first. Either (n_coeffs,) for a
+                   single polynomial, or (n_polys, n_coeffs) for a batch.
+        * x - points to evaluate at. For a batch of polynomials this is either
+              (n_points,), shared by all of them, or (n_polys, n_points).
+    """
+    coeffs = numpy.asarray(coeffs, dtype=numpy.float64)
+    if coeffs.ndim > 1:
+        #one (n_polys, 1) column per power, so that they broadcast along x
+        coeffs = coeffs.T[:, :, numpy.newaxis]
+
+    result = numpy.zeros(numpy.broadcast_shapes(coeffs[0].shape, numpy.shape(x)))
+    for c in coeffs:
+        result *= x
+        result += c
+    return result
+
+
+def _real_roots(coeffs):
+    #returns the roots of a batch of polynomials (highest power first) as an
+    #(n_polys, n_roots) array, with NaN in place of the complex roots
+    coeffs = numpy.atleast_2d(coeffs)
+    n_polys, n_coeffs = coeffs.shape
+    if n_coeffs < 2:
+        return numpy.empty((n_polys, 0))
+
+    #the roots are the eigenvalues of the companion matrix
+    lead = coeffs[:, 0]
+    valid = lead != 0
+    companion = numpy.zeros((n_polys, n_coeffs - 1, n_coeffs - 1))
+    companion[valid, 0, :] = -coeffs[valid, 1:] / lead[valid, numpy.newaxis]
+    idx = numpy.arange(n_coeffs - 2)
+    companion[:, idx + 1, idx] = 1.0
+
+    roots = numpy.linalg.eigvals(companion)
+    is_real = numpy.abs(roots.imag) <= 1e-9 * (1.0 + numpy.abs(roots.real))
+    is_real &= valid[:, numpy.newaxis]
+    return numpy.where(is_real, roots.real, numpy.nan)
+
+
+def polynomial_residuals(coeffs, x_lo, x_hi, y, y_err, mode='extremes'):
+    """
+    Calculates the distances of data points from polynomial trend lines,
+    allowing for the error in x of each point. Distances that are within
+    the y error are set to zero. This is the array version of
+    find_residuals(), and works on a single spectrum or a batch of them.
+
+        * coeffs - polynomial coefficients, highest power first, (n_coeffs,)
+                   or (n_spectra, n_coeffs)
+        * x_lo, x_hi - the ends of the x error interval of each point (x -
+                       x_err and x + x_err), (n_points,) or (n_spectra, n_points)
+        * y - y values, (n_points,) or (n_spectra, n_points)
+        * y_err - absolute error in y, broadcastable to y
+        * mode - 'extremes' to use the smaller of the distances from the
+                 trend line at x_lo and x_hi. 'interval' to use the exact
+                 minimum distance from the trend line anywhere between x_lo
+                 and x_hi.
+    """
+    fit_lo = polyval(coeffs, x_lo)
+    fit_hi = polyval(coeffs, x_hi)
+
+    if mode == 'extremes':
+        resid = numpy.minimum(numpy.abs(y - fit_lo), numpy.abs(y - fit_hi))
+
+    elif mode == 'interval':
+        #the trend line covers every value between its smallest and largest
+        #values over the interval. These are either at the ends of the
+        #interval, or at turning points inside it.
+        fit_min = numpy.minimum(fit_lo, fit_hi)
+        fit_max = numpy.maximum(fit_lo, fit_hi)
+
+        coeffs = numpy.atleast_2d(coeffs)
+        n_coeffs = coeffs.shape[-1]
+        deriv = coeffs[:, :-1] * numpy.arange(n_coeffs - 1, 0, -1)
+        turning_pts = _real_roots(deriv)
+        turning_vals = polyval(coeffs, turning_pts)
+        if numpy.ndim(fit_lo) == 1:
+            turning_pts = turning_pts[0]
+            turning_vals = turning_vals[0]
+
+        for j in range(turning_pts.shape[-1]):
+            r = turning_pts[..., j, numpy.newaxis]
+            v = turning_vals[..., j, numpy.newaxis]
+            inside = numpy.logical_and(r > x_lo, r < x_hi)
+            fit_min = numpy.where(inside, numpy.minimum(fit_min, v), fit_min)
+            fit_max = numpy.where(inside, numpy.maximum(fit_max, v), fit_max)
+
+        resid = numpy.maximum(fit_min - y, 0) + numpy.maximum(y - fit_max, 0)
+
+    else:
+        raise ValueError("mode must be 'extremes' or 'interval'")
+
+    #set residuals that are within the error bars to zero
+    resid[resid < y_err] = 0
+    return resid
+
+
+def fit_backgrounds(wavenum, absorbances, bkgd_lowlim, bkgd_highlim,
+                    excl_lowlim, excl_highlim, bkgd_fit_order=1,
+                    angle_err=5.0, col_err_fraction=0.05,
+                    reject_outliers=True, max_iterations=None,
+                    residual_mode='extremes'):
+    """
+    Fits polynomial backgrounds to a batch of spectra that share the same
+    wavenumber axis and background limits. This gives the same results as
+    running ProcessedScan.calculate() on each spectrum in turn.
+
+        * wavenum - (n_points,) wavenumber axis
+        * absorbances - (n_spectra, n_points) array of absorbances
+        * bkgd_lowlim, bkgd_highlim - limits of the region to fit
+        * excl_lowlim, excl_highlim - limits of a region to leave out of the fit
+        * bkgd_fit_order - order of the background polynomial
+        * angle_err - absolute error in wavenumber (scalar or (n_points,))
+        * col_err_fraction - fractional error in absorbance
+        * reject_outliers - if True, points that can't be fitted within their
+                            error bars are removed one at a time (per
+                            spectrum), worst first, and the fit is repeated
+        * max_iterations - maximum number of rejection passes (None for
+                           no limit)
+        * residual_mode - how the residuals are calculated, see
+                          polynomial_residuals()
+
+    Returns a BatchFitResult.
+    """
+    wavenum = numpy.asarray(wavenum, dtype=numpy.float64)
+    absorbances = numpy.atleast_2d(numpy.asarray(absorbances, dtype=numpy.float64))
+    n_spectra, n_points = absorbances.shape
+    if wavenum.shape != (n_points,):
+        raise ValueError("absorbances must have the same number of points as wavenum")
+
+    #don't allow the background to be bigger than the scan data
+    bkgd_lowlim = max(bkgd_lowlim, wavenum.min())
+    bkgd_highlim = min(bkgd_highlim, wavenum.max())
+
+    idxs = numpy.nonzero(background_mask(wavenum, bkgd_lowlim, bkgd_highlim,
+                                         excl_lowlim, excl_highlim))[0]
+    n_coeffs = bkgd_fit_order + 1
+    if len(idxs) < n_coeffs:
+        raise ValueError("Not enough background points to fit a polynomial of order %d"%bkgd_fit_order)
+
+    x = wavenum[idxs]
+    centre, scale = scale_axis(x)
+    x_err = numpy.broadcast_to(angle_err, wavenum.shape)[idxs]
+    vander = numpy.vander((x - centre) / scale, n_coeffs)
+    y = absorbances[:, idxs]
+
+    #one QR factorisation solves every spectrum
+    q, r = numpy.linalg.qr(vander)
+    coeffs_t = numpy.linalg.solve(r, q.T @ y.T).T
+
+    mask = numpy.ones(y.shape, dtype=bool)
+    iterations = 0
+    if reject_outliers:
+        t_lo = (x - x_err - centre) / scale
+        t_hi = (x + x_err - centre) / scale
+        y_err = numpy.abs(y * col_err_fraction)
+        active = numpy.arange(n_spectra)
+        factors = numpy.repeat(_triangular_factor(vander)[numpy.newaxis], n_spectra, axis=0)
+        rhs = y @ vander
+
+        while max_iterations is None or iterations < max_iterations:
+            c = coeffs_t[active]
+            resid = polynomial_residuals(c, t_lo, t_hi, y[active], y_err[active], mode=residual_mode)
+            resid[~mask[active]] = 0
+
+            #stop fitting spectra that fit within error, or which don't have
+            #enough points left to reject another one
+            has_outliers = numpy.any(resid > 0, axis=1)
+            has_outliers &= mask[active].sum(axis=1) > n_coeffs
+            active = active[has_outliers]
+            if len(active) == 0:
+                break
+
+            #remove the point with the greatest residual from each fit
+            worst = numpy.argmax(resid[has_outliers], axis=1)
+            mask[active, worst] = False
+            iterations += 1
+
+            #downdate each spectrum's factor to remove its rejected point
+            rhs[active] -= vander[worst] * y[active, worst][:, numpy.newaxis]
+            r_active = factors[active]
+            ok = cholesky_downdate(r_active, vander[worst])
+            if not numpy.all(ok):
+                redo = active[~ok]
+                gram = numpy.einsum('sm,mi,mj->sij', mask[redo].astype(numpy.float64), vander, vander)
+                r_active[~ok] = numpy.swapaxes(numpy.linalg.cholesky(gram), -1, -2)
+            factors[active] = r_active
+            coeffs_t[active] = _solve_factored(r_active, rhs[active])
+
+    full_mask = numpy.zeros(absorbances.shape, dtype=bool)
+    full_mask[:, idxs] = mask
+
+    subtracted = absorbances - coeffs_t @ numpy.vander((wavenum - centre) / scale, n_coeffs).T
+
+    return BatchFitResult(unscale_coeffs(coeffs_t, centre, scale), subtracted, full_mask,
+                          len(idxs) - mask.sum(axis=1), iterations)
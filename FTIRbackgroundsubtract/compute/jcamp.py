@@ -0,0 +1,225 @@
+"""
+Reader for JCAMP-DX spectra (.jdx, .dx), including the compressed ASDF
+forms of (X++(Y..Y)) data.
+
+In ASDF the y values are written with their first digit (and sign) replaced
+by a letter, so they need no separators. SQZ letters start an absolute
+value, DIF letters start a difference from the previous value and DUP
+letters repeat the previous value (or difference). In DIF form the last
+value of each line is repeated at the start of the next as a check.
+
+Rather than walking through the values one at a time, the decoder works
+on the whole data block at once. Each letter is replaced by its digits
+(after a marker number saying whether it is a difference or a repeat), and
+each newline by nan, so that numpy's C parser can read all of the values
+and their kinds in one go. The repeats, differences and checks are then
+resolved with numpy.repeat and cumulative sums.
+"""
+import re
+import warnings
+
+import numpy
+
+
+SQZ_DIGITS = {'@': '0', 'A': '1', 'B': '2', 'C': '3', 'D': '4', 'E': '5', 'F': '6', 'G': '7',
+              'H': '8', 'I': '9', 'a': '-1', 'b': '-2', 'c': '-3', 'd': '-4', 'e': '-5',
+              'f': '-6', 'g': '-7', 'h': '-8', 'i': '-9'}
+DIF_DIGITS = {'%': '0', 'J': '1', 'K': '2', 'L': '3', 'M': '4', 'N': '5', 'O': '6', 'P': '7',
+              'Q': '8', 'R': '9', 'j': '-1', 'k': '-2', 'l': '-3', 'm': '-4', 'n': '-5',
+              'o': '-6', 'p': '-7', 'q': '-8', 'r': '-9'}
+DUP_DIGITS = {'S': '1', 'T': '2', 'U': '3', 'V': '4', 'W': '5', 'X': '6', 'Y': '7', 'Z': '8',
+              's': '9'}
+
+#what each ASDF character is replaced with: its digits, after a marker for
+#DIF and DUP values. The markers are numbers that can't occur in the data,
+#so numpy's parser reads them along with the values, and newlines are
+#marked with nan in the same way.
+_DIF_MARK = b' inf '
+_DUP_MARK = b' -inf '
+_REPLACEMENTS = ([(c, b' ' + d.encode()) for c, d in SQZ_DIGITS.items()] +
+                 [(c, _DIF_MARK + d.encode()) for c, d in DIF_DIGITS.items()] +
+                 [(c, _DUP_MARK + d.encode()) for c, d in DUP_DIGITS.items()])
+
+#the markers contain ASDF letters, so the letters are first translated to
+#bytes above 127 (which can't be in the data) and those are replaced
+_PLACEHOLDERS = bytes(range(128, 128 + len(_REPLACEMENTS)))
+_TO_PLACEHOLDERS = bytes.maketrans(''.join(c for c, r in _REPLACEMENTS).encode(),
+                                   _PLACEHOLDERS)
+
+#bytes that aren't ASDF characters (for bytes.translate() to delete), with
+#E and e left out as they can also be exponents
+_NOT_ASDF = bytes(c for c in range(256)
+                  if chr(c) not in SQZ_DIGITS and chr(c) not in DIF_DIGITS
+                  and chr(c) not in DUP_DIGITS or chr(c) in 'Ee')
+#an AFFN number with an exponent, whose E isn't an ASDF character
+_EXPONENT_NUMBER = re.compile(rb'[+-]?\d*\.?\d+[Ee][+-]?\d+')
+#a sign that starts a new value, rather than being part of an exponent
+_SEPARATING_SIGN = re.compile(rb'(?<![Ee])(?=[+-])')
+_COMMENT = re.compile(rb'\$\$[^\n]*')
+
+
+def sniff(data):
+    """
+    Returns True if 'data' (the first bytes of a file) looks like a
+    JCAMP-DX file.
+    """
+    return data.lstrip()[:2] == b'##'
+
+
+def _parse_number(value):
+    return float(value.strip().split()[0].replace(b',', b'.'))
+
+
+def _split_records(data):
+    #yields (label, value, data lines) of the labelled data records, with
+    #the labels normalised as the standard describes
+    data = data.replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+    if b'$$' in data:
+        data = _COMMENT.sub(b'', data)
+    for record in (b'\n' + data.lstrip()).split(b'\n##')[1:]:
+        label, _, rest = record.partition(b'=')
+        value, _, lines = rest.partition(b'\n')
+        label = re.sub(rb'[\s\-/_]', b'', label).upper().decode('ascii', 'replace')
+        yield label, value.strip(), lines
+
+
+def _read_values(block):
+    #parses a block of plain numbers separated by spaces, commas,
+    #semicolons or signs
+    block = block.replace(b',', b' ').replace(b';', b' ')
+    if b'E' in block or b'e' in block:
+        block = _SEPARATING_SIGN.sub(b' ', block)
+    else:
+        block = block.replace(b'+', b' +').replace(b'-', b' -')
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', DeprecationWarning)
+        try:
+            return numpy.fromstring(block, dtype=numpy.float64, sep=' ')
+        except (DeprecationWarning, ValueError):
+            raise ValueError("JCAMP-DX data contains values that are not numbers")
+
+
+def is_asdf(block):
+    """
+    Returns True if a block of (X++(Y..Y)) data is in one of the ASDF forms
+    rather than plain numbers (AFFN).
+    """
+    if block.translate(None, _NOT_ASDF):
+        return True
+    if b'E' not in block and b'e' not in block:
+        return False
+    #any E left once the numbers with exponents are taken out is SQZ
+    rest = _EXPONENT_NUMBER.sub(b' ', block)
+    return b'E' in rest or b'e' in rest
+
+
+def decode_xydata(block):
+    """
+    Decodes the data lines of an (X++(Y..Y)) table, in AFFN or any of the
+    ASDF forms, and returns the array of y values (without the x values at
+    the start of each line, or the y checks).
+    """
+    if is_asdf(block):
+        block = block.translate(_TO_PLACEHOLDERS)
+        for placeholder, (c, replacement) in zip(_PLACEHOLDERS, _REPLACEMENTS):
+            block = block.replace(bytes((placeholder,)), replacement)
+    values = _read_values(block.replace(b'\n', b' nan '))
+
+    #the markers say what the value after them is, and which line it is on
+    is_nan = numpy.isnan(values)
+    is_value = numpy.isfinite(values)
+    idx = numpy.flatnonzero(is_value)
+    lines = numpy.cumsum(is_nan)[idx]
+    before = numpy.full(len(idx), numpy.nan)
+    before[idx > 0] = values[idx[idx > 0] - 1]
+    is_dif = before == numpy.inf
+    is_dup = before == -numpy.inf
+    values = values[idx]
+    if len(values) == 0:
+        return values
+
+    #the x value at the start of each line isn't needed
+    is_x = numpy.ones(len(lines), dtype=bool)
+    is_x[1:] = lines[1:] != lines[:-1]
+    if numpy.any(is_x & (is_dif | is_dup)):
+        raise ValueError("JCAMP-DX line starts with a difference or repeat count")
+
+    #expand the repeats: DUP n means the value before it occurs n times
+    if numpy.any(is_dup):
+        if numpy.any(is_dup[1:] & (is_dup[:-1] | is_x[:-1])):
+            raise ValueError("JCAMP-DX data has a repeat count in the wrong place")
+        counts = numpy.ones(len(values), dtype=numpy.int64)
+        dup_idx = numpy.flatnonzero(is_dup)
+        counts[dup_idx - 1] = values[dup_idx].astype(numpy.int64)
+        keep = ~is_dup
+        counts = counts[keep]
+        values = numpy.repeat(values[keep], counts)
+        is_dif = numpy.repeat(is_dif[keep], counts)
+        lines = numpy.repeat(lines[keep], counts)
+        is_x = numpy.repeat(is_x[keep], counts)
+
+    keep = ~is_x
+    values = values[keep]
+    is_dif = is_dif[keep]
+    lines = lines[keep]
+    if len(values) == 0:
+        return values
+
+    #each absolute value starts a run of differences, which are summed
+    if is_dif[0]:
+        raise ValueError("JCAMP-DX data starts with a difference")
+    is_abs = ~is_dif
+    abs_idx = numpy.flatnonzero(is_abs)
+    total = numpy.cumsum(values)
+    run = numpy.cumsum(is_abs) - 1
+    y = total - (total[abs_idx] - values[abs_idx])[run]
+
+    #a line that follows one ending in a difference starts with a check
+    #value, a repeat of the last y value
+    check = numpy.zeros(len(lines), dtype=bool)
+    check[1:] = (lines[1:] != lines[:-1]) & is_dif[:-1]
+    return y[~check]
+
+
+def parse(data):
+    """
+    Reads the first spectrum in a JCAMP-DX file, from an (X++(Y..Y)) table
+    or a list of (XY..XY) pairs. Returns (x, y, y_units) where y_units is
+    the YUNITS of the file in lower case.
+    """
+    header = {}
+    x = y = None
+    for label, value, lines in _split_records(data):
+        if label in ('XYDATA', 'XYPOINTS', 'PEAKTABLE'):
+            form = value.replace(b' ', b'').upper()
+            xfactor = _parse_number(header.get('XFACTOR', b'1'))
+            yfactor = _parse_number(header.get('YFACTOR', b'1'))
+            if form.startswith(b'(X++(Y..Y))'):
+                y = decode_xydata(lines) * yfactor
+                n_points = len(y)
+                if 'NPOINTS' in header:
+                    n_points = int(_parse_number(header['NPOINTS']))
+                    if n_points != len(y):
+                        raise ValueError("JCAMP-DX data has %d points but NPOINTS is %d"
+                                         % (len(y), n_points))
+                try:
+                    first = _parse_number(header['FIRSTX'])
+                    last = _parse_number(header['LASTX'])
+                except KeyError:
+                    raise ValueError("JCAMP-DX file has no FIRSTX and LASTX")
+                x = numpy.linspace(first, last, n_points)
+            elif form.startswith(b'(XY..XY)'):
+                values = _read_values(lines)
+                if len(values) % 2:
+                    raise ValueError("JCAMP-DX (XY..XY) data has an odd number of values")
+                x = values[0::2] * xfactor
+                y = values[1::2] * yfactor
+            else:
+                raise ValueError("Unsupported JCAMP-DX data form %r" % value.decode('latin-1'))
+            break
+        header[label] = value
+
+    if y is None:
+        raise ValueError("JCAMP-DX file has no spectrum")
+    y_units = header.get('YUNITS', b'absorbance').decode('latin-1').strip().lower()
+    return x, y, y_units
@@ -0,0 +1,277 @@
+"""
+Fast loading of spectrum files.
+
+Two-column (wavenumber, absorbance) text files are read in one go and
+handed to numpy's C number parser, which fills a single flat buffer. The
+columns are then copied into preallocated contiguous arrays. The delimiter
+(comma, tab, semicolon or whitespace), any header lines and the direction
+of the wavenumber axis are detected automatically.
+
+Spectra can also be read straight from the instrument files, without
+exporting them to text first: Bruker OPUS (compute.opus), Thermo OMNIC .spa
+(compute.spa) and JCAMP-DX (compute.jcamp). The format is worked out from
+the first bytes of the file (see READERS), so the file name doesn't matter.
+Transmittance spectra are converted to absorbance.
+
+Files compressed with gzip, bzip2, xz or zstd (e.g. spectrum.csv.gz) are
+decompressed in memory by parse_spectrum(), see compute.archive, which also
+reads tar and zip archives of spectra.
+"""
+import os
+import warnings
+import numpy
+
+from FTIRbackgroundsubtract.compute import jcamp, opus, spa
+from FTIRbackgroundsubtract.compute.archive import (DEFAULT_MAX_SIZE, decompress, is_archive_filename,
+                                                   strip_compression)
+
+
+#lines to look at when sniffing the delimiter and the header
+SNIFF_LINES = 50
+
+
+class SpectrumFormat:
+    """
+    Description of the layout of a text spectrum file, as found by
+    sniff_format().
+
+        * delimiter - the column delimiter (None means any whitespace)
+        * n_header - number of header lines before the first row of numbers
+        * n_cols - number of columns in each row
+    """
+    def __init__(self, delimiter, n_header, n_cols):
+        self.delimiter = delimiter
+        self.n_header = n_header
+        self.n_cols = n_cols
+
+    def __repr__(self):
+        return "SpectrumFormat(delimiter=%r, n_header=%d, n_cols=%d)"%(self.delimiter, self.n_header, self.n_cols)
+
+
+def _is_number(s):
+    try:
+        float(s)
+        return True
+    except ValueError:
+        return False
+
+
+def _split(line, delimiter):
+    if delimiter is None:
+        return line.split()
+    return [f.strip() for f in line.split(delimiter)]
+
+
+def sniff_format(lines):
+    """
+    Works out the delimiter, number of header lines and number of columns
+    from the first few lines of a spectrum file.
+
+        * lines - list of text lines (str) from the start of the file
+
+    Raises ValueError if no row of numbers can be found.
+    """
+    for n_header, line in enumerate(lines):
+        line = line.strip()
+        if not line:
+            continue
+
+        for delimiter in (',', '\t', ';', None):
+            if delimiter is not None and delimiter not in line:
+                continue
+            fields = [f for f in _split(line, delimiter) if f]
+            if len(fields) >= 2 and all(_is_number(f) for f in fields):
+                return SpectrumFormat(delimiter, n_header, len(fields))
+
+    raise ValueError("Could not find any rows of numbers to load")
+
+
+def _parse_text(data):
+    #reads a text file of columns, returning (wavenumber, absorbance, units)
+    #as strided views of the first two columns
+
+    #skip a UTF-8 byte order mark if Excel left one behind
+    if data.startswith(b'\xef\xbb\xbf'):
+        data = data[3:]
+
+    #bytes.splitlines() only splits on \n, \r\n and \r, so the lengths of
+    #the lines give the offset of the end of the header
+    head = data[:4096 * 4].splitlines(keepends=True)[:SNIFF_LINES]
+    fmt = sniff_format([line.decode('latin-1') for line in head])
+
+    body = data
+    if fmt.n_header:
+        if not head[fmt.n_header - 1].endswith((b'\n', b'\r')):
+            raise ValueError("Spectrum file header has no line break before the data")
+        body = data[sum(len(line) for line in head[:fmt.n_header]):]
+
+    if fmt.delimiter is not None:
+        body = body.replace(fmt.delimiter.encode(), b' ')
+
+    #numpy's text parser only warns (and stops) if it hits something that
+    #isn't a number - we want that to be an error instead
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', DeprecationWarning)
+        try:
+            values = numpy.fromstring(body, dtype=numpy.float64, sep=' ')
+        except (DeprecationWarning, ValueError):
+            raise ValueError("Spectrum file contains values that are not numbers")
+
+    #the values are read as one stream, so check that each row had its own
+    if values.size % fmt.n_cols or numpy.any(_row_lengths(body) != fmt.n_cols):
+        raise ValueError("Spectrum file has rows with missing values")
+
+    return values[0::fmt.n_cols], values[1::fmt.n_cols], 'absorbance'
+
+
+def _row_lengths(body):
+    #the number of values on each non-blank line of 'body', once the
+    #delimiters have been replaced with spaces
+    chars = numpy.frombuffer(body, dtype=numpy.uint8)
+    is_space = chars <= ord(' ')
+    #the offsets of the first character of each value
+    starts = numpy.flatnonzero(is_space[:-1] > is_space[1:]) + 1
+    if chars.size and not is_space[0]:
+        starts = numpy.concatenate(([0], starts))
+    #\r\n line endings are split on the \n, and the \r is a space
+    breaks = numpy.flatnonzero(chars == ord('\n' if b'\n' in body else '\r'))
+    counts = numpy.diff(numpy.searchsorted(starts, breaks), prepend=0, append=starts.size)
+    return counts[counts > 0]
+
+
+class SpectrumReader:
+    """
+    A spectrum file format.
+
+        * name - name of the format
+        * extensions - file extensions that the format uses (lower case)
+        * sniff - function of the first SNIFF_BYTES of a file that returns
+                  True if the file is in this format
+        * parse - function of the contents of a file that returns (x, y,
+                  y_units), where y_units is e.g. 'absorbance' or
+                  'transmittance'
+    """
+    def __init__(self, name, extensions, sniff, parse):
+        self.name = name
+        self.extensions = tuple(extensions)
+        self.sniff = sniff
+        self.parse = parse
+
+    def __repr__(self):
+        return "SpectrumReader(%r)" % self.name
+
+
+#bytes looked at to recognise a format
+SNIFF_BYTES = 64
+
+#the binary formats are tried first, as they have magic numbers, and text
+#(which accepts anything) last
+READERS = [
+    SpectrumReader('opus', (), opus.sniff, opus.parse),
+    SpectrumReader('spa', ('.spa',), spa.sniff, spa.parse),
+    SpectrumReader('jcamp', ('.jdx', '.dx', '.jcm'), jcamp.sniff, jcamp.parse),
+    SpectrumReader('text', ('.csv', '.txt', '.dpt'), lambda head: True, _parse_text),
+]
+
+
+def register_reader(reader):
+    """
+    Adds a SpectrumReader, which is tried before the built in formats.
+    """
+    READERS.insert(0, reader)
+
+
+def get_reader(data):
+    """
+    Returns the SpectrumReader for a file, given its contents (or at least
+    its first SNIFF_BYTES).
+    """
+    head = data[:SNIFF_BYTES]
+    for reader in READERS:
+        if reader.sniff(head):
+            return reader
+    raise ValueError("Unrecognised spectrum file format")
+
+
+def is_spectrum_filename(filename):
+    """
+    Returns True if 'filename' has the extension of one of the formats that
+    can be read, with or without a compression extension (e.g. .csv.gz).
+    OPUS files are numbered (.0, .1, ...). Archives aren't counted as
+    spectra.
+    """
+    if is_archive_filename(filename):
+        return False
+    ext = os.path.splitext(strip_compression(filename))[1].lower()
+    if ext[1:].isdigit():
+        return True
+    return any(ext in r.extensions for r in READERS)
+
+
+def to_absorbance(y, y_units):
+    """
+    Converts spectrum values in 'y_units' to absorbance. Transmittance is
+    taken to be in percent if any value is over 2. Units that can't be
+    converted (e.g. a single channel spectrum) are returned as they are,
+    with a warning.
+    """
+    y_units = y_units.lower()
+    if y_units == 'absorbance':
+        return y
+    if 'transmittance' in y_units:
+        if 'percent' in y_units or '%' in y_units or numpy.max(y, initial=0) > 2:
+            y = y * 0.01
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            return -numpy.log10(y)
+    warnings.warn("Spectrum is in %s, not absorbance" % y_units)
+    return y
+
+
+def parse_spectrum(data, dtype=numpy.float64, order=None, max_size=DEFAULT_MAX_SIZE):
+    """
+    Parses the contents of a spectrum file, in any of the formats in
+    READERS, into wavenumber and absorbance arrays.
+
+        * data - the file contents as bytes, which may be compressed
+        * dtype - dtype of the returned arrays
+        * order - None to keep the order of the file, or 'ascending' /
+                  'descending' to return the wavenumber axis in that order
+        * max_size - largest size (bytes) that compressed contents may
+                     decompress to, or None for no limit
+
+    Returns a tuple of contiguous arrays (wavenumber, absorbance).
+    """
+    if order not in (None, 'ascending', 'descending'):
+        raise ValueError("order must be None, 'ascending' or 'descending'")
+
+    data = decompress(data, max_size)
+    x, y, y_units = get_reader(data).parse(data)
+    y = to_absorbance(y, y_units)
+    n_rows = len(x)
+
+    #copy the columns into preallocated contiguous arrays
+    wavenumber = numpy.empty(n_rows, dtype=dtype)
+    absorbance = numpy.empty(n_rows, dtype=dtype)
+
+    step = 1
+    if n_rows > 1 and order is not None:
+        is_ascending = x[0] < x[-1]
+        if is_ascending != (order == 'ascending'):
+            step = -1
+
+    wavenumber[:] = x[::step]
+    absorbance[:] = y[::step]
+
+    return wavenumber, absorbance
+
+
+def load_spectrum(filename, dtype=numpy.float64, order=None):
+    """
+    Loads a spectrum file, either text containing columns of wavenumber and
+    absorbance or one of the instrument formats, and may be compressed.
+    See parse_spectrum() for a description of the arguments.
+    """
+    #parse_spectrum() decompresses the contents if they are compressed
+    with open(filename, 'rb') as ifp:
+        data = ifp.read()
+    return parse_spectrum(data, dtype=dtype, order=order)
@@ -0,0 +1,160 @@
+"""
+Measurements of a background-subtracted absorption peak: its height,
+position, integrated area, full width at half maximum and centroid.
+
+The functions work on a single spectrum or on a 2-D batch of spectra (one
+per row) sharing a wavenumber axis, and are vectorised over both the points
+and the spectra.
+"""
+import numpy
+
+
+class PeakMetrics:
+    """
+    The measurements of one peak, or arrays of them for a batch of spectra.
+    Quantities that can't be measured (e.g. the FWHM of a peak that doesn't
+    drop to half its height within the limits) are NaN.
+
+     * height - maximum of the background-subtracted absorbance
+     * position - wavenumber of the maximum
+     * area - integrated absorbance (trapezoidal rule, cm-1)
+     * fwhm - full width at half maximum (cm-1)
+     * centroid - absorbance-weighted mean wavenumber
+    """
+    def __init__(self, height, position, area, fwhm, centroid):
+        self.height = height
+        self.position = position
+        self.area = area
+        self.fwhm = fwhm
+        self.centroid = centroid
+
+    def __repr__(self):
+        return ("PeakMetrics(height=%s, position=%s, area=%s, fwhm=%s, centroid=%s)"
+                % (self.height, self.position, self.area, self.fwhm, self.centroid))
+
+    def as_dict(self):
+        return {'height': self.height, 'position': self.position, 'area': self.area,
+                'fwhm': self.fwhm, 'centroid': self.centroid}
+
+
+def _half_crossing(x, y, i0, i1, half):
+    #wavenumber where the line from point i0 to i1 crosses 'half'
+    rows = numpy.arange(y.shape[0])
+    if x.ndim == 1:
+        x0, x1 = x[i0], x[i1]
+    else:
+        x0, x1 = x[rows, i0], x[rows, i1]
+    y0, y1 = y[rows, i0], y[rows, i1]
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        t = (half - y0) / (y1 - y0)
+    return x0 + t * (x1 - x0)
+
+
+def _trapezoid_weights(x):
+    #weights w such that y @ w is the trapezoidal integral of y over x
+    dx = numpy.abs(numpy.diff(x))
+    w = numpy.zeros(len(x))
+    w[1:] += 0.5 * dx
+    w[:-1] += 0.5 * dx
+    return w
+
+
+def _fwhm(x, y, imax, half, mask=None):
+    #the nearest points either side of the maximum that are below half of
+    #it, interpolating linearly between them and their neighbours
+    n_spectra, n_points = y.shape
+    if n_points < 2:
+        return numpy.full(n_spectra, numpy.nan)
+    idx = numpy.arange(n_points)
+    below = y < half[:, numpy.newaxis]
+    if mask is not None:
+        below &= mask
+    before = below & (idx < imax[:, numpy.newaxis])
+    after = below & (idx > imax[:, numpy.newaxis])
+
+    #argmax of a boolean array finds the first True
+    left = n_points - 1 - numpy.argmax(before[:, ::-1], axis=1)
+    right = numpy.argmax(after, axis=1)
+    found = before.any(axis=1) & after.any(axis=1)
+
+    left = numpy.minimum(left, n_points - 2)
+    right = numpy.maximum(right, 1)
+    x_left = _half_crossing(x, y, left, left + 1, half)
+    x_right = _half_crossing(x, y, right - 1, right, half)
+    return numpy.where(found, numpy.abs(x_right - x_left), numpy.nan)
+
+
+def peak_metrics(wavenum, subtracted, lowlim=None, highlim=None):
+    """
+    Measures the peak in the background-subtracted spectra between lowlim
+    and highlim (which default to the whole spectrum). Returns a
+    PeakMetrics of scalars if 'subtracted' is 1-D, or of arrays with one
+    value per row if it is 2-D.
+
+        * wavenum - monotonic wavenumber array, either 1-D (shared by all
+                    of the spectra) or the same shape as 'subtracted'
+        * subtracted - background-subtracted absorbance
+        * lowlim, highlim - wavenumber range to measure the peak in
+    """
+    y = numpy.asarray(subtracted, dtype=float)
+    single = y.ndim == 1
+    y = numpy.atleast_2d(y)
+    x = numpy.asarray(wavenum, dtype=float)
+    if single:
+        x = x.reshape(-1)
+
+    if lowlim is None:
+        lowlim = numpy.min(x)
+    if highlim is None:
+        highlim = numpy.max(x)
+    lo, hi = min(lowlim, highlim), max(lowlim, highlim)
+
+    if x.ndim == 1:
+        #shared axis: the points inside the limits are a contiguous block,
+        #so take a view of them rather than masking
+        inside = numpy.flatnonzero((x >= lo) & (x <= hi))
+        s = slice(inside[0], inside[-1] + 1) if len(inside) else slice(0, 0)
+        x = x[s]
+        y = y[:, s]
+        mask = None
+        has_points = numpy.full(y.shape[0], len(inside) > 0)
+    else:
+        mask = (x >= lo) & (x <= hi)
+        has_points = mask.any(axis=1)
+    n_spectra, n_points = y.shape
+    rows = numpy.arange(n_spectra)
+
+    if n_points == 0:
+        nans = numpy.full(n_spectra, numpy.nan)
+        metrics = (nans,) * 5
+    else:
+        #height and position
+        if mask is None:
+            imax = numpy.argmax(y, axis=1)
+            position = x[imax]
+        else:
+            imax = numpy.argmax(numpy.where(mask, y, -numpy.inf), axis=1)
+            position = numpy.where(has_points, x[rows, imax], numpy.nan)
+        height = numpy.where(has_points, y[rows, imax], numpy.nan)
+
+        #area and centroid by the trapezoidal rule
+        if mask is None:
+            w = _trapezoid_weights(x)
+            area = y @ w
+            moment = y @ (x * w)
+        else:
+            dx = numpy.abs(numpy.diff(x, axis=1))
+            seg = mask[:, 1:] & mask[:, :-1]
+            area = numpy.sum(numpy.where(seg, 0.5 * (y[:, 1:] + y[:, :-1]) * dx, 0.0), axis=1)
+            xy = x * y
+            moment = numpy.sum(numpy.where(seg, 0.5 * (xy[:, 1:] + xy[:, :-1]) * dx, 0.0), axis=1)
+            area = numpy.where(has_points, area, numpy.nan)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            centroid = numpy.where(area != 0, moment / area, numpy.nan)
+
+        fwhm = _fwhm(x, y, imax, 0.5 * height, mask)
+        metrics = (height, position, area, fwhm, centroid)
+
+    if single:
+        return PeakMetrics(*[float(m[0]) for m in metrics])
+    return PeakMetrics(*metrics)
@@ -0,0 +1,201 @@
+"""
+Prefix moment tables for refitting polynomial backgrounds when the fit
+limits move.
+
+The normal equations of a least squares polynomial fit only need the sums
+of x**k and x**k * y over the points in the fit. If cumulative sums of
+these are tabulated over the sorted axis once, the normal equations for any
+window (minus any exclusion window) can be assembled without looking at
+the points again.
+
+Sums of high powers over a long axis cancel badly when they are
+differenced, so the tables are kept per block of BLOCK_SIZE points, each
+relative to the centre of its block. The moments of a window are put
+together from its partial end blocks and the totals of the whole blocks in
+between, each shifted to the centre of the window with the binomial
+theorem. This costs O(n_blocks * order**2) per window, and windows shorter
+than a couple of blocks are summed directly.
+"""
+import math
+import numpy
+
+from FTIRbackgroundsubtract.compute.fitting import scale_axis, unscale_coeffs
+
+
+BLOCK_SIZE = 1024
+
+#the highest order of fit used by the suggested limits
+DEFAULT_MAX_ORDER = 5
+
+
+def _binomial_matrix(n):
+    b = numpy.zeros((n, n))
+    for p in range(n):
+        for q in range(p + 1):
+            b[p, q] = math.comb(p, q)
+    return b
+
+
+class PrefixMoments:
+    """
+    Tables of the moments of x and y from which the normal equations of a
+    polynomial fit over any range of x can be built in constant time.
+
+        * x - x values (need not be sorted)
+        * y - corresponding y values
+        * max_order - highest order of polynomial that will be fitted
+    """
+    def __init__(self, x, y, max_order=DEFAULT_MAX_ORDER):
+        self.max_order = max_order
+        self.n_moments = 2 * max_order + 1
+
+        #index that sorts the original axis
+        self.sort_index = numpy.argsort(x, kind='stable')
+        self.x = numpy.asarray(x, dtype=numpy.float64)[self.sort_index]
+        self.y = numpy.asarray(y, dtype=numpy.float64)[self.sort_index]
+        self.centre, self.scale = scale_axis(self.x)
+        self.t = (self.x - self.centre) / self.scale
+
+        n = len(self.x)
+        n_blocks = max(1, -(-n // BLOCK_SIZE))
+        starts = numpy.arange(n_blocks) * BLOCK_SIZE
+        ends = numpy.minimum(starts + BLOCK_SIZE, n) - 1
+        self.block_centres = 0.5 * (self.t[starts] + self.t[numpy.maximum(ends, starts)])
+
+        #(n_blocks, BLOCK_SIZE + 1, n_moments) cumulative sums within each
+        #block, relative to the block centre. The padding at the end of the
+        #last block is zero so it doesn't contribute.
+        padded_t = numpy.zeros(n_blocks * BLOCK_SIZE)
+        padded_y = numpy.zeros(n_blocks * BLOCK_SIZE)
+        padded_t[:n] = self.t - numpy.repeat(self.block_centres, BLOCK_SIZE)[:n]
+        padded_y[:n] = self.y
+        powers = padded_t[:, numpy.newaxis] ** numpy.arange(self.n_moments)
+        powers[n:] = 0
+        powers = powers.reshape(n_blocks, BLOCK_SIZE, self.n_moments)
+
+        self.cum_x = numpy.zeros((n_blocks, BLOCK_SIZE + 1, self.n_moments))
+        self.cum_y = numpy.zeros((n_blocks, BLOCK_SIZE + 1, max_order + 1))
+        numpy.cumsum(powers, axis=1, out=self.cum_x[:, 1:])
+        numpy.cumsum(powers[:, :, :max_order + 1] * padded_y.reshape(n_blocks, BLOCK_SIZE, 1),
+                     axis=1, out=self.cum_y[:, 1:])
+
+        self.__binomial = _binomial_matrix(self.n_moments)
+
+    @property
+    def nbytes(self):
+        """
+        Memory used by the tables, in bytes.
+        """
+        return sum(a.nbytes for a in (self.sort_index, self.x, self.y, self.t,
+                                      self.block_centres, self.cum_x, self.cum_y))
+
+
+    def index_range(self, lo, hi):
+        """
+        Returns the (start, stop) indices into the sorted axis of the points
+        with lo < x < hi.
+        """
+        return (int(numpy.searchsorted(self.x, lo, side='right')),
+                int(numpy.searchsorted(self.x, hi, side='left')))
+
+
+    def range_moments(self, start, stop, tau):
+        """
+        Returns the sums of (t - tau)**p for p = 0..2*max_order, and of
+        (t - tau)**p * y for p = 0..max_order, over the sorted points
+        start:stop, where t is the scaled axis self.t.
+        """
+        if stop - start <= 2 * BLOCK_SIZE:
+            d = self.t[start:stop] - tau
+            powers = d[:, numpy.newaxis] ** numpy.arange(self.n_moments)
+            return powers.sum(axis=0), self.y[start:stop] @ powers[:, :self.max_order + 1]
+
+        b0, off0 = divmod(start, BLOCK_SIZE)
+        b1, off1 = divmod(stop, BLOCK_SIZE)
+
+        #moments of the partial first block, the whole blocks and the partial
+        #last block, each relative to the centre of its own block
+        mx = [self.cum_x[b0, BLOCK_SIZE] - self.cum_x[b0, off0]]
+        my = [self.cum_y[b0, BLOCK_SIZE] - self.cum_y[b0, off0]]
+        mx.extend(self.cum_x[b0 + 1:b1, BLOCK_SIZE])
+        my.extend(self.cum_y[b0 + 1:b1, BLOCK_SIZE])
+        blocks = list(range(b0, b1))
+        if off1 > 0:
+            mx.append(self.cum_x[b1, off1])
+            my.append(self.cum_y[b1, off1])
+            blocks.append(b1)
+
+        #shift them all to tau: sum (d + s)**p = sum_q binom(p, q) * s**(p - q) * sum d**q
+        shift = self.block_centres[blocks] - tau
+        shift_pows = shift[:, numpy.newaxis] ** numpy.arange(self.n_moments)
+        p, q = numpy.tril_indices(self.n_moments)
+        transform = numpy.zeros((len(blocks), self.n_moments, self.n_moments))
+        transform[:, p, q] = self.__binomial[p, q] * shift_pows[:, p - q]
+
+        n_y = self.max_order + 1
+        sx = numpy.einsum('bpq,bq->p', transform, numpy.array(mx))
+        sy = numpy.einsum('bpq,bq->p', transform[:, :n_y, :n_y], numpy.array(my))
+        return sx, sy
+
+
+    def normal_equations(self, lo, hi, excl_lo, excl_hi, order):
+        """
+        Returns the normal equations for a fit of a polynomial of 'order' to
+        the points with lo < x < hi, excluding those with excl_lo < x <
+        excl_hi.
+
+        Returns (gram, rhs, centre, scale, n_points). gram and rhs are for
+        the fit of the coefficients (highest power first) of a polynomial in
+        (x - centre) / scale, where centre and scale are those of
+        fitting.scale_axis() for the points in the fit.
+        """
+        if order > self.max_order:
+            raise ValueError("Moments were only tabulated for fits of up to order %d"%self.max_order)
+
+        start, stop = self.index_range(lo, hi)
+        e_start, e_stop = self.index_range(excl_lo, excl_hi)
+        e_start = min(max(e_start, start), stop)
+        e_stop = max(min(e_stop, stop), e_start)
+
+        ranges = [r for r in ((start, e_start), (e_stop, stop)) if r[1] > r[0]]
+        n_points = sum(r[1] - r[0] for r in ranges)
+        if n_points == 0:
+            return None, None, None, None, 0
+
+        #work in the frame that the points span, so that the equations are
+        #well conditioned whatever the size of the window
+        t_lo = self.t[ranges[0][0]]
+        t_hi = self.t[ranges[-1][1] - 1]
+        centre, scale = scale_axis(numpy.array([self.x[ranges[0][0]], self.x[ranges[-1][1] - 1]]))
+        tau = 0.5 * (t_hi + t_lo)
+        half_width = 0.5 * (t_hi - t_lo)
+        if half_width == 0:
+            half_width = 1.0 / self.scale
+
+        sx = numpy.zeros(self.n_moments)
+        sy = numpy.zeros(self.max_order + 1)
+        for r in ranges:
+            mx, my = self.range_moments(r[0], r[1], tau)
+            sx += mx
+            sy += my
+
+        #rescale from t to (x - centre) / scale
+        sx /= half_width ** numpy.arange(self.n_moments)
+        sy /= half_width ** numpy.arange(self.max_order + 1)
+
+        powers = numpy.arange(order, -1, -1)
+        gram = sx[powers[:, numpy.newaxis] + powers[numpy.newaxis, :]]
+        rhs = sy[powers]
+        return gram, rhs, centre, scale, n_points
+
+
+    def fit(self, lo, hi, excl_lo, excl_hi, order):
+        """
+        Returns the least squares polynomial coefficients (highest power
+        first, as numpy.polyfit) for the points with lo < x < hi, excluding
+        those with excl_lo < x < excl_hi. No outliers are rejected.
+        """
+        gram, rhs, centre, scale, n_points = self.normal_equations(lo, hi, excl_lo, excl_hi, order)
+        if n_points < order + 1:
+            raise ValueError("Not enough background points to fit a polynomial of order %d"%order)
+        return unscale_coeffs(numpy.linalg.solve(gram, rhs), centre, scale)
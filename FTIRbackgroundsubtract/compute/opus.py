@@ -0,0 +1,120 @@
+"""
+Reader for Bruker OPUS binary files (which are named e.g. sample.0,
+sample.1, ...).
+
+An OPUS file starts with a directory of blocks. Each entry gives the type,
+length and offset of a block: the spectra are float32 arrays, and each has a
+parameter block that gives its number of points (NPT), the first and last
+x values (FXV, LXV) and a y scaling factor (CSF). Everything is read
+straight out of the file's bytes with struct and numpy.frombuffer.
+"""
+import struct
+
+import numpy
+
+
+MAGIC = b'\x0a\x0a\x0a\x0a'
+
+#the first directory entry and the size of each entry
+DIRECTORY_POINTER = struct.Struct('<i')
+DIRECTORY_ENTRY = struct.Struct('<BBBBii')
+
+#data types (first byte of a directory entry) of the spectra that can be
+#read, best first. The parameters of a spectrum are in the block with
+#PARAMS_OFFSET added to its data type.
+SPECTRUM_TYPES = {15: 'absorbance', 7: 'single channel', 11: 'reference'}
+PARAMS_OFFSET = 16
+
+#parameter value types
+PARAM_INT = 0
+PARAM_FLOAT = 1
+PARAM_HEADER = struct.Struct('<4shh')
+
+
+def sniff(data):
+    """
+    Returns True if 'data' (the first bytes of a file) looks like an OPUS
+    file.
+    """
+    return data[:4] == MAGIC
+
+
+def read_directory(data):
+    """
+    Returns the directory of an OPUS file as a list of (data type, channel
+    type, text type, offset, length in bytes).
+    """
+    if len(data) < 24 or not sniff(data):
+        raise ValueError("Not an OPUS file")
+    (pointer,) = DIRECTORY_POINTER.unpack_from(data, 12)
+    (n_entries,) = DIRECTORY_POINTER.unpack_from(data, 20)
+    if pointer < 24 or pointer + n_entries * DIRECTORY_ENTRY.size > len(data):
+        raise ValueError("OPUS file has a corrupt directory")
+
+    entries = []
+    for i in range(n_entries):
+        data_type, channel_type, text_type, _, length, offset = DIRECTORY_ENTRY.unpack_from(
+            data, pointer + i * DIRECTORY_ENTRY.size)
+        if offset <= 0:
+            break
+        entries.append((data_type, channel_type, text_type, offset, 4 * length))
+    return entries
+
+
+def read_parameters(data, offset, length):
+    """
+    Returns the parameters in a parameter block as a dict mapping their
+    three letter names to their values.
+    """
+    params = {}
+    pos = offset
+    end = min(offset + length, len(data))
+    while pos + PARAM_HEADER.size <= end:
+        name, value_type, size = PARAM_HEADER.unpack_from(data, pos)
+        name = name.rstrip(b'\0').decode('ascii', 'replace')
+        pos += PARAM_HEADER.size
+        if name == 'END':
+            break
+        raw = data[pos:pos + 2 * size]
+        pos += 2 * size
+        if value_type == PARAM_INT and len(raw) >= 4:
+            params[name] = struct.unpack_from('<i', raw)[0]
+        elif value_type == PARAM_FLOAT and len(raw) >= 8:
+            params[name] = struct.unpack_from('<d', raw)[0]
+        else:
+            params[name] = raw.split(b'\0', 1)[0].decode('latin-1')
+    return params
+
+
+def parse(data):
+    """
+    Reads the spectrum in an OPUS file, preferring the absorbance spectrum.
+    Returns (x, y, y_units) where y_units is the kind of spectrum (see
+    SPECTRUM_TYPES).
+    """
+    entries = read_directory(data)
+    blocks = {}
+    for data_type, channel_type, text_type, offset, length in entries:
+        if text_type == 0:
+            blocks.setdefault(data_type, (offset, length))
+
+    for data_type, kind in SPECTRUM_TYPES.items():
+        if data_type in blocks and data_type + PARAMS_OFFSET in blocks:
+            break
+    else:
+        raise ValueError("OPUS file has no spectrum")
+
+    params = read_parameters(data, *blocks[data_type + PARAMS_OFFSET])
+    try:
+        n_points = int(params['NPT'])
+        first, last = float(params['FXV']), float(params['LXV'])
+    except KeyError as e:
+        raise ValueError("OPUS spectrum is missing the parameter %s" % e)
+    offset, length = blocks[data_type]
+    if n_points * 4 > length or offset + n_points * 4 > len(data):
+        raise ValueError("OPUS spectrum is shorter than its %d points" % n_points)
+
+    y = numpy.frombuffer(data, dtype='<f4', count=n_points, offset=offset).astype(numpy.float64)
+    y *= params.get('CSF', 1.0)
+    x = numpy.linspace(first, last, n_points)
+    return x, y, kind
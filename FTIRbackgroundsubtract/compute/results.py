@@ -0,0 +1,231 @@
+"""
+SQLite store of fitted band results, so that a batch run only has to fit
+the spectra (and bands) that it hasn't seen before.
+
+Results are keyed by a hash of the spectrum file contents, the band
+parameters (bkgd_lowlim, bkgd_highlim, excl_lowlim, excl_highlim,
+bkgd_fit_order) and the outlier rejection options, so renaming or copying a
+file doesn't cause it to be refitted, but editing it does. Each file path is
+also recorded with its mtime and size, so unchanged files are recognised
+without rehashing them.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+import numpy
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    sample TEXT NOT NULL,
+    hash TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_sample ON files (sample);
+CREATE INDEX IF NOT EXISTS files_hash ON files (hash);
+
+CREATE TABLE IF NOT EXISTS results (
+    hash TEXT NOT NULL,
+    bkgd_lowlim REAL NOT NULL,
+    bkgd_highlim REAL NOT NULL,
+    excl_lowlim REAL NOT NULL,
+    excl_highlim REAL NOT NULL,
+    bkgd_fit_order INTEGER NOT NULL,
+    fit_options TEXT NOT NULL,
+    band TEXT,
+    peak_height REAL,
+    coeffs BLOB,
+    ignored_idxs BLOB,
+    n_ignored INTEGER,
+    iterations INTEGER,
+    converged INTEGER,
+    fit_time REAL,
+    error TEXT,
+    created REAL NOT NULL,
+    PRIMARY KEY (hash, bkgd_lowlim, bkgd_highlim, excl_lowlim, excl_highlim,
+                 bkgd_fit_order, fit_options)
+);
+CREATE INDEX IF NOT EXISTS results_band ON results (band);
+CREATE INDEX IF NOT EXISTS results_params ON results (bkgd_lowlim, bkgd_highlim, excl_lowlim,
+                                                      excl_highlim, bkgd_fit_order);
+"""
+
+RESULT_FIELDS = ('hash', 'bkgd_lowlim', 'bkgd_highlim', 'excl_lowlim', 'excl_highlim',
+                 'bkgd_fit_order', 'fit_options', 'band', 'peak_height', 'coeffs',
+                 'ignored_idxs', 'n_ignored', 'iterations', 'converged', 'fit_time',
+                 'error', 'created')
+
+
+def file_digest(data):
+    """
+    Returns the hash (as hex) that spectrum file contents are stored under.
+    """
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def band_key(band):
+    """
+    Returns the (bkgd_lowlim, bkgd_highlim, excl_lowlim, excl_highlim,
+    bkgd_fit_order) tuple that identifies a Band in the store.
+    """
+    return (float(band.bkgd_lowlim), float(band.bkgd_highlim), float(band.excl_lowlim),
+            float(band.excl_highlim), int(band.bkgd_fit_order))
+
+
+def options_key(fit_options):
+    #a canonical string of the ProcessedScan keyword arguments
+    return json.dumps(fit_options or {}, sort_keys=True)
+
+
+class ResultsStore:
+    """
+    Results of band fits, stored in the SQLite database 'path' (created if
+    it doesn't exist).
+
+    Results are returned as dicts with the columns of the results table,
+    with 'coeffs' as a numpy array (highest power first, as numpy.poly1d)
+    and 'ignored_idxs' as an array of indices into the spectrum.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.row_factory = sqlite3.Row
+        #write-ahead logging lets readers (e.g. another run's queries) carry
+        #on while results are being written
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def cached_hash(self, filename):
+        """
+        Returns the recorded content hash of 'filename' if its mtime and size
+        haven't changed since it was recorded, or None, without reading the
+        file. Raises OSError if the file doesn't exist.
+        """
+        path = os.path.abspath(filename)
+        st = os.stat(path)
+        row = self.conn.execute("SELECT hash, mtime_ns, size FROM files WHERE path = ?",
+                                (path,)).fetchone()
+        if row is not None and row['mtime_ns'] == st.st_mtime_ns and row['size'] == st.st_size:
+            return row['hash']
+        return None
+
+    def put_files(self, files):
+        """
+        Records (or replaces) the hashes of files in a single transaction.
+        Each entry is (path, hash, mtime_ns, size). A spectrum in an archive
+        is recorded as 'archive/member' with the mtime and size of the
+        archive. The sample name is the file name without its extension.
+        """
+        rows = []
+        for path, digest, mtime_ns, size in files:
+            path = os.path.abspath(path)
+            sample = os.path.splitext(os.path.basename(path))[0]
+            rows.append((path, sample, digest, mtime_ns, size))
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO files (path, sample, hash, mtime_ns, size) "
+                                  "VALUES (?, ?, ?, ?, ?)", rows)
+
+    def completed(self, bands, fit_options=None):
+        """
+        Returns a dict mapping each content hash to the set of band_key()s of
+        'bands' that already have results (for these fit options).
+        """
+        keys = set(band_key(b) for b in bands)
+        done = {}
+        opts = options_key(fit_options)
+        for key in keys:
+            rows = self.conn.execute(
+                "SELECT hash FROM results WHERE bkgd_lowlim = ? AND bkgd_highlim = ? AND "
+                "excl_lowlim = ? AND excl_highlim = ? AND bkgd_fit_order = ? AND fit_options = ?",
+                key + (opts,))
+            for row in rows:
+                done.setdefault(row['hash'], set()).add(key)
+        return done
+
+    def get(self, digest, band, fit_options=None):
+        """
+        Returns the stored result for a spectrum hash and band, or None.
+        """
+        row = self.conn.execute(
+            "SELECT * FROM results WHERE hash = ? AND bkgd_lowlim = ? AND bkgd_highlim = ? AND "
+            "excl_lowlim = ? AND excl_highlim = ? AND bkgd_fit_order = ? AND fit_options = ?",
+            (digest,) + band_key(band) + (options_key(fit_options),)).fetchone()
+        return None if row is None else _decode(row)
+
+    def put_many(self, records, fit_options=None):
+        """
+        Inserts (or replaces) results in a single transaction. Each record
+        is a dict with 'hash', 'band' (a Band) and any of peak_height,
+        coeffs, ignored_idxs, n_ignored, iterations, converged, fit_time and
+        error.
+        """
+        opts = options_key(fit_options)
+        now = time.time()
+        rows = []
+        for r in records:
+            band = r['band']
+            coeffs = r.get('coeffs')
+            ignored_idxs = r.get('ignored_idxs')
+            converged = r.get('converged')
+            peak_height = r.get('peak_height')
+            rows.append((r['hash'],) + band_key(band) + (
+                opts, band.name,
+                None if peak_height is None else float(peak_height),
+                None if coeffs is None else numpy.asarray(coeffs, dtype='<f8').tobytes(),
+                None if ignored_idxs is None else numpy.asarray(ignored_idxs, dtype='<i8').tobytes(),
+                r.get('n_ignored'), r.get('iterations'),
+                None if converged is None else int(converged),
+                r.get('fit_time'),
+                None if r.get('error') is None else str(r['error']),
+                now))
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO results (%s) VALUES (%s)"
+                                  % (", ".join(RESULT_FIELDS), ", ".join("?" * len(RESULT_FIELDS))),
+                                  rows)
+
+    def query(self, sample=None, band=None):
+        """
+        Returns the stored results, joined with the files they came from,
+        optionally only for one sample (the file name without its
+        extension) and/or one band name. Results whose files aren't
+        recorded have a 'path' and 'sample' of None.
+        """
+        sql = ("SELECT files.path, files.sample, results.* FROM results "
+               "LEFT JOIN files ON files.hash = results.hash")
+        conditions = []
+        args = []
+        if sample is not None:
+            conditions.append("files.sample = ?")
+            args.append(sample)
+        if band is not None:
+            conditions.append("results.band = ?")
+            args.append(band)
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        return [_decode(row) for row in self.conn.execute(sql + " ORDER BY files.path", args)]
+
+
+def _decode(row):
+    result = dict(row)
+    if result['coeffs'] is not None:
+        result['coeffs'] = numpy.frombuffer(result['coeffs'], dtype='<f8')
+    if result['ignored_idxs'] is not None:
+        result['ignored_idxs'] = numpy.frombuffer(result['ignored_idxs'], dtype='<i8')
+    if result['converged'] is not None:
+        result['converged'] = bool(result['converged'])
+    return result
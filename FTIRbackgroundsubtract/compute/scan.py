@@ -0,0 +1,203 @@
+"""
+The ProcessedScan class, which fits a polynomial background to a single
+spectrum.
+"""
+import numpy
+
+from FTIRbackgroundsubtract.compute.loader import load_spectrum
+from FTIRbackgroundsubtract.compute.fitting import background_mask, fit_with_rejection, polynomial_residuals
+from FTIRbackgroundsubtract.compute.moments import PrefixMoments, DEFAULT_MAX_ORDER
+from FTIRbackgroundsubtract.compute.metrics import peak_metrics
+
+
+class ProcessedScan:
+    def __init__(self, wavenum, intensity, bkgd_fit_order=1, bkgd_threshold=5.0,
+                 bkgd_batch_reject=False, bkgd_max_iterations=10000,
+                 bkgd_residual_mode='extremes'):
+        self.__is_calculated = False
+        self.__moments = None
+        
+        self.angles = wavenum   
+        self.col_amount = intensity
+        
+        self.angle_err = numpy.ones_like(wavenum)*5
+        self.col_err = numpy.abs((intensity/100.0)*5)
+        
+        self.bkgd_lowlim = wavenum[-1]
+        self.bkgd_highlim = wavenum[0]
+        self.excl_lowlim = numpy.median(wavenum)
+        self.excl_highlim = numpy.median(wavenum)
+        
+        #background fitting parameters
+        self.bkgd_fit_order = bkgd_fit_order
+        self.bkgd_threshold = bkgd_threshold
+        self.bkgd_batch_reject = bkgd_batch_reject
+        self.bkgd_max_iterations = bkgd_max_iterations
+        self.bkgd_residual_mode = bkgd_residual_mode
+        self.manual_bkgd = True
+   
+    
+    def calculate(self):    
+        self.__calculate_bkgd()
+        return self
+    
+    def get_moments(self, max_order=None):
+        """
+        Returns the PrefixMoments tables of the scan, creating them the first
+        time they are needed (or if they don't go up to 'max_order', which
+        defaults to the current fit order).
+        """
+        if max_order is None:
+            max_order = self.bkgd_fit_order
+        if self.__moments is None or self.__moments.max_order < max_order:
+            self.__moments = PrefixMoments(self.angles, self.col_amount,
+                                           max(DEFAULT_MAX_ORDER, max_order))
+        return self.__moments
+    
+    def fit_bkgd_lims(self, bkgd_lowlim, bkgd_highlim, excl_lowlim, excl_highlim, bkgd_fit_order=None):
+        """
+        Returns a numpy.poly1d of the background fitted between the given
+        limits, without rejecting any points. This takes the same time
+        whatever the number of points in the scan, so it is suitable for
+        previewing fits while the limits are being moved.
+        """
+        if bkgd_fit_order is None:
+            bkgd_fit_order = self.bkgd_fit_order
+        moments = self.get_moments(bkgd_fit_order)
+        return numpy.poly1d(moments.fit(bkgd_lowlim, bkgd_highlim, excl_lowlim,
+                                        excl_highlim, bkgd_fit_order))
+    
+    def get_peak_height(self):
+        """
+        Returns the height of the highest point of the background-subtracted
+        scan between the background limits. calculate() must have been
+        called first.
+        """
+        in_lims = numpy.logical_and(self.angles >= self.bkgd_lowlim, self.angles <= self.bkgd_highlim)
+        return numpy.max(self.col_amount[in_lims] - self.bkgd_func(self.angles[in_lims]))
+    
+    def get_peak_metrics(self):
+        """
+        Returns the PeakMetrics (height, position, area, FWHM and centroid)
+        of the background-subtracted scan between the background limits.
+        calculate() must have been called first.
+        """
+        return peak_metrics(self.angles, self.col_amount - self.bkgd_func(self.angles),
+                            self.bkgd_lowlim, self.bkgd_highlim)
+    
+    def plot_bkgd_fit(self, ax):
+        
+        ignored = list(zip(*self.bkgd_ignored_pts))
+        if ignored:
+            ax.errorbar(ignored[0], ignored[1], ignored[3], ignored[2], 'r+')
+        
+        #subplot_calc.errorbar(not_bkgd_angles,not_bkgd_col_amounts, not_bkgd_col_err, not_bkgd_angle_err,'g+')        
+        ax.errorbar(self.angles[self.bkgd_idxs], self.col_amount[self.bkgd_idxs], self.col_err[self.bkgd_idxs], self.angle_err[self.bkgd_idxs], 'b+')
+        
+        x = numpy.linspace(self.angles[self.bkgd_idxs[0][0]],self.angles[self.bkgd_idxs[0][-1]],2000 )
+        ax.plot(x, [self.bkgd_func(i) for i in x], 'm-', linewidth=2)
+   
+   
+      
+    def __calculate_bkgd(self):
+        
+        #don't allow the background to be bigger than the scan data
+        if self.bkgd_lowlim < min(self.angles[0], self.angles[-1]):
+            self.bkgd_lowlim = min(self.angles[0], self.angles[-1]) 
+        
+        if self.bkgd_highlim > max(self.angles[0], self.angles[-1]):
+            self.bkgd_highlim = max(self.angles[0], self.angles[-1])        
+        
+        self.bkgd_mask = background_mask(self.angles, self.bkgd_lowlim, self.bkgd_highlim,
+                                         self.excl_lowlim, self.excl_highlim)
+        
+        
+        bkgd_idxs = numpy.where(self.bkgd_mask)
+
+        #fit a polynomial through the background, rejecting the points that
+        #can't be fitted within error
+        if self.bkgd_batch_reject:
+            threshold = self.bkgd_threshold
+        else:
+            threshold = None
+
+        #the initial fit comes straight from the moment tables
+        gram, rhs = self.get_moments().normal_equations(self.bkgd_lowlim, self.bkgd_highlim,
+                                                        self.excl_lowlim, self.excl_highlim,
+                                                        self.bkgd_fit_order)[:2]
+
+        fit = fit_with_rejection(self.angles[bkgd_idxs], self.col_amount[bkgd_idxs],
+                                 self.angle_err[bkgd_idxs], self.col_err[bkgd_idxs],
+                                 self.bkgd_fit_order, threshold=threshold,
+                                 max_iterations=self.bkgd_max_iterations,
+                                 residual_mode=self.bkgd_residual_mode,
+                                 gram=gram, rhs=rhs)
+
+        ignored_idxs = bkgd_idxs[0][fit.rejected]
+        ignored_pts = list(zip(self.angles[ignored_idxs], self.col_amount[ignored_idxs],
+                               self.angle_err[ignored_idxs], self.col_err[ignored_idxs]))
+
+        #store the calculated background for all angles
+        self.bkgd_func = numpy.poly1d(fit.coeffs)
+        self.bkgd_ignored_pts = ignored_pts
+        self.bkgd_ignored_idxs = ignored_idxs
+        self.bkgd_idxs = (bkgd_idxs[0][fit.keep],)
+        self.bkgd_iterations = fit.iterations
+        self.bkgd_converged = fit.converged
+        self.bkgd_fit_time = fit.fit_time
+
+
+def find_residuals(x, y, x_err, y_err, func, mode='extremes'):
+    """
+    Calculates the absolute distances of a data series from a trend line.
+    However, any distances that are within the error bars are set 
+    to zero. This makes it easy to see if a trend line fits some data within
+    experimental error. 
+    
+    * x - numpy array of x data
+    * y - numpy array of corresponding y data
+    * x_err - absolute error in x direction (x +- x_err)
+    * y_err - absolute error in y direction (y +- y_err)
+    * func - a numpy.poly1d, or a Python function that describes the trendline
+             such that y_trend = func(x)
+    * mode - 'extremes' to use the smaller of the distances at the extremes of
+             the x error, or 'interval' for the exact smallest distance over the
+             whole x error interval (func must be a numpy.poly1d for this)
+    """
+    x_mins = x - x_err
+    x_maxs = x + x_err
+
+    if isinstance(func, numpy.poly1d):
+        return polynomial_residuals(func.coeffs, x_mins, x_maxs, y, y_err, mode=mode)
+
+    if mode != 'extremes':
+        raise ValueError("mode 'interval' is only supported for numpy.poly1d trend lines")
+
+    #evaluate the distance between the data and the trendline at the extremes of
+    #the x error. Try the whole array at once before falling back to calling
+    #func on each value.
+    try:
+        fit_mins = numpy.asarray(func(x_mins), dtype=numpy.float64)
+        fit_maxs = numpy.asarray(func(x_maxs), dtype=numpy.float64)
+        if fit_mins.shape != numpy.shape(x_mins) or fit_maxs.shape != numpy.shape(x_maxs):
+            raise TypeError
+    except (TypeError, ValueError):
+        fit_func = numpy.frompyfunc(func, 1, 1)
+        fit_mins = fit_func(x_mins).astype(numpy.float64)
+        fit_maxs = fit_func(x_maxs).astype(numpy.float64)
+
+    #get the smallest distance of each point from the fit line
+    resid = numpy.minimum(numpy.abs(y - fit_mins), numpy.abs(y - fit_maxs))
+    
+    #set residuals that are within the error bars to zero
+    resid[numpy.where(resid < y_err)] = 0
+    
+    return resid
+
+
+def load_ftir_file(filename):
+    """
+    Loads a two column (wavenumber, absorbance) spectrum file. See
+    FTIRbackgroundsubtract.compute.loader.load_spectrum().
+    """
+    return load_spectrum(filename)
@@ -0,0 +1,75 @@
+"""
+Reader for Thermo Nicolet OMNIC .spa files.
+
+A .spa file starts with a title and a directory of 16 byte entries, each
+giving the type of a block, its offset and its size. The spectrum header
+block gives the number of points, the units and the first and last x
+values, and the data block is a float32 array of the intensities. Both
+are read straight out of the file's bytes with struct and numpy.frombuffer.
+"""
+import struct
+
+import numpy
+
+
+MAGIC = b'Spectral Data File'
+
+N_ENTRIES = struct.Struct('<H')
+N_ENTRIES_OFFSET = 294
+DIRECTORY_OFFSET = 304
+DIRECTORY_ENTRY = struct.Struct('<BxII')
+DIRECTORY_ENTRY_SIZE = 16
+
+#block types
+HEADER_BLOCK = 2
+DATA_BLOCK = 3
+
+#fields of the spectrum header block: number of points, x units, y units,
+#first x, last x
+HEADER = struct.Struct('<4xI B3x B3x ff')
+
+#y units codes
+Y_UNITS = {17: 'absorbance', 16: 'percent transmittance', 11: 'percent reflectance',
+           12: 'log(1/R)', 20: 'Kubelka-Munk', 15: 'single beam'}
+
+
+def sniff(data):
+    """
+    Returns True if 'data' (the first bytes of a file) looks like a .spa
+    file.
+    """
+    return data.startswith(MAGIC)
+
+
+def parse(data):
+    """
+    Reads the spectrum in a .spa file. Returns (x, y, y_units) where y_units
+    is a name from Y_UNITS (or 'unknown').
+    """
+    if not sniff(data) or len(data) < DIRECTORY_OFFSET:
+        raise ValueError("Not an OMNIC .spa file")
+    (n_entries,) = N_ENTRIES.unpack_from(data, N_ENTRIES_OFFSET)
+
+    blocks = {}
+    for i in range(n_entries):
+        pos = DIRECTORY_OFFSET + i * DIRECTORY_ENTRY_SIZE
+        if pos + DIRECTORY_ENTRY.size > len(data):
+            break
+        key, offset, size = DIRECTORY_ENTRY.unpack_from(data, pos)
+        blocks.setdefault(key, (offset, size))
+    if HEADER_BLOCK not in blocks or DATA_BLOCK not in blocks:
+        raise ValueError(".spa file has no spectrum")
+
+    header_offset = blocks[HEADER_BLOCK][0]
+    if header_offset + HEADER.size > len(data):
+        raise ValueError(".spa file has a corrupt spectrum header")
+    n_points, x_units, y_units, first, last = HEADER.unpack_from(data, header_offset)
+
+    offset, size = blocks[DATA_BLOCK]
+    n_points = min(n_points, size // 4)
+    if offset + 4 * n_points > len(data):
+        raise ValueError(".spa spectrum is shorter than its %d points" % n_points)
+
+    y = numpy.frombuffer(data, dtype='<f4', count=n_points, offset=offset).astype(numpy.float64)
+    x = numpy.linspace(first, last, n_points)
+    return x, y, Y_UNITS.get(y_units, 'unknown')
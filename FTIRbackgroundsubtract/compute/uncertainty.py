@@ -0,0 +1,194 @@
+"""
+Uncertainties of the fitted background and peak height of a ProcessedScan.
+
+Many perturbed copies ("realisations") of the background fit are made, and
+the spread of their results gives the uncertainty. There are two ways of
+making them:
+
+ * 'montecarlo' - every point is moved by a random amount drawn from its
+   error bars (angle_err in wavenumber, col_err in absorbance)
+ * 'bootstrap' - the background points used in the fit are resampled with
+   replacement
+
+The points that the fit rejected as outliers are left out of every
+realisation. The peak height of each realisation is measured from the
+observed spectrum minus that realisation's background (perturbing the peak
+itself as well would bias the maximum upwards), so it is the uncertainty
+due to the background.
+
+All of the realisations in a block are stacked into 3-D arrays and fitted
+with one batched least squares solve, and the blocks can be spread over
+several processes for large numbers of realisations.
+"""
+import concurrent.futures
+import time
+
+import numpy
+
+from FTIRbackgroundsubtract.compute.fitting import scale_axis, unscale_coeffs
+from FTIRbackgroundsubtract.compute.concentration import concentration
+
+
+METHODS = ('montecarlo', 'bootstrap')
+
+#number of realisations fitted together, which bounds the memory used
+BLOCK_SIZE = 256
+
+#use worker processes only for at least this many realisations
+PARALLEL_MIN_SAMPLES = 20000
+
+
+class Interval:
+    """
+    Summary of the distribution of a quantity over the realisations.
+
+     * value - the value from the original fit
+     * mean, std - mean and standard deviation over the realisations
+     * low, high - confidence interval (percentiles of the realisations)
+    """
+    def __init__(self, value, samples, confidence):
+        tail = 50.0 * (1.0 - confidence)
+        self.value = value
+        self.mean = numpy.mean(samples, axis=0)
+        self.std = numpy.std(samples, axis=0, ddof=1)
+        self.low, self.high = numpy.percentile(samples, [tail, 100.0 - tail], axis=0)
+
+    def __repr__(self):
+        return "Interval(value=%s, std=%s, low=%s, high=%s)" % (self.value, self.std, self.low, self.high)
+
+
+class UncertaintyResult:
+    """
+    Results of peak_uncertainty().
+
+     * method - 'montecarlo' or 'bootstrap'
+     * n_samples - number of realisations
+     * confidence - the confidence level of the intervals
+     * coeffs - Interval of the background coefficients (arrays, highest
+                power first)
+     * peak_height - Interval of the peak height
+     * concentration - Interval of the concentration, or None if no
+                       concentration parameters were given
+     * samples - (n_samples,) array of the peak height of each realisation
+     * elapsed - time taken (s), i.e. the cost for this spectrum
+    """
+    def __init__(self, method, n_samples, confidence, coeffs, peak_height, concentration,
+                 samples, elapsed):
+        self.method = method
+        self.n_samples = n_samples
+        self.confidence = confidence
+        self.coeffs = coeffs
+        self.peak_height = peak_height
+        self.concentration = concentration
+        self.samples = samples
+        self.elapsed = elapsed
+
+
+def _fit_block(t, y, order):
+    #least squares polynomial fits of a stack of realisations; t and y are
+    #(n, m) and the result is (n, order + 1), highest power first
+    vander = numpy.empty(t.shape[:-1] + (order + 1, t.shape[-1]))
+    vander[..., order, :] = 1.0
+    for i in range(order - 1, -1, -1):
+        numpy.multiply(vander[..., i + 1, :], t, out=vander[..., i, :])
+    gram = vander @ numpy.swapaxes(vander, -1, -2)
+    rhs = vander @ y[..., numpy.newaxis]
+    return numpy.linalg.solve(gram, rhs)[..., 0]
+
+
+def _realisations(data, n, seed):
+    """
+    Returns the (scaled) coefficients and peak heights of 'n' realisations.
+    'data' is the dict made by peak_uncertainty(), which is also what is
+    sent to the worker processes.
+    """
+    rng = numpy.random.default_rng(seed)
+    order = data['order']
+    centre, scale = data['centre'], data['scale']
+    x, y = data['x'], data['y']
+    t_peak = (data['x_peak'] - centre) / scale
+    vander_peak = t_peak[:, numpy.newaxis] ** numpy.arange(order, -1, -1)
+
+    coeffs = numpy.empty((n, order + 1))
+    heights = numpy.empty(n)
+    for start in range(0, n, BLOCK_SIZE):
+        stop = min(start + BLOCK_SIZE, n)
+        m = stop - start
+        if data['method'] == 'bootstrap':
+            idxs = rng.integers(0, len(x), (m, len(x)))
+            xs = x[idxs]
+            ys = y[idxs]
+        else:
+            xs = x + rng.standard_normal((m, len(x))) * data['x_err']
+            ys = y + rng.standard_normal((m, len(y))) * data['y_err']
+
+        c = _fit_block((xs - centre) / scale, ys, order)
+        coeffs[start:stop] = c
+        heights[start:stop] = numpy.max(data['y_peak'] - c @ vander_peak.T, axis=-1)
+    return coeffs, heights
+
+
+def _realisations_task(args):
+    return _realisations(*args)
+
+
+def peak_uncertainty(scan, n_samples=1000, method='montecarlo', confidence=0.95, seed=None,
+                     workers=1, concentration_params=None):
+    """
+    Estimates the uncertainty of the background fit and peak height of
+    'scan', which must have been calculated. Returns an UncertaintyResult.
+
+        * n_samples - number of realisations
+        * method - 'montecarlo' or 'bootstrap' (see the module docstring)
+        * confidence - confidence level of the intervals
+        * seed - seed for the random numbers, for repeatable results
+        * workers - number of processes to spread the realisations over,
+                    if there are at least PARALLEL_MIN_SAMPLES of them
+        * concentration_params - dict of keyword arguments for
+                    compute.concentration.concentration() (thickness_um,
+                    density, absorptivity and optionally species and units),
+                    to also give the uncertainty of the concentration
+    """
+    if method not in METHODS:
+        raise ValueError("method must be one of: %s" % ", ".join(METHODS))
+    if n_samples < 2:
+        raise ValueError("n_samples must be at least 2")
+    t0 = time.perf_counter()
+
+    order = scan.bkgd_fit_order
+    bkgd_idxs = scan.bkgd_idxs[0]
+    if len(bkgd_idxs) < order + 1:
+        raise ValueError("Not enough background points to fit a polynomial of order %d" % order)
+    x = scan.angles[bkgd_idxs]
+    centre, scale = scale_axis(x)
+
+    in_lims = numpy.logical_and(scan.angles >= scan.bkgd_lowlim, scan.angles <= scan.bkgd_highlim)
+    data = {'method': method, 'order': order, 'centre': centre, 'scale': scale,
+            'x': x, 'y': scan.col_amount[bkgd_idxs],
+            'x_err': scan.angle_err[bkgd_idxs], 'y_err': scan.col_err[bkgd_idxs],
+            'x_peak': scan.angles[in_lims], 'y_peak': scan.col_amount[in_lims]}
+
+    seeds = numpy.random.SeedSequence(seed)
+    if workers > 1 and n_samples >= PARALLEL_MIN_SAMPLES:
+        #a few blocks per worker, each with its own random stream
+        n_chunks = 4 * workers
+        sizes = [len(c) for c in numpy.array_split(numpy.arange(n_samples), n_chunks)]
+        tasks = [(data, size, s) for size, s in zip(sizes, seeds.spawn(n_chunks))]
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            parts = list(executor.map(_realisations_task, tasks))
+        coeffs = numpy.concatenate([p[0] for p in parts])
+        heights = numpy.concatenate([p[1] for p in parts])
+    else:
+        coeffs, heights = _realisations(data, n_samples, seeds)
+
+    peak_height = scan.get_peak_height()
+    conc = None
+    if concentration_params is not None:
+        conc = Interval(concentration(peak_height, **concentration_params),
+                        concentration(heights, **concentration_params), confidence)
+
+    return UncertaintyResult(method, n_samples, confidence,
+                             Interval(scan.bkgd_func.coeffs, unscale_coeffs(coeffs, centre, scale),
+                                      confidence),
+                             Interval(peak_height, heights, confidence),
+                             conc, heights, time.perf_counter() - t0)
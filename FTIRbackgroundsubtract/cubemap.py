@@ -0,0 +1,125 @@
+"""
+Command line tool to make maps of the peak heights (and optionally the
+concentrations) across a hyperspectral FTIR image stored as an ENVI cube,
+without splitting it into one file per pixel, e.g.:
+
+    ftir-bkgd-map image.hdr --preset 3500 -o maps.dat
+    ftir-bkgd-map image.hdr --preset 3500 -o maps.dat --thickness 100 \\
+        --density 2800 --absorptivity 63
+
+The cube is memory mapped and processed a tile at a time (see
+compute.cube), so it can be bigger than the memory of the machine. The maps
+are written to an ENVI file of float32 bands as each tile is finished.
+"""
+import argparse
+import sys
+import time
+
+from FTIRbackgroundsubtract.cli import parse_band
+from FTIRbackgroundsubtract.compute.bands import PRESETS, get_preset
+from FTIRbackgroundsubtract.compute.concentration import SPECIES, UNITS
+from FTIRbackgroundsubtract.compute.cube import map_cube, open_envi
+
+PROGRESS_INTERVAL = 0.25 #seconds
+
+
+def parse_tile(s):
+    """
+    Parses a --tile argument of the form 'ROWSxCOLS'.
+    """
+    try:
+        rows, cols = [int(f) for f in s.lower().split('x')]
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected ROWSxCOLS, got %r" % s)
+    if rows < 1 or cols < 1:
+        raise argparse.ArgumentTypeError("tile must be at least 1x1")
+    return rows, cols
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='ftir-bkgd-map',
+        description="Fit polynomial backgrounds to every pixel of a hyperspectral FTIR "
+                    "image (ENVI cube) and write maps of the peak heights.")
+    parser.add_argument('cube', help="ENVI header (.hdr) or data file of the cube")
+    parser.add_argument('-b', '--band', dest='bands', action='append', type=parse_band,
+                        default=[], metavar='LOW,HIGH,EXCL_LOW,EXCL_HIGH,ORDER[,NAME]',
+                        help="background limits, excluded peak window and fit order of a "
+                             "band to map (may be given more than once)")
+    parser.add_argument('-p', '--preset', dest='presets', action='append', default=[],
+                        choices=list(PRESETS),
+                        help="map one of the GUI's suggested bands (may be given more "
+                             "than once)")
+    parser.add_argument('-o', '--output', required=True,
+                        help="output ENVI data file, the header is written next to it")
+    parser.add_argument('--tile', type=parse_tile, default=None, metavar='ROWSxCOLS',
+                        help="size of the tiles of pixels fitted together (default: as "
+                             "large as --memory-budget allows)")
+    parser.add_argument('--memory-budget', type=float, default=256.0, metavar='MB',
+                        help="working memory for a tile in MB (default: 256)")
+    parser.add_argument('--no-reject', action='store_true',
+                        help="don't reject outliers from the background fits")
+    parser.add_argument('--max-iterations', type=int, default=None,
+                        help="maximum number of outlier rejection passes")
+    parser.add_argument('--thickness', type=float, default=None, metavar='UM',
+                        help="sample thickness in microns, to make a concentration map")
+    parser.add_argument('--density', type=float, default=None, metavar='G_PER_L',
+                        help="sample density in g/L, to make a concentration map")
+    parser.add_argument('--absorptivity', type=float, default=None, metavar='L_PER_MOL_CM',
+                        help="molar absorptivity of the band, to make a concentration map")
+    parser.add_argument('--species', default='H2O', choices=list(SPECIES),
+                        help="species of the band (default: H2O)")
+    parser.add_argument('--units', default='wt%', choices=list(UNITS),
+                        help="units of the concentration map (default: wt%%)")
+    parser.add_argument('-q', '--quiet', action='store_true',
+                        help="don't report progress")
+    args = parser.parse_args(argv)
+
+    bands = [get_preset(name) for name in args.presets] + args.bands
+    if not bands:
+        parser.error("no bands given, use --band or --preset")
+
+    conc = [args.thickness, args.density, args.absorptivity]
+    concentration_params = {}
+    if any(v is not None for v in conc):
+        if any(v is None for v in conc):
+            parser.error("a concentration map needs --thickness, --density and --absorptivity")
+        if len(bands) != 1:
+            parser.error("a concentration map can only be made for one band at a time")
+        concentration_params[bands[0].name] = {
+            'thickness_um': args.thickness, 'density': args.density,
+            'absorptivity': args.absorptivity, 'species': args.species, 'units': args.units}
+
+    try:
+        cube = open_envi(args.cube)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+
+    last_report = [0.0]
+    def progress(done, total):
+        now = time.perf_counter()
+        if now - last_report[0] > PROGRESS_INTERVAL or done == total:
+            last_report[0] = now
+            print("\r%d/%d tiles" % (done, total), end='', file=sys.stderr, flush=True)
+
+    fit_options = {'reject_outliers': not args.no_reject, 'max_iterations': args.max_iterations}
+    result = map_cube(cube, bands, args.output, concentration_params, tile_shape=args.tile,
+                      memory_budget=args.memory_budget * 1024 * 1024,
+                      progress=None if args.quiet else progress, **fit_options)
+
+    if not args.quiet:
+        n_pixels = cube.lines * cube.samples
+        print(file=sys.stderr)
+        print("%d x %d pixels in %d tiles of %dx%d in %.2f s (%.0f pixels/s)"
+              % (cube.lines, cube.samples, result.n_tiles, result.tile_shape[0],
+                 result.tile_shape[1], result.elapsed, n_pixels / max(result.elapsed, 1e-9)),
+              file=sys.stderr)
+        print("maps: %s" % ", ".join(result.names), file=sys.stderr)
+    if result.n_failed:
+        print("%d tile fit(s) failed, their pixels are NaN" % result.n_failed, file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
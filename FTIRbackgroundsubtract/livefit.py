@@ -0,0 +1,123 @@
+"""
+Background fitting in a worker thread, for previewing the fit while the
+limits are being dragged around in the GUI. Only uses the standard library
+and FTIRbackgroundsubtract.compute, so it doesn't depend on wx.
+"""
+import threading
+import time
+
+import numpy
+
+#don't fit more often than this (s), i.e. about 30 frames per second
+FRAME_INTERVAL = 1.0 / 30.0
+
+
+class LiveFitter:
+    """
+    Fits the background of 'scan' in a worker thread each time request() is
+    called, using ProcessedScan.fit_bkgd_lims() (so no points are rejected).
+
+    Requests are coalesced: if several arrive while a fit is running, or
+    within 'interval' seconds of the last fit starting, only the newest one
+    is fitted. Every request gets a generation number, and a result is only
+    passed to 'callback' if no newer request has been made since, so a slow
+    fit can never overwrite a newer one.
+
+        * scan - the ProcessedScan to fit
+        * callback - function to run with the result. It is called from the
+                     worker thread as callback(generation, lims, bkgd_func, error),
+                     where lims is the (bkgd_lowlim, bkgd_highlim, excl_lowlim,
+                     excl_highlim, bkgd_fit_order) tuple that was requested,
+                     bkgd_func is a numpy.poly1d (or None if the fit failed)
+                     and error is the exception raised by a failed fit (or None).
+                     GUI code should use is_current() to check that the result
+                     is still wanted once it gets back to the GUI thread.
+        * interval - minimum time between fits (s)
+    """
+    def __init__(self, scan, callback, interval=FRAME_INTERVAL):
+        self.scan = scan
+        self.callback = callback
+        self.interval = interval
+
+        self.__cond = threading.Condition()
+        self.__request = None
+        self.__generation = 0
+        self.__closed = False
+
+        #build the moment tables now, rather than making the first preview slow
+        scan.get_moments()
+
+        self.__thread = threading.Thread(target=self.__run, name="LiveFitter", daemon=True)
+        self.__thread.start()
+
+    def request(self, bkgd_lowlim, bkgd_highlim, excl_lowlim, excl_highlim, bkgd_fit_order=None):
+        """
+        Asks for the background to be fitted with the given limits, replacing
+        any request that hasn't been started yet. Returns the generation
+        number of the request.
+        """
+        if bkgd_fit_order is None:
+            bkgd_fit_order = self.scan.bkgd_fit_order
+        with self.__cond:
+            self.__generation += 1
+            self.__request = (self.__generation, (bkgd_lowlim, bkgd_highlim, excl_lowlim,
+                                                  excl_highlim, bkgd_fit_order))
+            self.__cond.notify()
+            return self.__generation
+
+    def cancel(self):
+        """
+        Drops any pending request, and stops the result of a running fit from
+        being passed to the callback.
+        """
+        with self.__cond:
+            self.__generation += 1
+            self.__request = None
+
+    def is_current(self, generation):
+        """
+        Returns True if no request has been made (or cancelled) since the one
+        with the given generation number.
+        """
+        with self.__cond:
+            return generation == self.__generation
+
+    def close(self):
+        """
+        Stops the worker thread. Pending requests are dropped.
+        """
+        with self.__cond:
+            self.__closed = True
+            self.__generation += 1
+            self.__cond.notify()
+        if threading.current_thread() is not self.__thread:
+            self.__thread.join()
+
+    def __run(self):
+        last_start = -self.interval
+        while True:
+            with self.__cond:
+                #wait for a request, and then until the interval has passed
+                #(any requests made in the meantime replace it)
+                while not self.__closed:
+                    wait = None
+                    if self.__request is not None:
+                        wait = last_start + self.interval - time.monotonic()
+                        if wait <= 0:
+                            break
+                    self.__cond.wait(wait)
+                if self.__closed:
+                    return
+                generation, lims = self.__request
+                self.__request = None
+
+            last_start = time.monotonic()
+            try:
+                bkgd_func = self.scan.fit_bkgd_lims(*lims)
+                error = None
+            except (ValueError, numpy.linalg.LinAlgError) as e:
+                bkgd_func = None
+                error = e
+
+            if self.is_current(generation):
+                self.callback(generation, lims, bkgd_func, error)
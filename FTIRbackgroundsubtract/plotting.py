@@ -0,0 +1,474 @@
+"""
+The matplotlib artists used by the GUI. These only need matplotlib (not wx),
+so they can also be used with other backends, e.g. in benchmarks/.
+
+The displays create their artists once and then update them in place with
+set_data, so that re-fitting the background doesn't replot the whole
+spectrum. Each display's update() returns True if it changed anything, and
+redraw_axes() then redraws only those axes. Large data sets are drawn with
+LODLine, which decimates them to the resolution of the screen, and sets of
+markers with LODMarkers, which only leaves out the points outside the view.
+"""
+import numpy
+
+from FTIRbackgroundsubtract.compute.decimate import minmax_decimate, thin_error_bars, view_slice
+
+
+class DraggableLine:
+    """
+    This class is mostly based on the draggable rectangles example from 
+    http://matplotlib.sourceforge.net/users/event_handling.html
+    
+    It provides a vertical line across 'axis' which can be dragged to any x
+    position. Useful for picking limits.
+    
+        * x_pos - initial x position to draw line at
+        * axis - axis to draw line into
+        * callback - list of functions to run when the line gets moved. The functions
+                     will be run in order, and will be passed the new x position of 
+                     the line as their only argument.
+        * motion_callback - function to run each time the line moves while it is
+                            being dragged. It is passed the new x position of
+                            the line.
+    """
+    
+    lock = None
+    
+    def __init__(self, x_pos, axis, linewidth=2.0, color='r', callback=None,
+                 motion_callback=None):
+        
+        self.line = axis.plot([x_pos]*2,axis.get_ylim(), linewidth=linewidth, color=color)[0]
+
+        self.press = None
+        self.background = None
+        self.callback = callback
+        self.motion_callback = motion_callback
+        self.__connect()
+
+   
+    def __connect(self):
+        #connect to all the events we need
+        self.cidpress = self.line.figure.canvas.mpl_connect('button_press_event', self.on_press)
+        self.cidrelease = self.line.figure.canvas.mpl_connect('button_release_event', self.on_release)
+        self.cidmotion = self.line.figure.canvas.mpl_connect('motion_notify_event', self.on_motion)           
+        self.cidredraw = self.line.figure.canvas.mpl_connect('draw_event', self.on_redraw)
+
+
+    def disconnect(self):
+        #disconnect all the stored connection ids
+        self.line.figure.canvas.mpl_disconnect(self.cidpress)
+        self.line.figure.canvas.mpl_disconnect(self.cidrelease)
+        self.line.figure.canvas.mpl_disconnect(self.cidmotion)
+        self.line.figure.canvas.mpl_disconnect(self.cidredraw)
+
+        
+    def on_press(self, event):
+        #on button press we will see if the mouse is over us and store some data
+        if event.inaxes != self.line.axes: return
+        if DraggableLine.lock is not None: return
+        contains, attrd = self.line.contains(event)
+        if not contains: return
+
+        x0 = self.line.get_xdata()[0],
+        self.press = x0, event.xdata, event.ydata
+        DraggableLine.lock = self
+
+        # draw everything but the selected rectangle and store the pixel buffer
+        canvas = self.line.figure.canvas
+        axes = self.line.axes
+        self.line.set_animated(True)
+        canvas.draw()
+        self.background = canvas.copy_from_bbox(self.line.axes.bbox)
+
+        # now redraw just the rectangle
+        axes.draw_artist(self.line)
+
+        # and blit just the redrawn area
+        canvas.blit(axes.bbox)
+
+
+    def get_xpos(self):
+        """
+        Returns the current x position of the line.
+        """
+        return self.line.get_xdata()[0]
+    
+    
+    def set_xpos(self,x_pos):
+        """
+        Sets the current x position of the line. It is up to the caller to
+        redraw the axes (see redraw_axes()).
+        """
+        self.line.set_xdata([x_pos]*2)
+        
+    
+    def on_redraw(self, event):
+        #reset the line's ylims so that you can't zoom to outside the size of the line
+        self.line.set_ydata(self.line.axes.get_ylim())
+        
+        if self.background is None:
+            #not being dragged, so the line was drawn with everything else
+            return
+        
+        canvas = self.line.figure.canvas
+        axes = self.line.axes        
+        
+        # restore the background region
+        canvas.restore_region(self.background)
+
+        # redraw just the current rectangle
+        axes.draw_artist(self.line)
+
+        # blit just the redrawn area
+        canvas.blit(axes.bbox)
+    
+    
+    def on_motion(self, event):
+        #on motion we will move the rect if the mouse is over us
+        if DraggableLine.lock is not self:
+            return
+        if event.inaxes != self.line.axes: return
+        x0, xpress, _ = self.press
+        dx = event.xdata - xpress
+
+        self.line.set_xdata([x0[0] + dx]*2)
+        self.line.set_ydata(self.line.axes.get_ylim())
+        self.line.set_linestyle('--')
+
+        canvas = self.line.figure.canvas
+        axes = self.line.axes
+        # restore the background region
+        canvas.restore_region(self.background)
+
+        # redraw just the current rectangle
+        axes.draw_artist(self.line)
+
+        # blit just the redrawn area
+        canvas.blit(axes.bbox)
+        
+        if self.motion_callback is not None:
+            self.motion_callback(self.get_xpos())
+
+ 
+    def on_release(self, event):
+        #on release we reset the press data
+        if DraggableLine.lock is not self:
+            return
+        
+        self.line.set_linestyle('-')
+        self.press = None
+        DraggableLine.lock = None
+
+        # turn off the rect animation property and reset the background
+        self.line.set_animated(False)
+        self.background = None
+
+        # redraw the full figure
+        self.line.figure.canvas.draw()
+        
+        if self.callback is not None:
+            self.callback(event.xdata)
+
+
+class LODLine:
+    """
+    A Line2D that only holds the points needed to draw its data at the
+    current zoom level, i.e. the min/max envelope of each pixel column (see
+    FTIRbackgroundsubtract.compute.decimate). The points are recomputed when
+    the x limits of the axes change (zooming and panning) and when the
+    figure is resized. The data must be monotonic in x.
+    
+    The remaining arguments are passed on to ax.plot().
+    """
+    def __init__(self, ax, *args, **kwargs):
+        self.ax = ax
+        self.line, = ax.plot([], [], *args, **kwargs)
+        self._data = None
+        ax.callbacks.connect('xlim_changed', self.on_xlim_changed)
+        ax.figure.canvas.mpl_connect('resize_event', self.on_resize)
+    
+    def set_data(self, x, y):
+        self._data = (numpy.asarray(x), numpy.asarray(y))
+        self.refresh(whole=True)
+    
+    def get_data(self):
+        """
+        Returns the full resolution data of the line.
+        """
+        return self._data
+    
+    def refresh(self, whole=False):
+        """
+        Recomputes the points for the current view, or for all of the data if
+        'whole' is True (so that autoscaling sees all of it).
+        """
+        if self._data is None or len(self._data[0]) == 0:
+            self.line.set_data([], [])
+            return
+        if whole:
+            lims = (self._data[0][0], self._data[0][-1])
+        else:
+            lims = self.ax.get_xlim()
+        self.line.set_data(*self._decimate(lims, max(int(self.ax.bbox.width), 1)))
+    
+    def _decimate(self, lims, n_columns):
+        return minmax_decimate(self._data[0], self._data[1], lims[0], lims[1], n_columns)
+    
+    def on_xlim_changed(self, ax):
+        self.refresh()
+    
+    def on_resize(self, evnt):
+        self.refresh()
+
+
+class LODErrorBars(LODLine):
+    """
+    Error bars drawn as a single line, which are thinned to one bar per pixel
+    column when there are too many to tell apart (see
+    FTIRbackgroundsubtract.compute.decimate.thin_error_bars()).
+    """
+    def set_data(self, x, y, x_err, y_err):
+        self._data = (numpy.asarray(x), numpy.asarray(y), numpy.asarray(x_err), numpy.asarray(y_err))
+        self.refresh(whole=True)
+    
+    def _decimate(self, lims, n_columns):
+        return thin_error_bars(*(self._data + (lims[0], lims[1], n_columns)))
+
+
+class LODMarkers(LODLine):
+    """
+    Points drawn as unconnected markers. Min/max decimation would drop the
+    points in the middle of a pixel column, which can't be filled in by the
+    lines to their neighbours as they are for an LODLine, so every point in
+    the view is drawn, and only the points outside it are left out.
+    """
+    def _decimate(self, lims, n_columns):
+        s = view_slice(self._data[0], lims[0], lims[1])
+        return self._data[0][s], self._data[1][s]
+
+
+def _bkgd_range(scan, lims=None):
+    #the part of the scan between the background limits (or the first two of 'lims')
+    if lims is None:
+        lims = (scan.bkgd_lowlim, scan.bkgd_highlim)
+    low_idx, high_idx = sorted((numpy.argmin(numpy.abs(scan.angles-lims[0])),
+                                numpy.argmin(numpy.abs(scan.angles-lims[1]))))
+    return scan.angles[low_idx:high_idx], scan.col_amount[low_idx:high_idx]
+
+
+def _fit_key(scan):
+    #everything that the fit and background subtracted displays depend on
+    return (id(scan.angles), id(scan.col_amount), scan.bkgd_lowlim, scan.bkgd_highlim,
+            scan.excl_lowlim, scan.excl_highlim, tuple(scan.bkgd_func.coeffs),
+            len(scan.bkgd_ignored_pts), len(scan.bkgd_idxs[0]))
+
+
+def _autoscale(ax, lod_lines=()):
+    ax.relim()
+    ax.autoscale_view()
+    for l in lod_lines:
+        l.refresh()
+
+
+class BackgroundFitDisplay:
+    """
+    Shows the background fit: the scan between the background limits, the
+    points used for the fit and the points that were rejected (with their
+    error bars) and the fitted polynomial.
+    """
+    def __init__(self, ax):
+        self.ax = ax
+        self.ax.invert_xaxis()
+        self.__key = None
+        
+        self.data_line = LODLine(self.ax, 'k-')
+        self.bkgd_errs = LODErrorBars(self.ax, 'b-', linewidth=1)
+        self.bkgd_pts = LODMarkers(self.ax, 'b+')
+        self.ignored_errs = LODErrorBars(self.ax, 'r-', linewidth=1)
+        self.ignored_pts = LODMarkers(self.ax, 'r+')
+        self.lod_lines = (self.data_line, self.bkgd_errs, self.bkgd_pts, self.ignored_errs, self.ignored_pts)
+        self.fit_line, = self.ax.plot([], [], 'm-', linewidth=2)
+    
+    def update(self, scan):
+        key = _fit_key(scan)
+        if key == self.__key:
+            return False
+        self.__key = key
+        
+        idxs = scan.bkgd_idxs
+        self.bkgd_pts.set_data(scan.angles[idxs], scan.col_amount[idxs])
+        self.bkgd_errs.set_data(scan.angles[idxs], scan.col_amount[idxs],
+                                scan.angle_err[idxs], scan.col_err[idxs])
+        
+        idxs = scan.bkgd_ignored_idxs
+        self.ignored_pts.set_data(scan.angles[idxs], scan.col_amount[idxs])
+        self.ignored_errs.set_data(scan.angles[idxs], scan.col_amount[idxs],
+                                   scan.angle_err[idxs], scan.col_err[idxs])
+        
+        if len(scan.bkgd_idxs[0]):
+            x = numpy.linspace(scan.angles[scan.bkgd_idxs[0][0]], scan.angles[scan.bkgd_idxs[0][-1]], 2000)
+            self.fit_line.set_data(x, scan.bkgd_func(x))
+        else:
+            self.fit_line.set_data([], [])
+        
+        self.data_line.set_data(*_bkgd_range(scan))
+        _autoscale(self.ax, self.lod_lines)
+        return True
+    
+    def preview(self, scan, lims, bkgd_func):
+        """
+        Shows a background that was fitted without the full calculation (e.g.
+        by a LiveFitter), between the limits lims[0] and lims[1]. The fitted
+        points aren't known, so they aren't shown.
+        """
+        self.__key = None
+        for line in (self.bkgd_pts, self.ignored_pts):
+            line.set_data([], [])
+        for line in (self.bkgd_errs, self.ignored_errs):
+            line.set_data([], [], [], [])
+        
+        wavenum, intensity = _bkgd_range(scan, lims)
+        self.data_line.set_data(wavenum, intensity)
+        x = numpy.linspace(lims[0], lims[1], 2000)
+        self.fit_line.set_data(x, bkgd_func(x))
+        _autoscale(self.ax, self.lod_lines)
+        return True
+        
+        
+class BackgroundSubtractedDisplay:
+    """
+    Shows the scan between the background limits with the background
+    subtracted.
+    """
+    def __init__(self, ax):
+        self.ax = ax
+        self.ax.invert_xaxis()
+        self.__key = None
+        
+        self.lod_line = LODLine(self.ax, 'g-')
+        self.line = self.lod_line.line
+        self.lod_lines = (self.lod_line,)
+        self.ax.axhline(y=0, color = 'r')
+    
+    def update(self, scan):
+        key = _fit_key(scan)
+        if key == self.__key:
+            return False
+        self.__key = key
+        
+        wavenum, intensity = _bkgd_range(scan)
+        self.lod_line.set_data(wavenum, intensity - scan.bkgd_func(wavenum))
+        _autoscale(self.ax, self.lod_lines)
+        return True
+    
+    def preview(self, scan, lims, bkgd_func):
+        """
+        Shows the scan between the limits lims[0] and lims[1] with 'bkgd_func'
+        subtracted, see BackgroundFitDisplay.preview().
+        """
+        self.__key = None
+        wavenum, intensity = _bkgd_range(scan, lims)
+        self.lod_line.set_data(wavenum, intensity - bkgd_func(wavenum))
+        _autoscale(self.ax, self.lod_lines)
+        return True
+
+
+class BackgroundRangeSelector:
+    """
+    Shows the whole scan, with draggable lines for picking the background
+    limits (green) and the limits of the excluded peak (red). If given,
+    'motion_callback' is called with the selector each time one of the lines
+    moves while it is being dragged.
+    """
+    def __init__(self, ax, motion_callback=None):
+        self.ax = ax
+        self.ax.invert_xaxis()
+        self.motion_callback = motion_callback
+        self.lim_line1 = None
+        self.lim_line2 = None
+        self.raw_line = LODLine(self.ax, 'b-')
+        self.plot = [self.raw_line.line]
+        self.__data = None
+    
+    def update(self, scan):
+        changed = False
+        if self.lim_line1 is None:
+            self.lim_line1 = DraggableLine(scan.bkgd_lowlim, self.ax, color='g',
+                                           motion_callback=self.on_line_motion)
+            self.lim_line2 = DraggableLine(scan.bkgd_highlim, self.ax, color='g',
+                                           motion_callback=self.on_line_motion)
+            self.excl_line1 = DraggableLine(scan.excl_lowlim, self.ax, color='r',
+                                            motion_callback=self.on_line_motion)
+            self.excl_line2 = DraggableLine(scan.excl_highlim, self.ax, color='r',
+                                            motion_callback=self.on_line_motion)
+            changed = True
+        else:
+            for line, x_pos in ((self.lim_line1, scan.bkgd_lowlim), (self.lim_line2, scan.bkgd_highlim),
+                                (self.excl_line1, scan.excl_lowlim), (self.excl_line2, scan.excl_highlim)):
+                if line.get_xpos() != x_pos:
+                    line.set_xpos(x_pos)
+                    changed = True
+
+        #(Line2D copies its data, so keep our own references to compare with)
+        if (self.__data is not None and self.__data[0] is scan.angles and
+                self.__data[1] is scan.col_amount):
+            return changed
+        self.raw_line.set_data(scan.angles, scan.col_amount)
+        self.__data = (scan.angles, scan.col_amount)
+        
+        #scale to the scan, not to the limit lines (which span the old ylims)
+        lines = (self.lim_line1, self.lim_line2, self.excl_line1, self.excl_line2)
+        for l in lines:
+            l.line.set_visible(False)
+        self.ax.relim(visible_only=True)
+        self.ax.autoscale_view()
+        for l in lines:
+            l.line.set_visible(True)
+        self.raw_line.refresh()
+        return True
+        
+    def on_line_motion(self, x_pos):
+        if self.motion_callback is not None:
+            self.motion_callback(self)
+        
+    def get_lims(self):
+        pos1 = self.lim_line1.get_xpos()
+        pos2 = self.lim_line2.get_xpos()
+        
+        return min(pos1,pos2), max(pos1,pos2)
+
+    def get_excl_lims(self):
+        pos1 = self.excl_line1.get_xpos()
+        pos2 = self.excl_line2.get_xpos()
+        
+        return min(pos1,pos2), max(pos1,pos2)
+
+
+def get_view_lims(axes):
+    """
+    Returns a dict of the current view limits of each of the axes, for
+    passing to redraw_axes().
+    """
+    return {ax: ax.viewLim.frozen() for ax in axes}
+
+
+def redraw_axes(canvas, axes, old_view_lims=None):
+    """
+    Redraws the given axes after their artists have been updated. If none of
+    their view limits have changed since 'old_view_lims' (from
+    get_view_lims()), only the insides of the axes are redrawn and blitted to
+    the screen. Otherwise the ticks need redrawing as well, so the whole
+    figure is drawn. Passing old_view_lims=None always draws the whole figure.
+    """
+    axes = list(axes)
+    if not axes:
+        return
+    
+    if old_view_lims is None or any(ax.viewLim.bounds != old_view_lims[ax].bounds
+                                    for ax in axes):
+        canvas.draw()
+        return
+    
+    for ax in axes:
+        ax.redraw_in_frame()
+        canvas.blit(ax.bbox)
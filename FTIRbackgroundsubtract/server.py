@@ -0,0 +1,701 @@
+"""
+A small HTTP service that does the background fitting for the web front end
+(templates/index.html), so that many users can share one machine:
+
+    ftir-bkgd-server --port 8000
+
+A spectrum is uploaded once (POST /spectra, with the file as the body) and
+kept in memory on the server, along with a ProcessedScan whose prefix moment
+tables are built when it is uploaded. The front end then only sends the
+limits for each fit. While a limit is being dragged it asks for previews,
+which are fitted straight from the moment tables (ProcessedScan.fit_bkgd_lims,
+without outlier rejection) in constant time, and it asks for the full fit
+once the drag ends. The work is done in a pool of threads (the heavy parts
+are numpy, which releases the GIL), so that the event loop can carry on
+serving other users and the spectra don't have to be copied to another
+process.
+
+Endpoints (all return JSON apart from /):
+
+    GET    /                     the front end
+    POST   /spectra              upload a spectrum file, returns its id
+    GET    /spectra/<id>         size and wavenumber range of a spectrum
+    DELETE /spectra/<id>         forget a spectrum
+    POST   /spectra/<id>/fit     fit one band, e.g. {"bkgd_lowlim": 2400,
+                                 "bkgd_highlim": 4000, "excl_lowlim": 2590,
+                                 "excl_highlim": 3788, "bkgd_fit_order": 1}
+                                 or {"preset": "3500"}. The fit order must
+                                 be 0 to MAX_FIT_ORDER. Add "preview": true
+                                 for a quick fit without outlier rejection
+    POST   /spectra/<id>/peak    peak heights of several bands,
+                                 {"bands": [...]} (default: all the presets)
+    GET    /spectra/<id>/plot    the traces to plot for a view, see below
+
+The plot endpoint takes the view as query parameters, e.g.
+
+    /spectra/<id>/plot?x_lo=2000&x_hi=4000&width=700&preset=3500
+
+where 'width' is the width of the plot in pixels. The raw spectrum (and, if
+a band is given as a preset or as bkgd_lowlim etc., the fitted background
+and the background-subtracted spectrum) are min/max decimated to a few
+points per pixel column (see compute.decimate), so the payload size depends
+on the width of the plot rather than on the size of the spectrum. Add
+format=binary to get float32 arrays instead of JSON (see encode_binary()),
+and preview=1 to fit the band as a preview.
+Payloads and fits are cached, so panning back and forth is cheap.
+
+Compressed uploads (e.g. spectrum.csv.gz) are decompressed up to
+--max-decompressed MB, so a small upload can't expand to fill the memory.
+
+Only needs the standard library and numpy.
+"""
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import hashlib
+import json
+import os
+import re
+import struct
+import sys
+import threading
+import time
+import urllib.parse
+
+import numpy
+
+from FTIRbackgroundsubtract.compute.bands import (Band, BandResult, PRESETS, get_preset,
+                                                 process_scan_bands)
+from FTIRbackgroundsubtract.compute.decimate import minmax_decimate, view_slice
+from FTIRbackgroundsubtract.compute.loader import parse_spectrum
+from FTIRbackgroundsubtract.compute.results import band_key
+from FTIRbackgroundsubtract.compute.scan import ProcessedScan
+
+DEFAULT_PORT = 8000
+DEFAULT_MAX_SPECTRA = 256
+DEFAULT_MAX_UPLOAD_MB = 64
+DEFAULT_MAX_DECOMPRESSED_MB = 256
+DEFAULT_PLOT_CACHE_MB = 64
+DEFAULT_FIT_CACHE_SIZE = 4096
+
+#widest plot (in pixels) that a payload can be requested for
+MAX_PLOT_WIDTH = 10000
+
+#highest background polynomial order that can be requested. The moment
+#tables of a spectrum grow with the order, and the fits become ill
+#conditioned long before this
+MAX_FIT_ORDER = 10
+
+#first bytes of a binary plot payload
+BINARY_MAGIC = b'FTRP'
+
+#how long an idle keep-alive connection is held open for (s)
+KEEPALIVE_TIMEOUT = 30.0
+
+DEFAULT_INDEX = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'templates', 'index.html')
+
+STATUS_REASONS = {200: 'OK', 201: 'Created', 204: 'No Content', 400: 'Bad Request',
+                  404: 'Not Found', 405: 'Method Not Allowed', 413: 'Payload Too Large',
+                  500: 'Internal Server Error'}
+
+
+class HTTPError(Exception):
+    """
+    Raised by a request handler to send an error response.
+    """
+    def __init__(self, status, message):
+        Exception.__init__(self, message)
+        self.status = status
+        self.message = message
+
+
+class Spectrum:
+    """
+    An uploaded spectrum. The id is a hash of the uploaded file, so the same
+    file uploaded twice (e.g. by two users) is only stored once.
+
+    The ProcessedScan of the spectrum (and its moment tables, which are
+    built here, so this should be created off the event loop) is shared by
+    all of the fits. Full fits change the scan's limits, so they hold 'lock'.
+    """
+    def __init__(self, spectrum_id, wavenum, absorbance):
+        self.id = spectrum_id
+        self.wavenum = wavenum
+        self.absorbance = absorbance
+        self.scan = ProcessedScan(wavenum, absorbance)
+        self.lock = threading.Lock()
+        self.nbytes = wavenum.nbytes + absorbance.nbytes + self.scan.get_moments().nbytes
+        self.last_used = time.monotonic()
+
+    def info(self):
+        return {'id': self.id,
+                'n_points': len(self.wavenum),
+                'wavenum_min': float(numpy.min(self.wavenum)),
+                'wavenum_max': float(numpy.max(self.wavenum))}
+
+
+class SessionStore:
+    """
+    The uploaded spectra, bounded in number and total size. The least
+    recently used spectra are dropped first.
+
+        * max_spectra - maximum number of spectra to keep
+        * max_bytes - maximum total size of the spectrum arrays
+    """
+    def __init__(self, max_spectra=DEFAULT_MAX_SPECTRA, max_bytes=None):
+        self.max_spectra = max_spectra
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.__spectra = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self.__spectra)
+
+    def add(self, spectrum):
+        if spectrum.id in self.__spectra:
+            return self.get(spectrum.id)
+        self.__spectra[spectrum.id] = spectrum
+        self.nbytes += spectrum.nbytes
+        while len(self.__spectra) > 1 and (
+                len(self.__spectra) > self.max_spectra or
+                (self.max_bytes is not None and self.nbytes > self.max_bytes)):
+            self.remove(next(iter(self.__spectra)))
+        return spectrum
+
+    def get(self, spectrum_id):
+        """
+        Returns the spectrum with the given id, or raises HTTPError(404).
+        """
+        try:
+            spectrum = self.__spectra[spectrum_id]
+        except KeyError:
+            raise HTTPError(404, "No spectrum with id %r (it may have expired, "
+                                 "try uploading it again)" % spectrum_id)
+        self.__spectra.move_to_end(spectrum_id)
+        spectrum.last_used = time.monotonic()
+        return spectrum
+
+    def remove(self, spectrum_id):
+        spectrum = self.__spectra.pop(spectrum_id, None)
+        if spectrum is not None:
+            self.nbytes -= spectrum.nbytes
+        return spectrum
+
+
+class LRUCache:
+    """
+    A cache bounded in number of entries and total size. The least recently
+    used entries are dropped first.
+
+        * max_entries - maximum number of entries
+        * max_bytes - maximum total size of the entries (as given to put())
+    """
+    def __init__(self, max_entries=None, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.__entries = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def get(self, key, default=None):
+        try:
+            value, nbytes = self.__entries[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self.__entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value, nbytes=0):
+        old = self.__entries.pop(key, None)
+        if old is not None:
+            self.nbytes -= old[1]
+        self.__entries[key] = (value, nbytes)
+        self.nbytes += nbytes
+        while len(self.__entries) > 1 and (
+                (self.max_entries is not None and len(self.__entries) > self.max_entries) or
+                (self.max_bytes is not None and self.nbytes > self.max_bytes)):
+            key, (value, nbytes) = self.__entries.popitem(last=False)
+            self.nbytes -= nbytes
+
+
+def parse_band_params(params):
+    """
+    Returns a Band from a JSON object, which either names a preset
+    ({"preset": "3500"}) or gives the limits and fit order.
+    """
+    if not isinstance(params, dict):
+        raise HTTPError(400, "Expected a JSON object describing a band")
+    try:
+        if 'preset' in params:
+            return get_preset(params['preset'])
+        band = Band(float(params['bkgd_lowlim']), float(params['bkgd_highlim']),
+                    float(params['excl_lowlim']), float(params['excl_highlim']),
+                    int(params.get('bkgd_fit_order', 1)), name=params.get('name'))
+    except KeyError as e:
+        raise HTTPError(400, "Missing band parameter %s" % e)
+    except (TypeError, ValueError) as e:
+        raise HTTPError(400, "Invalid band parameters: %s" % e)
+    check_fit_order(band)
+    return band
+
+
+def check_fit_order(band):
+    """
+    Raises HTTPError(400) if the fit order of 'band' isn't between 0 and
+    MAX_FIT_ORDER.
+    """
+    if not 0 <= band.bkgd_fit_order <= MAX_FIT_ORDER:
+        raise HTTPError(400, "bkgd_fit_order must be between 0 and %d" % MAX_FIT_ORDER)
+
+
+def _band_result_json(result):
+    out = {'band': result.band.name,
+           'bkgd_lowlim': result.band.bkgd_lowlim,
+           'bkgd_highlim': result.band.bkgd_highlim,
+           'excl_lowlim': result.band.excl_lowlim,
+           'excl_highlim': result.band.excl_highlim,
+           'bkgd_fit_order': result.band.bkgd_fit_order}
+    if result.ok:
+        out.update({'peak_height': float(result.peak_height),
+                    'coeffs': [float(c) for c in result.bkgd_func.coeffs],
+                    'n_ignored': result.n_ignored,
+                    'iterations': result.iterations,
+                    'converged': bool(result.converged),
+                    'fit_time': result.fit_time})
+    else:
+        out['error'] = str(result.error)
+    return out
+
+
+def plot_traces(wavenum, absorbance, x_lo, x_hi, width, fit=None):
+    """
+    Returns a list of (name, x, y) of the traces to plot for a view from x_lo
+    to x_hi that is 'width' pixels wide: the raw spectrum and, if 'fit' (a
+    successful fit as returned by fit_bands_job()) is given, the background
+    and the background-subtracted spectrum over the background range.
+    """
+    x, y = minmax_decimate(wavenum, absorbance, x_lo, x_hi, width)
+    traces = [('raw', x, y)]
+    if fit is None or 'error' in fit:
+        return traces
+
+    bkgd_func = numpy.poly1d(fit['coeffs'])
+    lo = min(fit['bkgd_lowlim'], fit['bkgd_highlim'])
+    hi = max(fit['bkgd_lowlim'], fit['bkgd_highlim'])
+
+    #the background is smooth, so a point per pixel column is plenty
+    view_lo, view_hi = max(lo, min(x_lo, x_hi)), min(hi, max(x_lo, x_hi))
+    if view_lo <= view_hi:
+        x = numpy.linspace(view_lo, view_hi, width + 1)
+    else:
+        x = numpy.empty(0)
+    traces.append(('background', x, bkgd_func(x)))
+
+    s = view_slice(wavenum, lo, hi)
+    in_range = (wavenum[s] >= lo) & (wavenum[s] <= hi)
+    sub_x = wavenum[s][in_range]
+    sub_y = absorbance[s][in_range] - bkgd_func(sub_x)
+    x, y = minmax_decimate(sub_x, sub_y, x_lo, x_hi, width)
+    traces.append(('subtracted', x, y))
+    return traces
+
+
+def encode_json(meta, traces):
+    out = dict(meta)
+    out['traces'] = {name: {'x': x.tolist(), 'y': y.tolist()} for name, x, y in traces}
+    return json.dumps(out).encode('utf-8')
+
+
+def encode_binary(meta, traces):
+    """
+    Packs the traces into bytes that a browser can read straight into
+    Float32Arrays. The layout is:
+
+        'FTRP'                    magic
+        uint32 (little endian)    length of the header
+        header                    JSON, padded with spaces to a multiple of 4 bytes
+        float32 data              for each trace, its x values then its y values
+
+    The header is 'meta' plus "traces": [{"name": ..., "n": ...}, ...] giving
+    the order and length of the traces in the data.
+    """
+    header = dict(meta)
+    header['traces'] = [{'name': name, 'n': len(x)} for name, x, y in traces]
+    header = json.dumps(header).encode('utf-8')
+    header += b' ' * (-len(header) % 4)
+    parts = [BINARY_MAGIC, struct.pack('<I', len(header)), header]
+    for name, x, y in traces:
+        parts.append(numpy.asarray(x, dtype='<f4').tobytes())
+        parts.append(numpy.asarray(y, dtype='<f4').tobytes())
+    return b''.join(parts)
+
+
+def load_spectrum_job(spectrum_id, data, max_size):
+    """
+    Runs in a worker thread: parses an uploaded file, which may decompress
+    to at most 'max_size' bytes, and returns its Spectrum.
+    """
+    return Spectrum(spectrum_id, *parse_spectrum(data, max_size=max_size))
+
+
+def fit_bands_job(spectrum, bands):
+    """
+    Runs in a worker thread: fits the bands to the spectrum's ProcessedScan
+    and returns their results as JSON-able dicts.
+    """
+    with spectrum.lock:
+        return [_band_result_json(r) for r in process_scan_bands(spectrum.scan, bands)]
+
+
+def preview_band_job(spectrum, band):
+    """
+    Runs in a worker thread: fits the background of 'band' straight from
+    the spectrum's moment tables, without rejecting any points, and returns
+    the result as fit_bands_job() does, with "preview": true.
+    """
+    t0 = time.perf_counter()
+    try:
+        bkgd_func = spectrum.scan.fit_bkgd_lims(band.bkgd_lowlim, band.bkgd_highlim,
+                                                band.excl_lowlim, band.excl_highlim,
+                                                band.bkgd_fit_order)
+        lo = min(band.bkgd_lowlim, band.bkgd_highlim)
+        hi = max(band.bkgd_lowlim, band.bkgd_highlim)
+        s = view_slice(spectrum.wavenum, lo, hi)
+        x = spectrum.wavenum[s]
+        in_range = (x >= lo) & (x <= hi)
+        if not numpy.any(in_range):
+            raise ValueError("No points between the background limits")
+        peak_height = numpy.max(spectrum.absorbance[s][in_range] - bkgd_func(x[in_range]))
+        result = BandResult(band, peak_height=peak_height, bkgd_func=bkgd_func, n_ignored=0,
+                            iterations=0, converged=True, fit_time=time.perf_counter() - t0)
+    except (ValueError, numpy.linalg.LinAlgError) as e:
+        result = BandResult(band, fit_time=time.perf_counter() - t0, error=e)
+    return dict(_band_result_json(result), preview=True)
+
+
+class FitServer:
+    """
+    The HTTP service. Requests are handled on an asyncio event loop, and the
+    parsing, fitting and decimating are done in a pool of 'workers' threads.
+    """
+    def __init__(self, store=None, workers=None, max_upload_bytes=DEFAULT_MAX_UPLOAD_MB * 1024 * 1024,
+                 index_file=DEFAULT_INDEX, plot_cache_bytes=DEFAULT_PLOT_CACHE_MB * 1024 * 1024,
+                 max_decompressed_bytes=DEFAULT_MAX_DECOMPRESSED_MB * 1024 * 1024):
+        if store is None:
+            store = SessionStore()
+        self.store = store
+        self.fit_cache = LRUCache(max_entries=DEFAULT_FIT_CACHE_SIZE)
+        self.plot_cache = LRUCache(max_bytes=plot_cache_bytes)
+        self.max_upload_bytes = max_upload_bytes
+        self.max_decompressed_bytes = max_decompressed_bytes
+        self.index_file = index_file
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        self.n_requests = 0
+
+        self.routes = []
+        self.add_route('GET', r'/', self.get_index)
+        self.add_route('POST', r'/spectra', self.post_spectrum)
+        self.add_route('GET', r'/spectra/(\w+)', self.get_spectrum)
+        self.add_route('DELETE', r'/spectra/(\w+)', self.delete_spectrum)
+        self.add_route('POST', r'/spectra/(\w+)/fit', self.post_fit)
+        self.add_route('POST', r'/spectra/(\w+)/peak', self.post_peak)
+        self.add_route('GET', r'/spectra/(\w+)/plot', self.get_plot)
+
+    def add_route(self, method, pattern, handler):
+        """
+        Registers 'handler' for requests matching 'method' and the path
+        regex 'pattern'. It is called as handler(request, *groups) and must
+        be a coroutine returning (status, body, content type), where body is
+        bytes or anything that can be sent as JSON.
+        """
+        self.routes.append((method, re.compile(pattern + '$'), handler))
+
+    async def run_in_pool(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    def close(self):
+        self.executor.shutdown()
+
+    # ----------------- handlers ----------------- #
+
+    async def get_index(self, request):
+        try:
+            with open(self.index_file, 'rb') as ifp:
+                return 200, ifp.read(), 'text/html; charset=utf-8'
+        except OSError:
+            raise HTTPError(404, "Front end not found")
+
+    async def post_spectrum(self, request):
+        data = request.body
+        spectrum_id = hashlib.blake2b(data, digest_size=16).hexdigest()
+        try:
+            spectrum = self.store.get(spectrum_id)
+        except HTTPError:
+            try:
+                spectrum = await self.run_in_pool(load_spectrum_job, spectrum_id, data,
+                                                  self.max_decompressed_bytes)
+            except ValueError as e:
+                raise HTTPError(400, "Could not read the spectrum: %s" % e)
+            spectrum = self.store.add(spectrum)
+        return 201, spectrum.info(), None
+
+    async def get_spectrum(self, request, spectrum_id):
+        return 200, self.store.get(spectrum_id).info(), None
+
+    async def delete_spectrum(self, request, spectrum_id):
+        if self.store.remove(spectrum_id) is None:
+            raise HTTPError(404, "No spectrum with id %r" % spectrum_id)
+        return 204, b'', None
+
+    async def fit(self, spectrum, band, preview=False):
+        """
+        Returns the fit of 'band' to 'spectrum' (as from fit_bands_job(), or
+        preview_band_job() if 'preview' is True), reusing an earlier fit
+        with the same limits if there is one.
+        """
+        #the moment tables are rebuilt for higher orders, so never let one
+        #through, whichever way the band was made
+        check_fit_order(band)
+        key = (spectrum.id, band_key(band), preview)
+        result = self.fit_cache.get(key)
+        if result is None:
+            if preview:
+                result = await self.run_in_pool(preview_band_job, spectrum, band)
+            else:
+                result, = await self.run_in_pool(fit_bands_job, spectrum, [band])
+            self.fit_cache.put(key, result)
+        #the name isn't part of the key, so take it from this request
+        return dict(result, band=band.name)
+
+    async def post_fit(self, request, spectrum_id):
+        spectrum = self.store.get(spectrum_id)
+        params = request.json()
+        band = parse_band_params(params)
+        return 200, await self.fit(spectrum, band, bool(params.get('preview'))), None
+
+    async def get_plot(self, request, spectrum_id):
+        spectrum = self.store.get(spectrum_id)
+        query = {k: v[-1] for k, v in request.query.items()}
+        try:
+            x_lo = float(query.get('x_lo', numpy.min(spectrum.wavenum)))
+            x_hi = float(query.get('x_hi', numpy.max(spectrum.wavenum)))
+            width = int(query.get('width', 800))
+        except ValueError as e:
+            raise HTTPError(400, "Invalid view: %s" % e)
+        if not 0 < width <= MAX_PLOT_WIDTH:
+            raise HTTPError(400, "width must be between 1 and %d" % MAX_PLOT_WIDTH)
+        fmt = query.get('format', 'json')
+        if fmt not in ('json', 'binary'):
+            raise HTTPError(400, "format must be 'json' or 'binary'")
+
+        band = None
+        if 'preset' in query or 'bkgd_lowlim' in query:
+            band = parse_band_params(query)
+        preview = query.get('preview', '0').lower() not in ('0', 'false', '')
+
+        key = (spectrum_id, x_lo, x_hi, width, None if band is None else band_key(band), preview,
+               fmt)
+        body = self.plot_cache.get(key)
+        if body is None:
+            meta = {'id': spectrum_id, 'x_lo': x_lo, 'x_hi': x_hi, 'width': width}
+            fit = None
+            if band is not None:
+                fit = await self.fit(spectrum, band, preview)
+                meta['fit'] = fit
+            traces = await self.run_in_pool(plot_traces, spectrum.wavenum, spectrum.absorbance,
+                                            x_lo, x_hi, width, fit)
+            encode = encode_binary if fmt == 'binary' else encode_json
+            body = encode(meta, traces)
+            self.plot_cache.put(key, body, len(body))
+
+        if fmt == 'binary':
+            return 200, body, 'application/octet-stream'
+        return 200, body, 'application/json'
+
+    async def post_peak(self, request, spectrum_id):
+        spectrum = self.store.get(spectrum_id)
+        params = request.json() if request.body else {}
+        if 'bands' in params:
+            if not isinstance(params['bands'], list):
+                raise HTTPError(400, "'bands' must be a list")
+            bands = [parse_band_params(b) for b in params['bands']]
+        else:
+            bands = list(PRESETS.values())
+        results = await self.run_in_pool(fit_bands_job, spectrum, bands)
+        return 200, {'id': spectrum_id,
+                     'peaks': [{'band': r['band'], 'peak_height': r.get('peak_height'),
+                                'error': r.get('error')} for r in results]}, None
+
+    # ----------------- HTTP ----------------- #
+
+    async def dispatch(self, request):
+        allowed = []
+        for method, pattern, handler in self.routes:
+            m = pattern.match(request.path)
+            if m is None:
+                continue
+            if method != request.method:
+                allowed.append(method)
+                continue
+            return await handler(request, *m.groups())
+        if allowed:
+            raise HTTPError(405, "Method %s not allowed for %s" % (request.method, request.path))
+        raise HTTPError(404, "Not found: %s" % request.path)
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(Request.read(reader, self.max_upload_bytes),
+                                                     KEEPALIVE_TIMEOUT)
+                except HTTPError as e:
+                    #the rest of the request can't be trusted, so close afterwards
+                    await self.send(writer, e.status, {'error': e.message}, None, keep_alive=False)
+                    break
+                if request is None:
+                    break
+
+                self.n_requests += 1
+                try:
+                    status, body, content_type = await self.dispatch(request)
+                except HTTPError as e:
+                    status, body, content_type = e.status, {'error': e.message}, None
+                except Exception as e:
+                    print("error handling %s %s: %r" % (request.method, request.path, e), file=sys.stderr)
+                    status, body, content_type = 500, {'error': "Internal error"}, None
+
+                await self.send(writer, status, body, content_type, request.keep_alive)
+                if not request.keep_alive:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def send(self, writer, status, body, content_type, keep_alive):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode('utf-8')
+            content_type = 'application/json'
+        headers = ["HTTP/1.1 %d %s" % (status, STATUS_REASONS.get(status, '')),
+                   "Content-Length: %d" % len(body),
+                   "Connection: %s" % ('keep-alive' if keep_alive else 'close')]
+        if content_type is not None:
+            headers.append("Content-Type: %s" % content_type)
+        writer.write(("\r\n".join(headers) + "\r\n\r\n").encode('latin-1') + body)
+        await writer.drain()
+
+    async def serve(self, host='127.0.0.1', port=DEFAULT_PORT):
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        async with server:
+            await server.serve_forever()
+
+
+class Request:
+    """
+    A parsed HTTP request.
+    """
+    def __init__(self, method, path, query, headers, body, version):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.headers = headers
+        self.body = body
+        connection = headers.get('connection', '').lower()
+        if version == 'HTTP/1.0':
+            self.keep_alive = connection == 'keep-alive'
+        else:
+            self.keep_alive = connection != 'close'
+
+    def json(self):
+        try:
+            return json.loads(self.body.decode('utf-8'))
+        except ValueError as e:
+            raise HTTPError(400, "Invalid JSON: %s" % e)
+
+    @classmethod
+    async def read(cls, reader, max_body_bytes):
+        """
+        Reads a request from 'reader'. Returns None if the connection was
+        closed before a new request started.
+        """
+        line = await reader.readline()
+        if not line:
+            return None
+        try:
+            method, target, version = line.decode('latin-1').split()
+        except ValueError:
+            raise HTTPError(400, "Malformed request line")
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, sep, value = line.decode('latin-1').partition(':')
+            if not sep:
+                raise HTTPError(400, "Malformed header")
+            headers[name.strip().lower()] = value.strip()
+
+        if 'chunked' in headers.get('transfer-encoding', '').lower():
+            raise HTTPError(400, "Chunked requests are not supported, send a Content-Length")
+        try:
+            length = int(headers.get('content-length', 0))
+        except ValueError:
+            raise HTTPError(400, "Invalid Content-Length")
+        if length > max_body_bytes:
+            raise HTTPError(413, "Request body is larger than %d bytes" % max_body_bytes)
+        body = await reader.readexactly(length) if length else b''
+
+        url = urllib.parse.urlsplit(target)
+        return cls(method.upper(), url.path, urllib.parse.parse_qs(url.query), headers, body, version)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='ftir-bkgd-server',
+        description="Serve the background fitting web front end.")
+    parser.add_argument('--host', default='127.0.0.1',
+                        help="address to listen on (default: 127.0.0.1)")
+    parser.add_argument('-p', '--port', type=int, default=DEFAULT_PORT,
+                        help="port to listen on (default: %d)" % DEFAULT_PORT)
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help="number of fitting threads (default: the thread pool's default)")
+    parser.add_argument('--max-spectra', type=int, default=DEFAULT_MAX_SPECTRA,
+                        help="number of uploaded spectra to keep (default: %d)" % DEFAULT_MAX_SPECTRA)
+    parser.add_argument('--max-memory', type=float, default=None,
+                        help="maximum memory for uploaded spectra in MB")
+    parser.add_argument('--max-upload', type=float, default=DEFAULT_MAX_UPLOAD_MB,
+                        help="maximum size of an upload in MB (default: %d)" % DEFAULT_MAX_UPLOAD_MB)
+    parser.add_argument('--max-decompressed', type=float, default=DEFAULT_MAX_DECOMPRESSED_MB,
+                        help="maximum size a compressed upload may decompress to in MB "
+                             "(default: %d)" % DEFAULT_MAX_DECOMPRESSED_MB)
+    parser.add_argument('--plot-cache', type=float, default=DEFAULT_PLOT_CACHE_MB,
+                        help="memory for cached plot payloads in MB (default: %d)" % DEFAULT_PLOT_CACHE_MB)
+    parser.add_argument('--index', default=DEFAULT_INDEX,
+                        help="HTML file to serve as the front end")
+    args = parser.parse_args(argv)
+
+    max_bytes = None if args.max_memory is None else int(args.max_memory * 1024 * 1024)
+    server = FitServer(SessionStore(args.max_spectra, max_bytes), workers=args.workers,
+                       max_upload_bytes=int(args.max_upload * 1024 * 1024), index_file=args.index,
+                       plot_cache_bytes=int(args.plot_cache * 1024 * 1024),
+                       max_decompressed_bytes=int(args.max_decompressed * 1024 * 1024))
+    print("Serving on http://%s:%d/" % (args.host, args.port), file=sys.stderr)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,468 @@
+"""
+Watches the folders that a spectrometer writes to and fits each new
+spectrum as soon as it has been written, appending the peak heights to a
+CSV table (and optionally an SQLite database, see compute.results), e.g.:
+
+    ftir-bkgd-watch /data/session1 --preset 3500 -o session1.csv
+
+New and changed files are found with inotify on Linux, and by polling the
+folders elsewhere (or with --poll). A file is only fitted once its size and
+modification time have stopped changing for --settle seconds, so that
+half-written files aren't read. The fits run in a pool of worker processes,
+and the results are appended (and flushed) as each file finishes.
+
+The end-to-end latency of each spectrum, from when the file was last
+written to when its results were written, is tracked and summarised when
+the watch stops (with Ctrl-C, or after --idle-exit seconds with no new
+files).
+"""
+import argparse
+import collections
+import concurrent.futures
+import csv
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import signal
+import struct
+import sys
+import time
+
+import numpy
+
+from FTIRbackgroundsubtract.cli import (RESULT_COLUMNS, add_band_arguments, get_bands,
+                                        get_fit_options, process_file)
+from FTIRbackgroundsubtract.compute.loader import is_spectrum_filename
+from FTIRbackgroundsubtract.compute.results import ResultsStore
+
+#seconds that a file's size and modification time must be unchanged before
+#it is fitted
+DEFAULT_SETTLE = 1.0
+
+#seconds between scans of the folders by the polling watcher
+DEFAULT_POLL_INTERVAL = 1.0
+
+#seconds to wait for events while fits are running, which bounds how late
+#a finished fit is written
+RESULT_CHECK_INTERVAL = 0.02
+
+#number of recent spectra that the latency percentiles are taken over
+LATENCY_WINDOW = 1000
+
+#inotify constants from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+INOTIFY_EVENT = struct.Struct('iIII')
+
+
+def scan_spectra(dirs):
+    """
+    Returns a dict mapping each spectrum file under 'dirs' (recursively) to
+    its (size, mtime_ns).
+    """
+    found = {}
+    for d in dirs:
+        for dirpath, dirnames, files in os.walk(d):
+            for f in files:
+                if is_spectrum_filename(f):
+                    path = os.path.join(dirpath, f)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    found[path] = (st.st_size, st.st_mtime_ns)
+    return found
+
+
+class PollingWatcher:
+    """
+    Finds new and changed spectrum files by scanning the folders every
+    'interval' seconds. Works everywhere, but the cost of a scan grows with
+    the number of files.
+    """
+    def __init__(self, dirs, interval=DEFAULT_POLL_INTERVAL):
+        self.dirs = list(dirs)
+        self.interval = interval
+        self.snapshot = scan_spectra(self.dirs)
+        self.last_scan = time.monotonic()
+
+    def wait(self, timeout):
+        """
+        Waits up to 'timeout' seconds and returns the paths of the spectrum
+        files that have appeared or changed since the last call.
+        """
+        delay = self.last_scan + self.interval - time.monotonic()
+        if delay > timeout:
+            time.sleep(max(timeout, 0))
+            return []
+        time.sleep(max(delay, 0))
+        current = scan_spectra(self.dirs)
+        self.last_scan = time.monotonic()
+        changed = [p for p, sig in current.items() if self.snapshot.get(p) != sig]
+        self.snapshot = current
+        return changed
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher:
+    """
+    Finds new and changed spectrum files with Linux's inotify (through
+    ctypes, so no extra packages are needed), so that files are noticed as
+    soon as they are written without scanning the folders. Subfolders,
+    including ones created later, are watched too.
+
+    Raises OSError if inotify isn't available.
+    """
+    def __init__(self, dirs):
+        libc_name = ctypes.util.find_library('c')
+        if libc_name is None:
+            raise OSError(errno.ENOSYS, "can't find the C library")
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self.libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, "inotify isn't available")
+        self.libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e))
+        self.dirs = list(dirs)
+        self.watches = {}
+        for d in self.dirs:
+            self._add_tree(d)
+
+    def _add_tree(self, top):
+        #watches 'top' and its subfolders, returning the spectra already in
+        #them (which may have been written before the watch was added)
+        found = []
+        for dirpath, dirnames, files in os.walk(top):
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(dirpath),
+                                             IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE)
+            if wd < 0:
+                e = ctypes.get_errno()
+                raise OSError(e, "can't watch %s: %s" % (dirpath, os.strerror(e)))
+            self.watches[wd] = dirpath
+            found.extend(os.path.join(dirpath, f) for f in files if is_spectrum_filename(f))
+        return found
+
+    def wait(self, timeout):
+        """
+        Waits up to 'timeout' seconds and returns the paths of the spectrum
+        files that have been created or written to since the last call.
+        """
+        readable, _, _ = select.select([self.fd], [], [], max(timeout, 0))
+        if not readable:
+            return []
+
+        changed = set()
+        while True:
+            try:
+                buf = os.read(self.fd, 65536)
+            except BlockingIOError:
+                break
+            pos = 0
+            while pos < len(buf):
+                wd, mask, cookie, length = INOTIFY_EVENT.unpack_from(buf, pos)
+                name = os.fsdecode(buf[pos + INOTIFY_EVENT.size:pos + INOTIFY_EVENT.size + length]
+                                   .rstrip(b'\0'))
+                pos += INOTIFY_EVENT.size + length
+
+                if mask & IN_Q_OVERFLOW:
+                    #events were lost, so look at everything
+                    changed.update(scan_spectra(self.dirs))
+                    continue
+                dirpath = self.watches.get(wd)
+                if dirpath is None:
+                    continue
+                path = os.path.join(dirpath, name)
+                if mask & IN_ISDIR:
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        changed.update(self._add_tree(path))
+                elif is_spectrum_filename(name):
+                    changed.add(path)
+        return list(changed)
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+def get_watcher(dirs, poll=False, poll_interval=DEFAULT_POLL_INTERVAL):
+    """
+    Returns an InotifyWatcher for 'dirs', or a PollingWatcher if 'poll' is
+    True or inotify isn't available.
+    """
+    if not poll and sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(dirs)
+        except OSError:
+            pass
+    return PollingWatcher(dirs, poll_interval)
+
+
+class LatencyStats:
+    """
+    The end-to-end latencies (s) of the spectra processed so far. The
+    percentiles are over the most recent LATENCY_WINDOW of them.
+    """
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent = collections.deque(maxlen=LATENCY_WINDOW)
+
+    def add(self, latency):
+        self.count += 1
+        self.total += latency
+        self.max = max(self.max, latency)
+        self.recent.append(latency)
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else float('nan')
+
+    def percentile(self, q):
+        if not self.recent:
+            return float('nan')
+        return float(numpy.percentile(self.recent, q))
+
+    def summary(self):
+        return ("%d spectra, latency mean %.2f s, p50 %.2f s, p95 %.2f s, max %.2f s"
+                % (self.count, self.mean, self.percentile(50), self.percentile(95), self.max))
+
+
+class SpectrumWatch:
+    """
+    Fits spectra as they appear in the watched folders.
+
+        * watcher - an InotifyWatcher or PollingWatcher
+        * bands, fit_options - passed to cli.process_file()
+        * on_result - called with (filename, rows, latency) for each file
+                      that has been fitted, in the order they finish. The
+                      latency is None for files written before the watch
+                      started.
+        * workers - number of worker processes
+        * settle - seconds that a file must be unchanged before it is fitted
+        * known - dict mapping files that have already been fitted to their
+                  (size, mtime_ns), so that they are only fitted again if
+                  they change
+    """
+    def __init__(self, watcher, bands, fit_options, on_result, workers=None,
+                 settle=DEFAULT_SETTLE, known=None):
+        self.watcher = watcher
+        self.bands = bands
+        self.fit_options = fit_options
+        self.on_result = on_result
+        self.workers = workers or os.cpu_count() or 1
+        self.settle = settle
+        self.fitted = dict(known or {})
+        self.latency = LatencyStats()
+        self.start_time = time.time()
+
+        #files waiting to settle: path -> [(size, mtime_ns), time of the last change]
+        self.unsettled = {}
+        #running fits: future -> (path, (size, mtime_ns))
+        self.running = {}
+
+    def add(self, paths):
+        """
+        Queues files to be fitted once they have settled.
+        """
+        now = time.monotonic()
+        for path in paths:
+            entry = self.unsettled.get(path)
+            if entry is None:
+                self.unsettled[path] = [None, now]
+            else:
+                entry[1] = now
+
+    def _check_settled(self, executor):
+        #submits the files whose size and modification time haven't changed
+        #for 'settle' seconds
+        now = time.monotonic()
+        for path, entry in list(self.unsettled.items()):
+            try:
+                st = os.stat(path)
+            except OSError:
+                #deleted or renamed before it settled
+                del self.unsettled[path]
+                continue
+            sig = (st.st_size, st.st_mtime_ns)
+            if sig != entry[0]:
+                entry[0] = sig
+                entry[1] = now
+            elif now - entry[1] >= self.settle and st.st_size > 0:
+                del self.unsettled[path]
+                if self.fitted.get(path) != sig:
+                    future = executor.submit(process_file, path, self.bands, self.fit_options)
+                    self.running[future] = (path, sig)
+
+    def _collect(self):
+        #passes on the results of the fits that have finished
+        done = [f for f in self.running if f.done()]
+        for future in done:
+            path, sig = self.running.pop(future)
+            if future.cancelled():
+                continue
+            try:
+                filename, pid, elapsed, rows = future.result()
+            except (Exception, KeyboardInterrupt) as e:
+                #e.g. a worker that was killed, which breaks the pool. The file
+                #isn't marked as fitted, so it is tried again if it changes or
+                #the watch is restarted without --new-only
+                print("%s: not fitted: %s" % (path, type(e).__name__), file=sys.stderr, flush=True)
+                continue
+            self.fitted[path] = sig
+            latency = None
+            if sig[1] * 1e-9 >= self.start_time:
+                latency = time.time() - sig[1] * 1e-9
+                self.latency.add(latency)
+            self.on_result(filename, rows, latency)
+
+    def run(self, idle_exit=None):
+        """
+        Watches and fits until interrupted with Ctrl-C, or until no files
+        have arrived or been fitted for 'idle_exit' seconds. Returns the
+        LatencyStats.
+        """
+        last_activity = time.monotonic()
+        with concurrent.futures.ProcessPoolExecutor(max_workers=self.workers,
+                                                    initializer=_ignore_sigint) as executor:
+            try:
+                while True:
+                    if self.running:
+                        timeout = RESULT_CHECK_INTERVAL
+                    elif self.unsettled:
+                        timeout = min(self.settle / 4.0, DEFAULT_POLL_INTERVAL)
+                    else:
+                        timeout = DEFAULT_POLL_INTERVAL
+                    changed = self.watcher.wait(timeout)
+                    if changed:
+                        self.add(changed)
+                    busy = self.unsettled or self.running
+                    self._check_settled(executor)
+                    self._collect()
+                    if changed or busy:
+                        last_activity = time.monotonic()
+                    elif idle_exit is not None and time.monotonic() - last_activity > idle_exit:
+                        break
+            except KeyboardInterrupt:
+                #finish the fits that have been started, but no more
+                for future in self.running:
+                    future.cancel()
+                concurrent.futures.wait(list(self.running))
+                self._collect()
+            finally:
+                self.watcher.close()
+        return self.latency
+
+
+def _ignore_sigint():
+    #Ctrl-C goes to the whole process group, but only the main process
+    #should stop, and let the workers finish the fits they have started
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='ftir-bkgd-watch',
+        description="Watch folders for new FTIR spectra, fit their backgrounds as they "
+                    "arrive and append the peak heights to a CSV table.")
+    parser.add_argument('dirs', nargs='+', metavar='DIR', help="folders to watch")
+    add_band_arguments(parser)
+    parser.add_argument('-o', '--output', default='-',
+                        help="CSV file to append the results to (default: stdout)")
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help="number of worker processes (default: number of cores)")
+    parser.add_argument('--db', default=None,
+                        help="SQLite database to store the results in as well")
+    parser.add_argument('--new-only', action='store_true',
+                        help="only fit files that appear or change after the watch starts, "
+                             "not the ones already in the folders")
+    parser.add_argument('--settle', type=float, default=DEFAULT_SETTLE, metavar='SECONDS',
+                        help="time a file must be unchanged before it is fitted (default: %g)"
+                             % DEFAULT_SETTLE)
+    parser.add_argument('--poll', action='store_true',
+                        help="poll the folders instead of using inotify")
+    parser.add_argument('--poll-interval', type=float, default=DEFAULT_POLL_INTERVAL,
+                        metavar='SECONDS', help="time between polls (default: %g)"
+                                                % DEFAULT_POLL_INTERVAL)
+    parser.add_argument('--idle-exit', type=float, default=None, metavar='SECONDS',
+                        help="stop after this long with no new files (default: run until "
+                             "interrupted)")
+    parser.add_argument('-q', '--quiet', action='store_true',
+                        help="don't report each spectrum or the latency summary")
+    args = parser.parse_args(argv)
+    bands = get_bands(parser, args)
+    fit_options = get_fit_options(args)
+    for d in args.dirs:
+        if not os.path.isdir(d):
+            parser.error("%s is not a folder" % d)
+
+    #the existing files count as new unless --new-only
+    watcher = get_watcher(args.dirs, args.poll, args.poll_interval)
+    known = scan_spectra(args.dirs) if args.new_only else {}
+
+    if args.output == '-':
+        ofp = sys.stdout
+        new_file = True
+    else:
+        new_file = not os.path.exists(args.output) or os.path.getsize(args.output) == 0
+        ofp = open(args.output, 'a', newline='')
+    writer = csv.DictWriter(ofp, fieldnames=RESULT_COLUMNS, extrasaction='ignore')
+    if new_file:
+        writer.writeheader()
+        ofp.flush()
+    store = ResultsStore(args.db) if args.db is not None else None
+
+    def on_result(filename, rows, latency):
+        writer.writerows(rows)
+        ofp.flush()
+        #the rows have the hash of the contents the worker fitted, unless
+        #the file couldn't be read
+        if store is not None and 'hash' in rows[0]:
+            store.put_files([(filename, rows[0]['hash'], rows[0]['mtime_ns'], rows[0]['size'])])
+            store.put_many([dict(r, band=b) for b, r in zip(bands, rows)], fit_options)
+        if not args.quiet:
+            errors = [r['error'] for r in rows if r['error']]
+            msg = "%s: %s" % (filename, errors[0] if errors else "ok")
+            if latency is not None:
+                msg += " (latency %.2f s)" % latency
+            print(msg, file=sys.stderr, flush=True)
+
+    if not args.quiet:
+        print("watching %s with %s" % (", ".join(args.dirs), type(watcher).__name__),
+              file=sys.stderr, flush=True)
+    watch = SpectrumWatch(watcher, bands, fit_options, on_result, args.workers, args.settle,
+                          known)
+    if not args.new_only:
+        watch.add(scan_spectra(args.dirs))
+    try:
+        watch.run(args.idle_exit)
+    except KeyboardInterrupt:
+        #a second Ctrl-C while waiting for the running fits
+        pass
+    finally:
+        if ofp is not sys.stdout:
+            ofp.close()
+        if store is not None:
+            store.close()
+        #the summary of the spectra fitted so far, however the watch stopped
+        if not args.quiet:
+            print(watch.latency.summary(), file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,119 @@
+"""
+Compares loading a set of spectra from compressed files and archives
+directly against the old workflow of decompressing them to a temporary
+folder first, and against loading the uncompressed files.
+
+Usage: python benchmarks/bench_compressed.py [n_spectra] [n_points]
+"""
+import gzip
+import os
+import shutil
+import sys
+import tarfile
+import tempfile
+import time
+import zipfile
+
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from FTIRbackgroundsubtract.compute.archive import iter_archive
+from FTIRbackgroundsubtract.compute.loader import is_spectrum_filename, load_spectrum, parse_spectrum
+
+
+def write_spectra(folder, n_spectra, n_points):
+    rng = numpy.random.default_rng(0)
+    wavenum = numpy.linspace(7000.0, 1200.0, n_points)
+    filenames = []
+    for i in range(n_spectra):
+        absorbance = (0.5 + 1e-4 * (wavenum - 1200.0)
+                      + numpy.exp(-((wavenum - 3550.0) / 150.0) ** 2)
+                      + rng.normal(0, 1e-3, n_points))
+        filename = os.path.join(folder, "s%04d.csv" % i)
+        numpy.savetxt(filename, numpy.column_stack((wavenum, absorbance)), fmt='%.6f',
+                      delimiter=',')
+        filenames.append(filename)
+    return filenames
+
+
+def load_folder(folder):
+    return [load_spectrum(os.path.join(folder, f)) for f in sorted(os.listdir(folder))
+            if is_spectrum_filename(f)]
+
+
+def load_archive(filename):
+    return [parse_spectrum(data) for name, data in iter_archive(filename, is_spectrum_filename)]
+
+
+def load_extracted(filename):
+    #the old workflow: extract to a temporary folder, then load the files
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if filename.endswith('.zip'):
+            with zipfile.ZipFile(filename) as zf:
+                zf.extractall(tmp_dir)
+        else:
+            with tarfile.open(filename) as tar:
+                tar.extractall(tmp_dir)
+        return load_folder(tmp_dir)
+
+
+def load_gunzipped(folder):
+    #the old workflow for single compressed files
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for f in sorted(os.listdir(folder)):
+            with gzip.open(os.path.join(folder, f), 'rb') as ifp:
+                with open(os.path.join(tmp_dir, f[:-3]), 'wb') as ofp:
+                    shutil.copyfileobj(ifp, ofp)
+        return load_folder(tmp_dir)
+
+
+def timed(name, func, arg, reference):
+    t0 = time.perf_counter()
+    spectra = func(arg)
+    elapsed = time.perf_counter() - t0
+    assert len(spectra) == len(reference), name
+    for (w, a), (w_ref, a_ref) in zip(spectra, reference):
+        assert numpy.array_equal(w, w_ref) and numpy.array_equal(a, a_ref), name
+    print("%-28s %8.3f s  %7.1f spectra/s" % (name, elapsed, len(spectra) / elapsed))
+
+
+def main(n_spectra=200, n_points=20000):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        plain = os.path.join(tmp_dir, 'plain')
+        gzipped = os.path.join(tmp_dir, 'gzipped')
+        os.mkdir(plain)
+        os.mkdir(gzipped)
+        filenames = write_spectra(plain, n_spectra, n_points)
+        for f in filenames:
+            with open(f, 'rb') as ifp:
+                data = ifp.read()
+            with gzip.open(os.path.join(gzipped, os.path.basename(f) + '.gz'), 'wb') as ofp:
+                ofp.write(data)
+
+        archives = []
+        for ext, mode in (('.tar.gz', 'w:gz'), ('.tar.xz', 'w:xz')):
+            archive = os.path.join(tmp_dir, 'spectra' + ext)
+            with tarfile.open(archive, mode) as tar:
+                for f in filenames:
+                    tar.add(f, arcname=os.path.basename(f))
+            archives.append(archive)
+        archive = os.path.join(tmp_dir, 'spectra.zip')
+        with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as zf:
+            for f in filenames:
+                zf.write(f, arcname=os.path.basename(f))
+        archives.append(archive)
+
+        print("%d spectra of %d points, %.1f MB of text" % (
+            n_spectra, n_points, sum(os.path.getsize(f) for f in filenames) / 1e6))
+        reference = load_folder(plain)
+        timed("plain .csv", load_folder, plain, reference)
+        timed(".csv.gz, gunzip to temp", load_gunzipped, gzipped, reference)
+        timed(".csv.gz, direct", load_folder, gzipped, reference)
+        for archive in archives:
+            ext = archive[len(os.path.join(tmp_dir, 'spectra')):]
+            timed("%s, extract to temp" % ext, load_extracted, archive, reference)
+            timed("%s, streamed" % ext, load_archive, archive, reference)
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,177 @@
+"""
+Compares loading the same spectrum from each of the instrument formats
+(Bruker OPUS, Thermo OMNIC .spa and JCAMP-DX, both plain and ASDF
+compressed) against loading it from a CSV export, and checks that they all
+give the same values.
+
+The files are written by the minimal writers below, which only write what
+the readers need.
+
+Usage: python benchmarks/bench_formats.py [n_points] [repeats]
+"""
+import os
+import struct
+import sys
+import tempfile
+import time
+
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from FTIRbackgroundsubtract.compute.jcamp import decode_xydata
+from FTIRbackgroundsubtract.compute.loader import get_reader, load_spectrum
+
+
+def make_spectrum(n_points):
+    wavenum = numpy.linspace(7000.0, 1200.0, n_points)
+    absorbance = 0.5 + 1e-4 * (wavenum - 1200.0) + numpy.exp(-((wavenum - 3550.0) / 150.0) ** 2)
+    return wavenum, absorbance
+
+
+def write_csv(filename, x, y):
+    numpy.savetxt(filename, numpy.column_stack((x, y)), fmt='%.6e', delimiter=',')
+
+
+def _opus_param(name, value):
+    if isinstance(value, int):
+        raw, value_type = struct.pack('<i', value), 0
+    elif isinstance(value, float):
+        raw, value_type = struct.pack('<d', value), 1
+    else:
+        raw = value.encode() + b'\0'
+        raw += b'\0' * (-len(raw) % 4)
+        value_type = 2
+    return struct.pack('<4shh', name.encode(), value_type, len(raw) // 2) + raw
+
+
+def write_opus(filename, x, y):
+    params = b''.join(_opus_param(k, v) for k, v in (
+        ('DPF', 1), ('NPT', len(x)), ('FXV', float(x[0])), ('LXV', float(x[-1])),
+        ('CSF', 1.0), ('DXU', 'WN'))) + struct.pack('<4shh', b'END', 0, 0)
+    params += b'\0' * (-len(params) % 4)
+    data = numpy.asarray(y, dtype='<f4').tobytes()
+
+    header_len = 504
+    entries = [(31, 16, len(params), header_len), (15, 16, len(data), header_len + len(params))]
+    header = bytearray(header_len)
+    struct.pack_into('<4sdiii', header, 0, b'\x0a\x0a\x0a\x0a', 920622.0, 24, 40, len(entries))
+    for i, (data_type, channel, length, offset) in enumerate(entries):
+        struct.pack_into('<BBBBii', header, 24 + 12 * i, data_type, channel, 0, 0, length // 4,
+                         offset)
+    with open(filename, 'wb') as ofp:
+        ofp.write(bytes(header) + params + data)
+
+
+def write_spa(filename, x, y):
+    header = bytearray(304 + 2 * 16)
+    header[:18] = b'Spectral Data File'
+    header[30:30 + 9] = b'benchmark'
+    struct.pack_into('<H', header, 294, 2)
+    spectrum_header = struct.pack('<4xI B3x B3x ff', len(x), 1, 17, x[0], x[-1]).ljust(64, b'\0')
+    data = numpy.asarray(y, dtype='<f4').tobytes()
+    struct.pack_into('<BxII', header, 304, 2, len(header), len(spectrum_header))
+    struct.pack_into('<BxII', header, 320, 3, len(header) + len(spectrum_header), len(data))
+    with open(filename, 'wb') as ofp:
+        ofp.write(bytes(header) + spectrum_header + data)
+
+
+def _sqz(v):
+    s = str(abs(v))
+    return ('@ABCDEFGHI' if v >= 0 else '@abcdefghi')[int(s[0])] + s[1:]
+
+
+def _dif(v):
+    s = str(abs(v))
+    return ('%JKLMNOPQR' if v >= 0 else '%jklmnopqr')[int(s[0])] + s[1:]
+
+
+def _dup(n):
+    s = str(n)
+    return 'STUVWXYZs'[int(s[0]) - 1] + s[1:]
+
+
+def write_jcamp(filename, x, y, compress=False, per_line=10):
+    yfactor = 1e-6
+    ints = numpy.round(numpy.asarray(y) / yfactor).astype(numpy.int64)
+    lines = ["##TITLE=benchmark", "##JCAMP-DX=4.24", "##DATA TYPE=INFRARED SPECTRUM",
+             "##XUNITS=1/CM", "##YUNITS=ABSORBANCE", "##XFACTOR=1.0", "##YFACTOR=%g" % yfactor,
+             "##FIRSTX=%.10g" % x[0], "##LASTX=%.10g" % x[-1], "##NPOINTS=%d" % len(x),
+             "##XYDATA=(X++(Y..Y))"]
+    if compress:
+        #DIFDUP, with each line starting with a check of the last value
+        start = 0
+        while True:
+            stop = min(start + per_line, len(ints) - 1)
+            line = ["%.6f" % (x[start] / 1.0), _sqz(ints[start])]
+            difs = numpy.diff(ints[start:stop + 1])
+            i = 0
+            while i < len(difs):
+                j = i
+                while j + 1 < len(difs) and difs[j + 1] == difs[i]:
+                    j += 1
+                line.append(_dif(difs[i]))
+                if j > i:
+                    line.append(_dup(j - i + 1))
+                i = j + 1
+            lines.append(''.join(line[:1]) + ' ' + ''.join(line[1:]))
+            if stop >= len(ints) - 1:
+                break
+            start = stop
+    else:
+        for start in range(0, len(ints), per_line):
+            lines.append("%.6f %s" % (x[start], ' '.join(str(v) for v in ints[start:start + per_line])))
+    lines.append("##END=")
+    with open(filename, 'w') as ofp:
+        ofp.write('\n'.join(lines) + '\n')
+
+
+def time_loader(filename, repeats):
+    best = None
+    for i in range(repeats):
+        t0 = time.perf_counter()
+        load_spectrum(filename)
+        elapsed = time.perf_counter() - t0
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def check_unsigned_exponents():
+    #the E of an AFFN exponent without a sign isn't the SQZ digit 5
+    y = decode_xydata(b'1 1.0E+2 1.02E2\n2 -3e1 4.5E-1\n')
+    assert numpy.allclose(y, [100.0, 102.0, -30.0, 0.45]), y
+
+
+def main(n_points=20000, repeats=20):
+    check_unsigned_exponents()
+    x, y = make_spectrum(n_points)
+    files = (('CSV', 'spectrum.csv', write_csv),
+             ('OPUS', 'spectrum.0', write_opus),
+             ('SPA', 'spectrum.spa', write_spa),
+             ('JCAMP-DX (AFFN)', 'spectrum.jdx', write_jcamp),
+             ('JCAMP-DX (DIFDUP)', 'spectrum_asdf.jdx',
+              lambda f, x, y: write_jcamp(f, x, y, compress=True)))
+
+    print("%d points" % n_points)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        t_csv = None
+        for name, basename, writer in files:
+            filename = os.path.join(tmp_dir, basename)
+            writer(filename, x, y)
+            size_kb = os.path.getsize(filename) / 1e3
+            with open(filename, 'rb') as ifp:
+                reader = get_reader(ifp.read()).name
+
+            w, a = load_spectrum(filename)
+            #the binary formats store float32, and the JCAMP-DX files 1e-6 steps
+            assert numpy.allclose(w, x, rtol=1e-6) and numpy.allclose(a, y, rtol=1e-6, atol=1e-6), name
+
+            elapsed = time_loader(filename, repeats)
+            if t_csv is None:
+                t_csv = elapsed
+            print("%-18s %-6s %9.1f kB %8.2f ms  %5.1fx the CSV speed"
+                  % (name, reader, size_kb, elapsed * 1e3, t_csv / elapsed))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
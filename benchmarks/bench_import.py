@@ -0,0 +1,54 @@
+"""
+Checks that the headless compute package can be imported without loading
+wxPython or matplotlib, and within a fixed time budget.
+
+Usage: python benchmarks/bench_import.py [repeats]
+
+Exits with a non-zero status if either check fails.
+"""
+import os
+import subprocess
+import sys
+
+
+#maximum time allowed to import FTIRbackgroundsubtract.compute (s)
+IMPORT_BUDGET = 0.5
+
+IMPORT_SCRIPT = """
+import sys, time
+t0 = time.perf_counter()
+import FTIRbackgroundsubtract.compute
+elapsed = time.perf_counter() - t0
+gui = [m for m in ('wx', 'matplotlib', 'pylab') if m in sys.modules]
+print(elapsed, ','.join(gui))
+"""
+
+
+def time_import(repo_dir):
+    #each import has to be timed in a fresh interpreter
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([repo_dir, env.get('PYTHONPATH', '')])
+    out = subprocess.run([sys.executable, '-c', IMPORT_SCRIPT], env=env, check=True,
+                         capture_output=True, text=True).stdout.split()
+    return float(out[0]), out[1].split(',') if len(out) > 1 else []
+
+
+def main(repeats=5):
+    repo_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+    results = [time_import(repo_dir) for i in range(repeats)]
+    best = min(r[0] for r in results)
+    gui_modules = results[0][1]
+
+    print("import FTIRbackgroundsubtract.compute: %.1f ms (budget %.1f ms)" % (best * 1e3, IMPORT_BUDGET * 1e3))
+    if gui_modules:
+        print("FAIL: GUI modules were imported: %s" % ', '.join(gui_modules))
+        return 1
+    if best > IMPORT_BUDGET:
+        print("FAIL: import took longer than the budget")
+        return 1
+    print("OK")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(*[int(a) for a in sys.argv[1:]]))
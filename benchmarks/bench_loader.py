@@ -0,0 +1,82 @@
+"""
+Compares the throughput of the spectrum loader against the original
+row-by-row csv.reader implementation of load_ftir_file.
+
+Usage: python benchmarks/bench_loader.py [n_points] [repeats]
+"""
+import csv
+import os
+import sys
+import tempfile
+import time
+
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from FTIRbackgroundsubtract.compute.loader import load_spectrum, parse_spectrum
+
+
+def csv_reader_load(filename):
+    #the original implementation of load_ftir_file, kept as the reference
+    reader = csv.reader(open(filename, "rt"), dialect="excel")
+
+    wavenumber = []
+    absorbance = []
+
+    for line in reader:
+        wavenumber.append(float(line[0]))
+        absorbance.append(float(line[1]))
+
+    return numpy.array(wavenumber), numpy.array(absorbance)
+
+
+def make_spectrum_file(filename, n_points):
+    """
+    Writes a synthetic spectrum in the same format as test-spectrum.CSV
+    """
+    wavenum = numpy.linspace(1200.0, 7000.0, n_points)
+    absorbance = 0.5 + 1e-4 * (wavenum - 1200.0) + numpy.exp(-((wavenum - 3550.0) / 150.0) ** 2)
+    numpy.savetxt(filename, numpy.column_stack((wavenum, absorbance)), fmt='%.6e', delimiter=',')
+
+
+def check_ragged_rows():
+    #rows with a missing value must be an error, as they were with
+    #csv.reader, not paired up with the values of the next row
+    for data in (b'1,2\n3,\n4,\n', b'1,2\n3\n4\n', b'1 2 3\n4\n', b'1,2\r3\r4\r'):
+        try:
+            parse_spectrum(data)
+        except ValueError:
+            continue
+        raise AssertionError("ragged rows %r were accepted" % data)
+
+
+def time_loader(func, filename, repeats):
+    best = None
+    for i in range(repeats):
+        t0 = time.perf_counter()
+        func(filename)
+        elapsed = time.perf_counter() - t0
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main(n_points=500000, repeats=5):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        filename = os.path.join(tmp_dir, 'spectrum.csv')
+        make_spectrum_file(filename, n_points)
+        size_mb = os.path.getsize(filename) / 1e6
+
+        w_ref, a_ref = csv_reader_load(filename)
+        w, a = load_spectrum(filename)
+        assert numpy.array_equal(w, w_ref) and numpy.array_equal(a, a_ref)
+        check_ragged_rows()
+
+        print("%d points, %.1f MB" % (n_points, size_mb))
+        for name, func in (('csv.reader', csv_reader_load), ('load_spectrum', load_spectrum)):
+            elapsed = time_loader(func, filename, repeats)
+            print("%-15s %8.1f ms %8.1f MB/s" % (name, elapsed * 1e3, size_mb / elapsed))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,52 @@
+"""
+Measures how long the peak metrics (height, position, area, FWHM and
+centroid) take for a batch of background-subtracted spectra, comparing one
+call on the whole 2-D batch with a call per spectrum.
+
+Usage: python benchmarks/bench_metrics.py [n_spectra] [n_points]
+"""
+import os
+import sys
+import time
+
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from FTIRbackgroundsubtract.compute.metrics import peak_metrics
+
+
+def make_batch(n_spectra, n_points):
+    rng = numpy.random.default_rng(0)
+    wavenum = numpy.linspace(4000.0, 2400.0, n_points)
+    heights = rng.uniform(0.1, 2.0, (n_spectra, 1))
+    centres = rng.uniform(3450.0, 3650.0, (n_spectra, 1))
+    widths = rng.uniform(80.0, 200.0, (n_spectra, 1))
+    subtracted = heights * numpy.exp(-0.5 * ((wavenum - centres) / widths) ** 2)
+    subtracted += rng.normal(0, 0.002, subtracted.shape)
+    return wavenum, subtracted
+
+
+def main(n_spectra=10000, n_points=1600):
+    wavenum, subtracted = make_batch(n_spectra, n_points)
+    print("%d spectra of %d points" % (n_spectra, n_points))
+
+    t0 = time.perf_counter()
+    batch = peak_metrics(wavenum, subtracted, 2400.0, 4000.0)
+    t_batch = time.perf_counter() - t0
+    print("%-22s %8.1f ms  (%.2f us/spectrum)" % ('batched', t_batch * 1e3, t_batch / n_spectra * 1e6))
+
+    #the per-spectrum loop is slow, so only time some of the spectra
+    n_loop = min(n_spectra, 1000)
+    t0 = time.perf_counter()
+    singles = [peak_metrics(wavenum, subtracted[i], 2400.0, 4000.0) for i in range(n_loop)]
+    t_loop = (time.perf_counter() - t0) * n_spectra / n_loop
+    print("%-22s %8.1f ms  (%.2f us/spectrum)" % ('one call per spectrum', t_loop * 1e3,
+                                                  t_loop / n_spectra * 1e6))
+
+    for name in ('height', 'position', 'area', 'fwhm', 'centroid'):
+        expected = numpy.array([getattr(m, name) for m in singles])
+        assert numpy.allclose(getattr(batch, name)[:n_loop], expected, equal_nan=True), name
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
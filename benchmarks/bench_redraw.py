@@ -0,0 +1,120 @@
+"""
+Measures how long the plots take to update after the background is re-fitted
+(i.e. when Apply is pressed), comparing the persistent artists in
+FTIRbackgroundsubtract.plotting against the original approach of clearing
+and replotting every axes and then redrawing the whole figure.
+
+Uses the Agg backend, so no display (or wxPython) is needed.
+
+Usage: python benchmarks/bench_redraw.py [n_points] [n_updates]
+"""
+import os
+import sys
+import time
+
+import numpy
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from FTIRbackgroundsubtract.compute.scan import ProcessedScan
+from FTIRbackgroundsubtract.plotting import (BackgroundFitDisplay, BackgroundRangeSelector,
+                                             BackgroundSubtractedDisplay, get_view_lims, redraw_axes)
+
+
+class ReplotFitDisplay:
+    #the original displays, which clear and replot their axes on every update
+    def __init__(self, ax):
+        self.ax = ax
+
+    def update(self, scan):
+        self.ax.clear()
+        scan.plot_bkgd_fit(self.ax)
+        low_idx = numpy.argmin(numpy.abs(scan.angles-scan.bkgd_lowlim))
+        high_idx = numpy.argmin(numpy.abs(scan.angles-scan.bkgd_highlim))
+        self.ax.plot(scan.angles[low_idx:high_idx], scan.col_amount[low_idx:high_idx], 'k-')
+
+
+class ReplotSubtractedDisplay:
+    def __init__(self, ax):
+        self.ax = ax
+
+    def update(self, scan):
+        self.ax.clear()
+        low_idx = numpy.argmin(numpy.abs(scan.angles-scan.bkgd_lowlim))
+        high_idx = numpy.argmin(numpy.abs(scan.angles-scan.bkgd_highlim))
+        wavenum = scan.angles[low_idx:high_idx]
+        self.ax.plot(wavenum, scan.col_amount[low_idx:high_idx] - scan.bkgd_func(wavenum), 'g-')
+        self.ax.axhline(y=0, color='r')
+
+
+class ReplotRangeSelector:
+    def __init__(self, ax):
+        self.ax = ax
+
+    def update(self, scan):
+        self.ax.cla()
+        for x in (scan.bkgd_lowlim, scan.bkgd_highlim, scan.excl_lowlim, scan.excl_highlim):
+            self.ax.axvline(x, color='g')
+        self.ax.plot(scan.angles, scan.col_amount, 'b-')
+
+
+def make_scan(n_points):
+    wavenum = numpy.linspace(7000.0, 1200.0, n_points)
+    rng = numpy.random.default_rng(0)
+    absorbance = (0.5 + 1e-4 * (wavenum - 1200.0) + numpy.exp(-((wavenum - 3550.0) / 150.0) ** 2)
+                  + rng.normal(0, 0.005, n_points))
+    scan = ProcessedScan(wavenum, absorbance, bkgd_batch_reject=True)
+    scan.bkgd_lowlim, scan.bkgd_highlim = 2400.0, 4000.0
+    scan.excl_lowlim, scan.excl_highlim = 2590.0, 3788.0
+    return scan
+
+
+def make_figure():
+    fig = Figure(figsize=(8, 8))
+    FigureCanvasAgg(fig)
+    return fig, [fig.add_subplot(3, 1, i) for i in (1, 2, 3)]
+
+
+def time_updates(scan, displays, canvas, n_updates, incremental):
+    for d in displays:
+        d.update(scan.calculate())
+    canvas.draw()
+
+    times = []
+    for i in range(n_updates):
+        #nudge the excluded region, as if the user had edited it and pressed Apply
+        scan.excl_highlim = 3788.0 + (i % 2)
+        scan.calculate()
+
+        t0 = time.perf_counter()
+        if incremental:
+            view_lims = get_view_lims(d.ax for d in displays)
+            changed = [d.ax for d in displays if d.update(scan)]
+            redraw_axes(canvas, changed, view_lims)
+        else:
+            for d in displays:
+                d.update(scan)
+            canvas.draw()
+        times.append(time.perf_counter() - t0)
+    return numpy.median(times), numpy.max(times)
+
+
+def main(n_points=200000, n_updates=10):
+    scan = make_scan(n_points)
+    print("%d points, %d updates" % (n_points, n_updates))
+
+    fig, axes = make_figure()
+    displays = [ReplotRangeSelector(axes[0]), ReplotFitDisplay(axes[1]), ReplotSubtractedDisplay(axes[2])]
+    median, worst = time_updates(scan, displays, fig.canvas, n_updates, incremental=False)
+    print("%-22s median %8.1f ms  max %8.1f ms" % ('clear and replot', median * 1e3, worst * 1e3))
+
+    fig, axes = make_figure()
+    displays = [BackgroundRangeSelector(axes[0]), BackgroundFitDisplay(axes[1]),
+                BackgroundSubtractedDisplay(axes[2])]
+    median, worst = time_updates(scan, displays, fig.canvas, n_updates, incremental=True)
+    print("%-22s median %8.1f ms  max %8.1f ms" % ('persistent artists', median * 1e3, worst * 1e3))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
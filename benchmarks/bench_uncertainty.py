@@ -0,0 +1,65 @@
+"""
+Measures the cost per spectrum of the Monte Carlo and bootstrap
+uncertainties of the peak height of the test spectrum, fitting the
+realisations one at a time and as batches.
+
+Usage: python benchmarks/bench_uncertainty.py [n_samples] [workers]
+"""
+import os
+import sys
+import time
+
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from FTIRbackgroundsubtract.compute import ProcessedScan, load_spectrum
+from FTIRbackgroundsubtract.compute.uncertainty import METHODS, peak_uncertainty
+
+TEST_SPECTRUM = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                             'FTIRbackgroundsubtract', 'test-spectrum.CSV')
+
+
+def make_scan():
+    wavenum, absorbance = load_spectrum(TEST_SPECTRUM)
+    scan = ProcessedScan(wavenum, absorbance)
+    scan.bkgd_lowlim, scan.bkgd_highlim = 2400.0, 4000.0
+    scan.excl_lowlim, scan.excl_highlim = 2590.0, 3788.0
+    scan.calculate()
+    return scan
+
+
+def loop_montecarlo(scan, n_samples):
+    #the straightforward version: one numpy.polyfit per realisation
+    rng = numpy.random.default_rng(0)
+    idxs = scan.bkgd_idxs[0]
+    x, y = scan.angles[idxs], scan.col_amount[idxs]
+    in_lims = (scan.angles >= scan.bkgd_lowlim) & (scan.angles <= scan.bkgd_highlim)
+    heights = numpy.empty(n_samples)
+    for i in range(n_samples):
+        xs = x + rng.standard_normal(len(x)) * scan.angle_err[idxs]
+        ys = y + rng.standard_normal(len(y)) * scan.col_err[idxs]
+        c = numpy.polyfit(xs, ys, scan.bkgd_fit_order)
+        heights[i] = numpy.max(scan.col_amount[in_lims] - numpy.polyval(c, scan.angles[in_lims]))
+    return heights
+
+
+def main(n_samples=2000, workers=1):
+    scan = make_scan()
+    print("%d realisations of a %d point spectrum" % (n_samples, len(scan.angles)))
+
+    for method in METHODS:
+        result = peak_uncertainty(scan, n_samples, method, seed=0, workers=workers)
+        print("%-22s %8.1f ms/spectrum  peak height %.4f +- %.4f"
+              % (method, result.elapsed * 1e3, result.peak_height.value, result.peak_height.std))
+
+    #the loop is slow, so only time some of the realisations
+    n_loop = min(n_samples, 200)
+    t0 = time.perf_counter()
+    heights = loop_montecarlo(scan, n_loop)
+    t_loop = (time.perf_counter() - t0) * n_samples / n_loop
+    print("%-22s %8.1f ms/spectrum  peak height %.4f +- %.4f"
+          % ('montecarlo (loop)', t_loop * 1e3, numpy.mean(heights), numpy.std(heights, ddof=1)))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
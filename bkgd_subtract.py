@@ -1,159 +1,23 @@
 import wx
-import sys
 import os.path
-import pickle
 import matplotlib
 matplotlib.use('wxAgg') #bad things happen if you don't use the wxAgg backend
 import pylab as plt
 import numpy
-import math
-import csv
-
-class DraggableLine:
-    """
-    This class is mostly based on the draggable rectangles example from 
-    http://matplotlib.sourceforge.net/users/event_handling.html
-    
-    It provides a vertical line across 'axis' which can be dragged to any x
-    position. Useful for picking limits.
-    
-        * x_pos - initial x position to draw line at
-        * axis - axis to draw line into
-        * callback - list of functions to run when the line gets moved. The functions
-                     will be run in order, and will be passed the new x position of 
-                     the line as their only argument.
-    """
-    
-    lock = None
-    
-    def __init__(self, x_pos, axis, linewidth=2.0, color='r', callback=None):
-        
-        self.line = axis.plot([x_pos]*2,axis.get_ylim(), linewidth=linewidth, color=color)[0]
-
-        self.press = None
-        self.background = None
-        self.callback = callback
-        self.__connect()
-
-   
-    def __connect(self):
-        #connect to all the events we need
-        self.cidpress = self.line.figure.canvas.mpl_connect('button_press_event', self.on_press)
-        self.cidrelease = self.line.figure.canvas.mpl_connect('button_release_event', self.on_release)
-        self.cidmotion = self.line.figure.canvas.mpl_connect('motion_notify_event', self.on_motion)           
-        self.cidredraw = self.line.figure.canvas.mpl_connect('draw_event', self.on_redraw)
-
-
-    def disconnect(self):
-        #disconnect all the stored connection ids
-        self.line.figure.canvas.mpl_disconnect(self.cidpress)
-        self.line.figure.canvas.mpl_disconnect(self.cidrelease)
-        self.line.figure.canvas.mpl_disconnect(self.cidmotion)
-        self.line.figure.canvas.mpl_disconnect(self.cidredraw)
-
-        
-    def on_press(self, event):
-        #on button press we will see if the mouse is over us and store some data
-        if event.inaxes != self.line.axes: return
-        if DraggableLine.lock is not None: return
-        contains, attrd = self.line.contains(event)
-        if not contains: return
-
-        x0 = self.line.get_xdata()[0],
-        self.press = x0, event.xdata, event.ydata
-        DraggableLine.lock = self
-
-        # draw everything but the selected rectangle and store the pixel buffer
-        canvas = self.line.figure.canvas
-        axes = self.line.axes
-        self.line.set_animated(True)
-        canvas.draw()
-        self.background = canvas.copy_from_bbox(self.line.axes.bbox)
-
-        # now redraw just the rectangle
-        axes.draw_artist(self.line)
-
-        # and blit just the redrawn area
-        canvas.blit(axes.bbox)
-
-
-    def get_xpos(self):
-        """
-        Returns the current x position of the line.
-        """
-        return self.line.get_xdata()[0]
-    
-    
-    def set_xpos(self,x_pos):
-        """
-        Sets the current x position of the line and redraws it.
-        """
-        self.line.set_xdata([x_pos]*2)
-        self.line.axes.redraw_in_frame()
-        
-    
-    def on_redraw(self, event):
-        #reset the line's ylims so that you can't zoom to outside the size of the line
-        self.line.set_ydata(self.line.axes.get_ylim())
-        
-        canvas = self.line.figure.canvas
-        axes = self.line.axes        
-        
-        # restore the background region
-        canvas.restore_region(self.background)
-
-        # redraw just the current rectangle
-        axes.draw_artist(self.line)
-
-        # blit just the redrawn area
-        canvas.blit(axes.bbox)
-    
-    
-    def on_motion(self, event):
-        #on motion we will move the rect if the mouse is over us
-        if DraggableLine.lock is not self:
-            return
-        if event.inaxes != self.line.axes: return
-        x0, xpress, ypress = self.press
-        dx = event.xdata - xpress
-        dy = event.ydata - ypress
-
-        self.line.set_xdata([x0[0] + dx]*2)
-        self.line.set_ydata(self.line.axes.get_ylim())
-        self.line.set_linestyle('--')
-
-        canvas = self.line.figure.canvas
-        axes = self.line.axes
-        # restore the background region
-        canvas.restore_region(self.background)
-
-        # redraw just the current rectangle
-        axes.draw_artist(self.line)
-
-        # blit just the redrawn area
-        canvas.blit(axes.bbox)
-
- 
-    def on_release(self, event):
-        #on release we reset the press data
-        if DraggableLine.lock is not self:
-            return
-        
-        self.line.set_linestyle('-')
-        self.press = None
-        DraggableLine.lock = None
-
-        # turn off the rect animation property and reset the background
-        self.line.set_animated(False)
-        self.background = None
-
-        # redraw the full figure
-        self.line.figure.canvas.draw()
-        
-        if self.callback is not None:
-            self.callback(event.xdata)
 
+from FTIRbackgroundsubtract.compute import ProcessedScan, find_residuals, load_ftir_file
+from FTIRbackgroundsubtract.compute.cache import get_default_cache
+from FTIRbackgroundsubtract.compute.bands import PRESETS
+from FTIRbackgroundsubtract.compute.concentration import SPECIES, concentration
+from FTIRbackgroundsubtract.compute.absorptivity import get_default_database
+from FTIRbackgroundsubtract.livefit import LiveFitter
+from FTIRbackgroundsubtract.plotting import (BackgroundFitDisplay, BackgroundRangeSelector,
+                                             BackgroundSubtractedDisplay, get_view_lims, redraw_axes)
 
+#find_residuals and load_ftir_file used to be defined here, and are still
+#imported from here by older scripts
+__all__ = ['FileChooser', 'BackgroundFittingControls', 'ControlWindow', 'PeakHeightDisplay',
+           'PlotManager', 'find_residuals', 'load_ftir_file']
 
 class FileChooser(wx.Frame):
     def __init__(self):
@@ -228,7 +92,7 @@ class FileChooser(wx.Frame):
             return
              
         wx.YieldIfNeeded()
-        wavenum, intensity = load_ftir_file(filename)
+        wavenum, intensity = get_default_cache().load(filename)
         print("loaded ",filename)
         scan = ProcessedScan(wavenum, intensity)
         
@@ -260,6 +124,7 @@ class BackgroundFittingControls(wx.Panel):
         #define calculate wt% button
         self.calculate_wtper_sizer = wx.BoxSizer(wx.HORIZONTAL)
         self.calculate_wtper_button = wx.Button(self, wx.ID_ANY, "Calculate wt%")
+        self.wtper_result = wx.StaticText(self, wx.ID_ANY, "")
 
         #define suggestion buttons
         self.suggestions = wx.BoxSizer(wx.HORIZONTAL)
@@ -272,6 +137,8 @@ class BackgroundFittingControls(wx.Panel):
         #define Fit Order text box
         self.fit_order_sizer = wx.BoxSizer(wx.HORIZONTAL)
         self.fit_order_txtbox = wx.TextCtrl(self, wx.ID_ANY, size=(50, -1))
+        self.live_preview_chkbox = wx.CheckBox(self, wx.ID_ANY, "Live Preview")
+        self.live_preview_chkbox.SetValue(True)
 
         #define absorption coefficient text box and search icon
         self.to_calc_wtper_sizer = wx.BoxSizer(wx.HORIZONTAL)
@@ -279,6 +146,10 @@ class BackgroundFittingControls(wx.Panel):
         searchbmp = wx.Bitmap("img/search.bmp", wx.BITMAP_TYPE_BMP)
         self.abs_coeff_search_button = wx.BitmapButton(self, wx.ID_ANY, searchbmp)#, size=(10,-1))
 
+        #define species choice
+        self.species_choice = wx.Choice(self, wx.ID_ANY, choices=list(SPECIES))
+        self.species_choice.SetStringSelection('H2O')
+
         #define thickness text box
         self.thickness_txtbox = wx.TextCtrl(self, wx.ID_ANY, value="100", size=(50, -1))
 
@@ -316,6 +187,8 @@ class BackgroundFittingControls(wx.Panel):
         self.fit_order_sizer.AddSpacer(5)
         self.fit_order_sizer.Add(wx.StaticText(self, wx.ID_ANY,"Fit Order:"),0, wx.ALIGN_CENTER_VERTICAL)
         self.fit_order_sizer.Add(self.fit_order_txtbox,0, wx.ALIGN_CENTER_VERTICAL)
+        self.fit_order_sizer.AddSpacer(10)
+        self.fit_order_sizer.Add(self.live_preview_chkbox,0, wx.ALIGN_CENTER_VERTICAL)
         self.vsizer.Add(self.excl_hsizer,1,wx.ALIGN_CENTER_HORIZONTAL) 
         #self.vsizer.AddSpacer(5)
         self.vsizer.Add(self.fit_order_sizer,0,wx.ALIGN_CENTER_HORIZONTAL)
@@ -325,6 +198,11 @@ class BackgroundFittingControls(wx.Panel):
         self.vsizer.AddSpacer(5)
         self.vsizer.Add(self.for_calc_label,0,wx.ALIGN_LEFT)
 
+        #Add species label and choice
+        self.to_calc_wtper_sizer.AddSpacer(5)
+        self.to_calc_wtper_sizer.Add(wx.StaticText(self, wx.ID_ANY,"Species:"),0, wx.ALIGN_CENTER_VERTICAL)
+        self.to_calc_wtper_sizer.Add(self.species_choice,0, wx.ALIGN_CENTER_VERTICAL)
+
         #Add absorption coefficient label and text box
         self.to_calc_wtper_sizer.AddSpacer(5)
         self.to_calc_wtper_sizer.Add(wx.StaticText(self, wx.ID_ANY,"Absoprtion Coeff:"),0, wx.ALIGN_CENTER_VERTICAL)
@@ -353,15 +231,19 @@ class BackgroundFittingControls(wx.Panel):
         #Add calculate wt% buttons
         self.calculate_wtper_sizer.AddSpacer(5)
         self.calculate_wtper_sizer.Add(self.calculate_wtper_button,0,wx.ALIGN_CENTER_VERTICAL)
+        self.calculate_wtper_sizer.AddSpacer(10)
+        self.calculate_wtper_sizer.Add(self.wtper_result,0,wx.ALIGN_CENTER_VERTICAL)
         self.vsizer.Add(self.calculate_wtper_sizer,2,wx.ALIGN_CENTER_HORIZONTAL)
         
         # add event for calculate_wtper_button
         wx.EVT_BUTTON(self, self.calculate_wtper_button.GetId(), self.on_calc_wtper)
+        wx.EVT_BUTTON(self, self.abs_coeff_search_button.GetId(), self.on_abs_coeff_search)
         self.SetSizer(self.vsizer)
         self.vsizer.Fit(self)
         self.SetAutoLayout(1)
         self.update(self.plot_manager.get_current_scan())
         self.plot_manager.register_callback(self.update)
+        self.plot_manager.register_preview_callback(self.on_preview)
         
         #Add Suggested Limits text
         self.suggestion_label = wx.StaticText(self, label="Suggested Limits:")
@@ -398,6 +280,7 @@ class BackgroundFittingControls(wx.Panel):
         wx.EVT_BUTTON(self, self.suggest4500_button.GetId(), self.on_suggest4500)
         wx.EVT_BUTTON(self, self.suggest5200_button.GetId(), self.on_suggest5200)
         wx.EVT_BUTTON(self, self.suggestCO3_2_button.GetId(), self.on_suggestCO3_2)
+        wx.EVT_CHECKBOX(self, self.live_preview_chkbox.GetId(), self.on_live_preview)
         self.SetSizer(self.vsizer)
         self.vsizer.Fit(self)
         self.SetAutoLayout(1)
@@ -415,7 +298,12 @@ class BackgroundFittingControls(wx.Panel):
         scan.excl_highlim = float(self.upper_excl_txtbox.GetValue())
         
         scan.bkgd_fit_order = int(self.fit_order_txtbox.GetValue())
-        scan.calculate()
+        try:
+            scan.calculate()
+        except ValueError as e:
+            wx.EndBusyCursor()
+            wx.MessageBox(str(e), "FTIR Background Subtract", wx.ICON_ERROR)
+            return
         self.plot_manager.update(scan)
         wx.EndBusyCursor()
     
@@ -468,70 +356,42 @@ class BackgroundFittingControls(wx.Panel):
         self.lower_excl_txtbox.ChangeValue(str(round(lower_lim,2)))
         self.upper_excl_txtbox.ChangeValue(str(round(upper_lim,2)))
 
-    def on_suggest(self, evt):
-
-        lower_lim, upper_lim = self.plot_manager.bkgd_selector.get_lims()
+    def on_live_preview(self, evt):
+        self.plot_manager.set_live_preview(self.live_preview_chkbox.GetValue())
 
-        self.lower_lim_txtbox.ChangeValue(str(2400))
-        self.upper_lim_txtbox.ChangeValue(str(4000))
+    def on_preview(self, lims):
+        #show the limits of the live preview, so that Apply will use them
+        self.lower_lim_txtbox.ChangeValue(str(round(lims[0],2)))
+        self.upper_lim_txtbox.ChangeValue(str(round(lims[1],2)))
+        self.lower_excl_txtbox.ChangeValue(str(round(lims[2],2)))
+        self.upper_excl_txtbox.ChangeValue(str(round(lims[3],2)))
 
-        lower_lim, upper_lim = self.plot_manager.bkgd_selector.get_excl_lims()       
-        self.lower_excl_txtbox.ChangeValue(str(2590))
-        self.upper_excl_txtbox.ChangeValue(str(3788))
+    def set_preset(self, name):
+        """
+        Fills in the limits and fit order of one of the suggested bands
+        (see FTIRbackgroundsubtract.compute.bands.PRESETS).
+        """
+        band = PRESETS[name]
+        self.lower_lim_txtbox.ChangeValue(str(band.bkgd_lowlim))
+        self.upper_lim_txtbox.ChangeValue(str(band.bkgd_highlim))
+        self.lower_excl_txtbox.ChangeValue(str(band.excl_lowlim))
+        self.upper_excl_txtbox.ChangeValue(str(band.excl_highlim))
+        self.fit_order_txtbox.ChangeValue(str(band.bkgd_fit_order))
 
-        self.fit_order_txtbox.ChangeValue(str(1))
+    def on_suggest(self, evt):
+        self.set_preset('3500')
 
     def on_suggestCO3(self, evt):
-    
-        lower_lim, upper_lim = self.plot_manager.bkgd_selector.get_lims()
-
-        self.lower_lim_txtbox.ChangeValue(str(1242))
-        self.upper_lim_txtbox.ChangeValue(str(2038))
-
-        lower_lim, upper_lim = self.plot_manager.bkgd_selector.get_excl_lims()       
-        self.lower_excl_txtbox.ChangeValue(str(1362))
-        self.upper_excl_txtbox.ChangeValue(str(1770))
-
-        self.fit_order_txtbox.ChangeValue(str(3))
+        self.set_preset('CO3')
 
     def on_suggest5200(self, evt):
-    
-        lower_lim, upper_lim = self.plot_manager.bkgd_selector.get_lims()
-
-        self.lower_lim_txtbox.ChangeValue(str(4710))
-        self.upper_lim_txtbox.ChangeValue(str(5960))
-
-        lower_lim, upper_lim = self.plot_manager.bkgd_selector.get_excl_lims()       
-        self.lower_excl_txtbox.ChangeValue(str(5138))
-        self.upper_excl_txtbox.ChangeValue(str(5280))
-
-        self.fit_order_txtbox.ChangeValue(str(3))
+        self.set_preset('5200')
 
     def on_suggest4500(self, evt):
-    
-        lower_lim, upper_lim = self.plot_manager.bkgd_selector.get_lims()
-
-        self.lower_lim_txtbox.ChangeValue(str(4050))
-        self.upper_lim_txtbox.ChangeValue(str(5072))
-
-        lower_lim, upper_lim = self.plot_manager.bkgd_selector.get_excl_lims()       
-        self.lower_excl_txtbox.ChangeValue(str(4300))
-        self.upper_excl_txtbox.ChangeValue(str(4600))
-
-        self.fit_order_txtbox.ChangeValue(str(3))
+        self.set_preset('4500')
 
     def on_suggestCO3_2(self, evt):
-    
-        lower_lim, upper_lim = self.plot_manager.bkgd_selector.get_lims()
-
-        self.lower_lim_txtbox.ChangeValue(str(1499))
-        self.upper_lim_txtbox.ChangeValue(str(2339))
-
-        lower_lim, upper_lim = self.plot_manager.bkgd_selector.get_excl_lims()       
-        self.lower_excl_txtbox.ChangeValue(str(1551))
-        self.upper_excl_txtbox.ChangeValue(str(2058))
-
-        self.fit_order_txtbox.ChangeValue(str(5))
+        self.set_preset('CO3 (2)')
 
     def on_applysuggested(self, evt):
 
@@ -544,24 +404,76 @@ class BackgroundFittingControls(wx.Panel):
         scan.excl_highlim = float(self.upper_excl_txtbox.GetValue())
         
         scan.bkgd_fit_order = int(self.fit_order_txtbox.GetValue())
-        scan.calculate()
+        try:
+            scan.calculate()
+        except ValueError as e:
+            wx.EndBusyCursor()
+            wx.MessageBox(str(e), "FTIR Background Subtract", wx.ICON_ERROR)
+            return
         self.plot_manager.update(scan)
         wx.EndBusyCursor()  
 
-    def on_calc_wtper(self, evt):
-        wx.BeginBusyCursor()
+    def on_abs_coeff_search(self, evt):
+        #offer the published absorption coefficients of bands inside the
+        #excluded (i.e. peak) region, or all of them if there are none
         scan = self.plot_manager.get_current_scan()
-        peak_height = g_peak_height
+        database = get_default_database()
+        entries = database.in_range(scan.excl_lowlim, scan.excl_highlim)
+        if not entries:
+            entries = database.entries
+
+        dlg = wx.SingleChoiceDialog(self, "Published absorption coefficients:",
+                                    "Absorption Coefficient", [e.describe() for e in entries])
+        try:
+            if dlg.ShowModal() != wx.ID_OK:
+                return
+            entry = entries[dlg.GetSelection()]
+        finally:
+            dlg.Destroy()
+
+        composition = None
+        if entry.formula is not None:
+            dlg = wx.TextEntryDialog(self, "%s wt%% of the glass, separated by commas:"
+                                     % ", ".join(entry.requires), "Glass Composition")
+            try:
+                if dlg.ShowModal() != wx.ID_OK:
+                    return
+                values = dlg.GetValue().split(',')
+            finally:
+                dlg.Destroy()
+            try:
+                composition = dict(zip(entry.requires, [float(v) for v in values]))
+            except ValueError:
+                composition = {}
+        try:
+            epsilon = float(entry.evaluate(composition))
+        except ValueError as e:
+            wx.MessageBox(str(e), "FTIR Background Subtract", wx.ICON_ERROR)
+            return
 
-        absorption_coeff = float(self.abs_coeff_txtbox.GetValue())
-        thickness_um = float(self.thickness_txtbox.GetValue())
-        thickness_cm = thickness_um * 0.0001
-        density_g_per_L = float(self.density_txtbox.GetValue())
+        self.abs_coeff_txtbox.ChangeValue(str(round(epsilon, 3)))
+        self.species_choice.SetStringSelection(entry.species)
 
-        # TODO add dropdown for species and use particular MW here instead of 18.08
-        conc = (100.0 * 18.08 * peak_height) / (thickness_cm * density_g_per_L * absorption_coeff)
-        print(conc)
-        wx.EndBusyCursor() 
+    def on_calc_wtper(self, evt):
+        metrics = self.plot_manager.get_peak_metrics()
+        if metrics is None or numpy.isnan(metrics.height):
+            wx.MessageBox("Fit a background before calculating the concentration",
+                          "FTIR Background Subtract", wx.ICON_ERROR)
+            return
+        try:
+            absorption_coeff = float(self.abs_coeff_txtbox.GetValue())
+            thickness_um = float(self.thickness_txtbox.GetValue())
+            density_g_per_L = float(self.density_txtbox.GetValue())
+        except ValueError:
+            wx.MessageBox("The absorption coefficient, thickness and density must be numbers",
+                          "FTIR Background Subtract", wx.ICON_ERROR)
+            return
+
+        species = self.species_choice.GetStringSelection()
+        conc = concentration(metrics.height, thickness_um, density_g_per_L, absorption_coeff,
+                             species=species)
+        self.wtper_result.SetLabel("%s: %.4g wt%%" % (species, conc))
+        self.vsizer.Layout()
 
 
 class ControlWindow(wx.Frame):
@@ -599,223 +511,46 @@ class ControlWindow(wx.Frame):
     
     
     def on_close(self,evnt):
+        self.plot_manager.close()
         plt.close()
         self.Destroy()
         
     def on_fig_close(self,evnt):
+        self.plot_manager.close()
         self.Destroy()
 
 
 
 
-class ProcessedScan:
-    def __init__(self, wavenum, intensity, bkgd_fit_order=1, bkgd_threshold=5.0):
-        self.__is_calculated = False
-        
-        self.angles = wavenum   
-        self.col_amount = intensity
-        
-        self.angle_err = numpy.ones_like(wavenum)*5
-        self.col_err = numpy.abs((intensity/100.0)*5)
-        
-        self.bkgd_lowlim = wavenum[-1]
-        self.bkgd_highlim = wavenum[0]
-        self.excl_lowlim = numpy.median(wavenum)
-        self.excl_highlim = numpy.median(wavenum)
-        
-        #background fitting parameters
-        self.bkgd_fit_order = bkgd_fit_order
-        self.bkgd_threshold = bkgd_threshold
-        self.manual_bkgd = True
-   
-    
-    def calculate(self):    
-        self.__calculate_bkgd()
-        return self
-    
-    def plot_bkgd_fit(self, ax):
-        
-        ignored = list(zip(*self.bkgd_ignored_pts))
-        if ignored:
-            ax.errorbar(ignored[0], ignored[1], ignored[3], ignored[2], 'r+')
-        
-        #subplot_calc.errorbar(not_bkgd_angles,not_bkgd_col_amounts, not_bkgd_col_err, not_bkgd_angle_err,'g+')        
-        ax.errorbar(self.angles[self.bkgd_idxs], self.col_amount[self.bkgd_idxs], self.col_err[self.bkgd_idxs], self.angle_err[self.bkgd_idxs], 'b+')
-        
-        x = numpy.linspace(self.angles[self.bkgd_idxs[0][0]],self.angles[self.bkgd_idxs[0][-1]],2000 )
-        ax.plot(x, [self.bkgd_func(i) for i in x], 'm-', linewidth=2)
-   
-   
-      
-    def __calculate_bkgd(self):
-        
-        #don't allow the background to be bigger than the scan data
-        if self.bkgd_lowlim < min(self.angles[0], self.angles[-1]):
-            self.bkgd_lowlim = min(self.angles[0], self.angles[-1]) 
-        
-        if self.bkgd_highlim > max(self.angles[0], self.angles[-1]):
-            self.bkgd_highlim = max(self.angles[0], self.angles[-1])        
-        
-        is_lower_bkgd = self.angles > self.bkgd_lowlim
-        is_higher_bkgd = self.angles < self.bkgd_highlim
-        bkgd_mask = numpy.logical_and(is_lower_bkgd, is_higher_bkgd)
-        
-        is_lower_excl = self.angles > self.excl_lowlim
-        is_higher_excl = self.angles < self.excl_highlim
-        excl_mask = numpy.logical_and(is_lower_excl,is_higher_excl)
-        
-        self.bkgd_mask = numpy.logical_and(bkgd_mask, numpy.logical_not(excl_mask))
-        
-        
-        bkgd_idxs = numpy.where(self.bkgd_mask)
-
-        
-        #fit a polynomial through the background
-        ignored_pts = []
-        
-        while True:
-            bkgd_angles = self.angles[bkgd_idxs]
-            bkgd_col_amounts = self.col_amount[bkgd_idxs]
-            bkgd_angle_err = self.angle_err[bkgd_idxs]
-            bkgd_col_err = self.col_err[bkgd_idxs]
-            
-            polyfit_params = numpy.polyfit(bkgd_angles, bkgd_col_amounts, self.bkgd_fit_order)
-            bkgd_function = numpy.poly1d(polyfit_params)
-                 
-            #calculate the residuals - ignoring those that are within error
-            resid = find_residuals(bkgd_angles, bkgd_col_amounts, bkgd_angle_err, bkgd_col_err, bkgd_function)
-            
-            if len(numpy.nonzero(resid)[0]) == 0:
-                break
-            
-            #remove the point with the greatest residual from the fit
-            idx_to_skip = bkgd_idxs[0][numpy.argmax(resid)]
-            ignored_pts.append((self.angles[idx_to_skip], self.col_amount[idx_to_skip], self.angle_err[idx_to_skip], self.col_err[idx_to_skip]))
-            bkgd_idxs = (bkgd_idxs[0][numpy.where(bkgd_idxs[0] != idx_to_skip)],)
-        
-        #store the calculated background for all angles
-        self.bkgd_func = bkgd_function
-        self.bkgd_ignored_pts = ignored_pts
-        self.bkgd_idxs = bkgd_idxs
-
-
-def find_residuals(x, y, x_err, y_err, func):
-    """
-    Calculates the absolute distances of a data series from a trend line.
-    However, any distances that are within the error bars are set 
-    to zero. This makes it easy to see if a trend line fits some data within
-    experimental error. 
-    
-    * x - numpy array of x data
-    * y - numpy array of corresponding y data
-    * x_err - absolute error in x direction (x +- x_err)
-    * y_err - absolute error in y direction (y +- y_err)
-    * func - a Python function that describes the trendline such that y_trend = func(x)
-             where x is a single x value.
-    """
-    #convert func to numpy ufunc
-    fit_func = numpy.frompyfunc(func, 1, 1)
-    
-    x_mins = x - x_err
-    x_maxs = x + x_err
-    
-    #evaluate the distance between the data and the trendline at the extremes of
-    #the x error.
-    resid_mins = numpy.abs(y - fit_func(x_mins))
-    resid_maxs = numpy.abs(y - fit_func(x_maxs))
-    
-    #get the smallest distance of each point from the fit line
-    resid = numpy.minimum(resid_mins, resid_maxs)
-    
-    #set residuals that are within the error bars to zero
-    resid[numpy.where(resid < y_err)] = 0
-    
-    return resid
-
-
-class BackgroundFitDisplay:
-    def __init__(self, ax):
-        self.ax = ax
-        self.ax.invert_xaxis()
-    
-    def update(self, scan):
-        self.ax.clear()
-        scan.plot_bkgd_fit(self.ax)
-
-        low_idx = numpy.argmin(numpy.abs(scan.angles-scan.bkgd_lowlim))
-        high_idx = numpy.argmin(numpy.abs(scan.angles-scan.bkgd_highlim))
-
-        wavenum = scan.angles[low_idx:high_idx]
-        intensity = scan.col_amount[low_idx:high_idx]
-        
-        self.ax.plot(wavenum, intensity, 'k-')
-        
-        
-class BackgroundSubtractedDisplay:
+class PeakHeightDisplay(BackgroundSubtractedDisplay):
     """
-    Updates to the background subtracted subplot
+    Updates to the background subtracted subplot, labelled with the peak
+    height, area and FWHM
     """
     def __init__(self, ax):
-        self.ax = ax
-        self.ax.invert_xaxis()
+        BackgroundSubtractedDisplay.__init__(self, ax)
+        self.text = self.ax.text(0, 0, "")
+        self.metrics = None
     
     def update(self, scan):
-        self.ax.clear()
-        low_idx = numpy.argmin(numpy.abs(scan.angles-scan.bkgd_lowlim))
-        high_idx = numpy.argmin(numpy.abs(scan.angles-scan.bkgd_highlim))
-        wavenum = scan.angles[low_idx:high_idx]
-        intens = scan.col_amount[low_idx:high_idx] - scan.bkgd_func(wavenum)
-
-        global g_peak_height # I know I'm not supposed to but too bad
-        g_peak_height = round(max(intens), 5)
+        if not BackgroundSubtractedDisplay.update(self, scan):
+            return False
+        wavenum, intens = self.lod_line.get_data()
 
-        peak_height = g_peak_height
-        x_loc = 0.6 * (max(wavenum) - min(wavenum)) + min(wavenum)
-        y_loc = 0.8 * peak_height
-        peak_string = "Peak height: " + str(peak_height)
+        self.metrics = scan.get_peak_metrics()
+        x_loc = 0.6 * (numpy.max(wavenum) - numpy.min(wavenum)) + numpy.min(wavenum)
+        y_loc = 0.8 * self.metrics.height
+        peak_string = "Peak height: %.5f\nArea: %.4g\nFWHM: %.4g" % (
+            self.metrics.height, self.metrics.area, self.metrics.fwhm)
 
-        self.ax.text(x=x_loc, y=y_loc, s=peak_string)
-        self.ax.plot(wavenum, intens, 'g-')
-        self.ax.axhline(y=0, color = 'r')
-
-class BackgroundRangeSelector:
-    def __init__(self, ax):
-        self.ax = ax
-        self.ax.invert_xaxis()
-        self.lim_line1 = None
-        self.lim_line2 = None
-        self.plot = None
-    
-    def update(self, scan):
-        self.ax.cla()
-        if self.lim_line1 is None:
-                self.lim_line1 = DraggableLine(scan.bkgd_lowlim, self.ax, color='g')
-                self.lim_line2 = DraggableLine(scan.bkgd_highlim, self.ax, color='g')
-                self.excl_line1 = DraggableLine(scan.excl_lowlim, self.ax, color='r')
-                self.excl_line2 = DraggableLine(scan.excl_highlim, self.ax, color='r')
-        else:
-            self.lim_line1.set_xpos(scan.bkgd_lowlim)
-            self.lim_line2.set_xpos(scan.bkgd_highlim)
-            self.excl_line1.set_xpos(scan.excl_lowlim)
-            self.excl_line2.set_xpos(scan.excl_highlim)
-
-        self.plot = self.ax.plot(scan.angles, scan.col_amount,'b-')
-        
-    def get_lims(self):
-        pos1 = self.lim_line1.get_xpos()
-        pos2 = self.lim_line2.get_xpos()
-        
-        return min(pos1,pos2), max(pos1,pos2)
-
-    def get_excl_lims(self):
-        pos1 = self.excl_line1.get_xpos()
-        pos2 = self.excl_line2.get_xpos()
-        
-        return min(pos1,pos2), max(pos1,pos2)
+        self.text.set_position((x_loc, y_loc))
+        self.text.set_text(peak_string)
+        return True
 
 class PlotManager:
     def __init__(self,scan):
         self.callbacks = []
+        self.preview_callbacks = []
         self.scan = scan
         #create the plotting window
         bkgd_select_ax = plt.subplot2grid((3,2), (0,0), colspan=2)
@@ -824,51 +559,106 @@ class PlotManager:
         bkgd_subtracted_ax = plt.subplot2grid((3,2), (2, 0), colspan=2)
         self.plots = []
         
-        self.bkgd_selector = BackgroundRangeSelector(bkgd_select_ax)
+        self.bkgd_selector = BackgroundRangeSelector(bkgd_select_ax, motion_callback=self.on_lims_moved)
         self.bkgd_selector.update(scan)
         self.plots.append(self.bkgd_selector)
         
         self.bkgd_fit = BackgroundFitDisplay(bkgd_fit_ax)
         self.plots.append(self.bkgd_fit)
         
-        self.bkgd_subtracted_plot = BackgroundSubtractedDisplay(bkgd_subtracted_ax)
+        self.bkgd_subtracted_plot = PeakHeightDisplay(bkgd_subtracted_ax)
         self.plots.append(self.bkgd_subtracted_plot)
         
+        #once the figure has been drawn, updates only need to redraw the
+        #axes that have changed
+        self.figure = bkgd_select_ax.figure
+        self.__drawn = False
+        self.figure.canvas.mpl_connect('draw_event', self.on_draw)
+        
+        #refit the background in a worker thread as the limits are dragged
+        self.live_preview = True
+        self.live_fitter = LiveFitter(scan, self.on_live_fit)
+        self.closed = False
+        
     def get_current_scan(self):
         return self.scan
 
+    def get_peak_metrics(self):
+        """
+        Returns the PeakMetrics of the current fit, or None if there isn't one.
+        """
+        return self.bkgd_subtracted_plot.metrics
+
     def show(self):    
         plt.show()
         
+    def on_draw(self, evnt):
+        self.__drawn = True
+        
     def register_callback(self, f):
         self.callbacks.append(f)
+    
+    def register_preview_callback(self, f):
+        """
+        Registers a function to be run with the (bkgd_lowlim, bkgd_highlim,
+        excl_lowlim, excl_highlim, bkgd_fit_order) tuple of each live preview
+        that is shown.
+        """
+        self.preview_callbacks.append(f)
+    
+    def set_live_preview(self, enabled):
+        self.live_preview = enabled
+        if not enabled:
+            self.live_fitter.cancel()
+    
+    def on_lims_moved(self, selector):
+        if self.live_preview and not self.closed:
+            self.live_fitter.request(*(selector.get_lims() + selector.get_excl_lims()))
+    
+    def on_live_fit(self, generation, lims, bkgd_func, error):
+        #this runs in the LiveFitter's thread, so hand over to the GUI thread
+        wx.CallAfter(self.show_preview, generation, lims, bkgd_func, error)
+    
+    def close(self):
+        """
+        Stops the live preview thread, when the window is closed. Previews
+        that are still queued for the GUI thread are then dropped.
+        """
+        if not self.closed:
+            self.closed = True
+            self.live_fitter.close()
+    
+    def show_preview(self, generation, lims, bkgd_func, error):
+        #drop results that have been superseded since they were posted, or
+        #that arrive after the window has gone
+        if self.closed or error is not None or not self.live_fitter.is_current(generation):
+            return
+        axes = [self.bkgd_fit.ax, self.bkgd_subtracted_plot.ax]
+        view_lims = get_view_lims(axes)
+        self.bkgd_fit.preview(self.scan, lims, bkgd_func)
+        self.bkgd_subtracted_plot.preview(self.scan, lims, bkgd_func)
+        redraw_axes(self.figure.canvas, axes, view_lims)
+        
+        for f in self.preview_callbacks:
+            f(lims)
              
     def update(self, scan):
         
         wx.BeginBusyCursor()
-        for p in self.plots:
-            p.update(scan)
-        
-        plt.draw()
+        #a preview that is still in progress mustn't replace the full fit
+        self.live_fitter.cancel()
+        if self.__drawn:
+            view_lims = get_view_lims(p.ax for p in self.plots)
+        else:
+            view_lims = None
+        changed = [p.ax for p in self.plots if p.update(scan)]
+        redraw_axes(self.figure.canvas, changed, view_lims)
         
         for f in self.callbacks:
             f(scan)
 
         wx.EndBusyCursor()
 
-def load_ftir_file(filename):
-
-    reader = csv.reader(open(filename, "rt"), dialect="excel") 
-
-    wavenumber = []
-    absorbance = []
-
-    for line in reader:
-        wavenumber.append(float(line[0]))
-        absorbance.append(float(line[1]))
-    
-    return numpy.array(wavenumber), numpy.array(absorbance)
-
 if __name__ == '__main__':
     app = wx.App()
 
@@ -15,13 +15,23 @@ setuptools.setup(
     url="https://github.com/kaylai/ftir-background-subtract",
     packages=setuptools.find_packages(),
     install_requires=[
-            'numpy',
+            'numpy>=1.20'],
+    extras_require={
+        'gui': [
             'matplotlib',
             'wxPython'],
+        'zstd': [
+            'zstandard']},
+    entry_points={
+        'console_scripts': [
+            'ftir-bkgd-batch = FTIRbackgroundsubtract.cli:main',
+            'ftir-bkgd-server = FTIRbackgroundsubtract.server:main',
+            'ftir-bkgd-map = FTIRbackgroundsubtract.cubemap:main',
+            'ftir-bkgd-watch = FTIRbackgroundsubtract.watch:main']},
     classifiers=[
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: MIT License",
         "Operating System :: OS Independent",
     ],
-    python_requires='>=3.6',
+    python_requires='>=3.8',
 )